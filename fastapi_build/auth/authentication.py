@@ -1,25 +1,44 @@
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from typing import Optional
 
 import jwt
 from fastapi import Request
 from jwt import InvalidTokenError
-from passlib.context import CryptContext
+from sqlalchemy import event
+from sqlalchemy.orm import Session, ORMExecuteState, object_session, make_transient_to_detached
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+from sqlalchemy.util.concurrency import in_greenlet, await_only
 
 from auth.base_authentication import BaseTokenAuthentication
-from config.settings import SECRET_KEY
+# 保留原有的导入路径
+from auth.hashers import pwd_context, verify_password, get_password_hash, averify_password, aget_password_hash  # noqa: F401
+from common.log import logger
+from common.ttl_cache import TTLCache
+from config.settings import SECRET_KEY, AUTH_CACHE_TTL, AUTH_CACHE_SIZE
 from models.user import User
 from exceptions.custom_exception import PermissionDenyError
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 ALGORITHM = "HS256"
 
+AUTH_CACHE_PREFIX = "auth_cache"
+# 各 worker 订阅的失效广播: "user:<id>", "user:*" 或 "token:<摘要>"
+INVALIDATE_CHANNEL = f"{AUTH_CACHE_PREFIX}:invalidate"
+# session.info 上的键, 本事务改动过的用户 id; ALL_USERS 表示批量语句改动了用户表
+CHANGED_USERS = "auth_changed_users"
+ALL_USERS = "*"
+# Redis 出错后这段时间(秒)内不再访问, 只用本进程的吊销记录
+REDIS_RETRY_SECONDS = 5
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# token 摘要 -> AuthEntry
+auth_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+# 本进程已知的吊销 token 摘要, 保留到 token 过期
+_revoked = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+_redis_down_until = 0.0
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -30,30 +49,293 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-def get_current_user(token: str):
+@dataclass(frozen=True)
+class AuthEntry:
+    payload: dict
+    user_id: int
+    # 用户的列值, 命中时重建 User
+    values: dict
+
+    def user(self) -> User:
+        """A detached User built from the snapshot, like one loaded by an already closed session."""
+        user = User.__mapper__.class_manager.new_instance()
+        # 与从数据库加载时一样直接写入 __dict__, 属性是已加载且未修改的状态
+        user.__dict__.update(self.values)
+        make_transient_to_detached(user)
+        return user
+
+
+def token_digest(token: str) -> str:
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+
+def _revoked_key(digest: str) -> str:
+    return f"{AUTH_CACHE_PREFIX}:revoked:{digest}"
+
+
+def decode_token(token: str) -> dict:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("user_id")
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except InvalidTokenError:
         raise PermissionDenyError("Invalid token")
-    user = User.objects.get_by_id(user_id)
+
+
+def _seconds_left(payload: dict) -> float:
+    exp = payload.get("exp")
+    return AUTH_CACHE_TTL if exp is None else min(AUTH_CACHE_TTL, exp - time.time())
+
+
+def _remember(digest: str, payload: dict, user: User, generation: int):
+    """Cache the loaded user unless an invalidation ran since ``generation`` was read."""
+    ttl = _seconds_left(payload)
+    if ttl > 0:
+        values = {column.key: getattr(user, column.key) for column in User.__mapper__.column_attrs}
+        auth_cache.set(digest, AuthEntry(payload, user.id, values), ttl=ttl, generation=generation)
+
+
+def _redis_available() -> bool:
+    return time.monotonic() >= _redis_down_until
+
+
+def _redis_failed(action: str):
+    global _redis_down_until
+    _redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+    logger.warning(f"auth cache redis unavailable, {action}")
+
+
+def _is_revoked(digest: str) -> bool:
+    if digest in _revoked:
+        return True
+    if not _redis_available():
+        return False
+    try:
+        from db.redis_client import r_cache
+
+        return bool(r_cache.exists(_revoked_key(digest)))
+    except Exception:
+        _redis_failed("check revoked token")
+        return False
+
+
+async def _ais_revoked(digest: str) -> bool:
+    if digest in _revoked:
+        return True
+    if not _redis_available():
+        return False
+    try:
+        from db.redis_client import aio_r_cache
+
+        return bool(await aio_r_cache.exists(_revoked_key(digest)))
+    except Exception:
+        _redis_failed("check revoked token")
+        return False
+
+
+def get_current_user(token: str):
+    digest = token_digest(token)
+    entry: AuthEntry = auth_cache.get(digest)
+    if entry is not None:
+        return entry.user()
+    # 在检查吊销和读取用户之前取, 期间的失效(用户改动/吊销)会让这次结果不写入缓存
+    generation = auth_cache.generation
+    payload = decode_token(token)
+    if _is_revoked(digest):
+        raise PermissionDenyError("Invalid token")
+    user = User.objects.get_by_id(payload.get("user_id"))
     if user is None:
         raise PermissionDenyError("用户不存在")
+    _remember(digest, payload, user, generation)
     return user
 
 
 async def aget_current_user(token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("user_id")
-    except InvalidTokenError:
+    """
+    Decoded payload and user are cached by token digest for ``AUTH_CACHE_TTL`` seconds, never past
+    the token's ``exp``. A hit returns a detached User rebuilt from the cached column values without
+    touching the database. Entries are dropped when the user row is changed or the token revoked, a
+    user loaded while such a change was applied is returned but not cached.
+    """
+    digest = token_digest(token)
+    entry: AuthEntry = auth_cache.get(digest)
+    if entry is not None:
+        return entry.user()
+    generation = auth_cache.generation
+    payload = decode_token(token)
+    if await _ais_revoked(digest):
         raise PermissionDenyError("Invalid token")
-    user = await User.objects.aget_by_id(user_id)
+    user = await User.objects.aget_by_id(payload.get("user_id"))
     if user is None:
         raise PermissionDenyError("用户不存在")
+    _remember(digest, payload, user, generation)
     return user
 
 
+def _apply_invalidation(message: str):
+    kind, _, value = message.partition(":")
+    if kind == "token":
+        auth_cache.pop(value)
+    elif value == ALL_USERS:
+        auth_cache.clear()
+    else:
+        auth_cache.pop_where(lambda entry: str(entry.user_id) == value)
+
+
+def _broadcast(messages: list[str]):
+    """Apply locally and publish to the other workers."""
+    for message in messages:
+        _apply_invalidation(message)
+    if not _redis_available():
+        return
+    try:
+        if in_greenlet():
+            # AsyncSession 提交时事件运行在 greenlet 中, 可以直接等待异步客户端
+            await_only(_apublish(messages))
+        else:
+            from db.redis_client import r_cache
+
+            for message in messages:
+                r_cache.publish(INVALIDATE_CHANNEL, message)
+    except Exception:
+        _redis_failed("invalidation only applied in this worker")
+
+
+async def _apublish(messages: list[str]):
+    from db.redis_client import aio_r_cache
+
+    for message in messages:
+        await aio_r_cache.publish(INVALIDATE_CHANNEL, message)
+
+
+def invalidate_user(user_id):
+    _broadcast([f"user:{user_id}"])
+
+
+def _revoke_args(token: str) -> tuple[str, Optional[int]]:
+    digest = token_digest(token)
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
+    except InvalidTokenError:
+        payload = {}
+    exp = payload.get("exp")
+    # 过期的 token 本身就会被拒绝, 吊销记录保留到 exp 即可; 没有 exp 的永久保留
+    seconds = max(1, int(exp - time.time()) + 1) if exp is not None else None
+    _revoked.set(digest, True, ttl=float("inf") if seconds is None else seconds)
+    return digest, seconds
+
+
+def revoke_token(token: str):
+    """Reject the token from now on in every worker, e.g. on logout."""
+    digest, seconds = _revoke_args(token)
+    try:
+        from db.redis_client import r_cache
+
+        r_cache.set(_revoked_key(digest), 1, ex=seconds)
+    except Exception:
+        _redis_failed("token only revoked in this worker")
+    _broadcast([f"token:{digest}"])
+
+
+async def arevoke_token(token: str):
+    digest, seconds = _revoke_args(token)
+    try:
+        from db.redis_client import aio_r_cache
+
+        await aio_r_cache.set(_revoked_key(digest), 1, ex=seconds)
+        await _apublish([f"token:{digest}"])
+    except Exception:
+        _redis_failed("token only revoked in this worker")
+    _apply_invalidation(f"token:{digest}")
+
+
+async def listen_invalidations():
+    """
+    Apply the invalidations published by other workers, started with the app (``middleware.startup``).
+    Messages may be missed while disconnected, so the whole cache is dropped on every (re)subscribe.
+    """
+    try:
+        from db.redis_client import aio_r_cache
+    except ImportError:
+        return
+    failures = 0
+    while True:
+        try:
+            async with aio_r_cache.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                auth_cache.clear()
+                failures = 0
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        data = message["data"]
+                        _apply_invalidation(data.decode() if isinstance(data, bytes) else data)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            failures += 1
+            if failures == 1:
+                logger.warning("auth cache invalidation listener disconnected, other workers' changes "
+                               "reach this worker after AUTH_CACHE_TTL")
+            # 断开期间缓存可能过期失效不了, 只用短 TTL 兜底
+            await asyncio.sleep(min(REDIS_RETRY_SECONDS * failures, 60))
+
+
+def _changed_users(session: Session) -> set:
+    return session.info.setdefault(CHANGED_USERS, set())
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _record_user_change(mapper, connection, target: User):
+    session = object_session(target)
+    if session is not None:
+        _changed_users(session).add(target.id)
+
+
+def _statement_user_ids(statement) -> Optional[set]:
+    """
+    Ids an update/delete statement is limited to by ``User.id == x`` or ``User.id.in_(...)`` in its
+    WHERE (``update_by_id`` / ``update_by_ids`` / ``delete_by_ids``), None when it may touch any row.
+    """
+    whereclause = statement.whereclause
+    if whereclause is None:
+        return None
+    if isinstance(whereclause, BooleanClauseList) and whereclause.operator is operators.and_:
+        clauses = whereclause.clauses
+    else:
+        clauses = [whereclause]
+    id_column = User.__table__.c.id
+    for clause in clauses:
+        if (not isinstance(clause, BinaryExpression) or not isinstance(clause.right, BindParameter)
+                or getattr(clause.left, "table", None) is not id_column.table
+                or getattr(clause.left, "key", None) != id_column.key):
+            continue
+        if clause.operator is operators.eq:
+            return {clause.right.effective_value}
+        if clause.operator is operators.in_op and clause.right.expanding:
+            return set(clause.right.effective_value)
+    return None
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _record_user_statement(orm_execute_state: ORMExecuteState):
+    if ((orm_execute_state.is_update or orm_execute_state.is_delete)
+            and orm_execute_state.bind_mapper is User.__mapper__):
+        user_ids = _statement_user_ids(orm_execute_state.statement)
+        # 不是按 id 限定的批量 update/delete 语句拿不到改动的 id, 清空整个缓存
+        _changed_users(orm_execute_state.session).update(user_ids if user_ids is not None else [ALL_USERS])
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session: Session):
+    user_ids = session.info.pop(CHANGED_USERS, None)
+    if user_ids:
+        _broadcast(["user:*"] if ALL_USERS in user_ids else [f"user:{user_id}" for user_id in user_ids])
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session: Session):
+    session.info.pop(CHANGED_USERS, None)
+
+
 class TokenAuthentication(BaseTokenAuthentication):
 
     async def authenticate(self, request: Request):
@@ -3,14 +3,16 @@
 # @Author : PinBar
 # @File : base_authentication.py
 import inspect
-from typing import TypeVar, Any, Union
+from typing import TypeVar, Any, Union, Optional, Callable, Sequence, Type
 
 from fastapi import Request
 from pydantic import BaseModel
 from fastapi.concurrency import run_in_threadpool
 
+from auth.base_permission import BasePermission
+from common import tracing
 from core.context import g
-from exceptions.custom_exception import AuthDenyError
+from exceptions.custom_exception import AuthDenyError, PermissionDenyError
 
 User = TypeVar("User", bound=Any)
 
@@ -29,6 +31,17 @@ async def aget_current_user(user_id) -> AnonymousUser:
 
 
 class BaseAuthentication:
+    """
+    ``blocking = False`` declares that ``authenticate_sync`` does no I/O, sync routes then run it on
+    the event loop instead of in the threadpool. A subclass overriding ``authenticate_sync`` is
+    blocking unless it sets ``blocking`` itself.
+    """
+    blocking = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "authenticate_sync" in cls.__dict__ and "blocking" not in cls.__dict__:
+            cls.blocking = True
 
     def __init__(self, name):
         self.name = name
@@ -36,7 +49,9 @@ class BaseAuthentication:
     def set_context(self, request: Request, user):
         g.user = user
         g.user_id = user.id
-        g.request = request
+        if g.request is None:
+            # 通常 RequestLogMiddleware 已经设置过
+            g.request = request
         request.state.user_id = user.id
         request.state.user = user
 
@@ -51,16 +66,21 @@ class BaseAuthentication:
         auth_func = self.authenticate if is_async else self.authenticate_sync
 
         async def run(request: Request):
-            if is_async:
-                user = await auth_func(request)
-            else:
-                user = await run_in_threadpool(auth_func, request)
+            with tracing.span(f"auth {self.__class__.__name__}"):
+                if is_async:
+                    user = await auth_func(request)
+                elif self.blocking:
+                    user = await run_in_threadpool(auth_func, request)
+                else:
+                    user = auth_func(request)
             self.set_context(request, user)
 
         return run
 
 
 class BaseTokenAuthentication(BaseAuthentication):
+    blocking = False
+
     def get_jwt_value(self, request: Request) -> str:
         token = request.headers.get('Authorization')
         if not token:
@@ -82,3 +102,85 @@ class BaseTokenAuthentication(BaseAuthentication):
     def authenticate_sync(self, request: Request):
         return AnonymousUser()
 
+
+def _overrides_call(cls: Type[BaseAuthentication]) -> bool:
+    return cls.__call__ is not BaseAuthentication.__call__
+
+
+def auth_dependency(authentication_classes: Sequence[Type[BaseAuthentication]],
+                    permission_classes: Sequence[Type[BasePermission]], func: Callable) -> Optional[Callable]:
+    """
+    One dependency running a route's authentication classes and then its permission classes, in
+    order, instead of a ``Depends`` for each.
+
+    Async routes await ``authenticate`` / ``has_permission``. Sync routes run the ``*_sync``
+    methods inline when every class is non-blocking, otherwise the whole chain runs in a single
+    threadpool call and the context is set again on the event loop (writes made in the worker
+    thread do not reach the request's context).
+
+    Authentication classes must not override ``__call__``, see ``auth_dependencies``.
+    """
+    authenticators = [cls(name='') for cls in authentication_classes]
+    permissions = [cls() for cls in permission_classes]
+    if not authenticators and not permissions:
+        return None
+
+    if inspect.iscoroutinefunction(func):
+        async def run(request: Request):
+            for authenticator in authenticators:
+                with tracing.span(f"auth {authenticator.__class__.__name__}"):
+                    user = await authenticator.authenticate(request)
+                authenticator.set_context(request, user)
+            for permission in permissions:
+                with tracing.span(f"permission {permission.__class__.__name__}"):
+                    allowed = await permission.has_permission(request)
+                if not allowed:
+                    raise PermissionDenyError()
+
+        return run
+
+    def check(request: Request) -> list:
+        users = []
+        for authenticator in authenticators:
+            with tracing.span(f"auth {authenticator.__class__.__name__}"):
+                user = authenticator.authenticate_sync(request)
+            authenticator.set_context(request, user)
+            users.append((authenticator, user))
+        for permission in permissions:
+            with tracing.span(f"permission {permission.__class__.__name__}"):
+                allowed = permission.has_permission_sync(request)
+            if not allowed:
+                raise PermissionDenyError()
+        return users
+
+    blocking = any(component.blocking for component in authenticators + permissions)
+
+    # 必须是 async 函数, FastAPI 会把同步的依赖放到线程池执行
+    async def run_sync(request: Request):
+        if not blocking:
+            check(request)
+            return
+        for authenticator, user in await run_in_threadpool(check, request):
+            authenticator.set_context(request, user)
+
+    return run_sync
+
+
+def auth_dependencies(authentication_classes: Sequence[Type[BaseAuthentication]],
+                      permission_classes: Sequence[Type[BasePermission]], func: Callable) -> list[Callable]:
+    """
+    Dependencies checking a route's authentication and permission classes, see ``auth_dependency``.
+
+    When an authentication class overrides ``__call__`` every authenticator of the route keeps its
+    own dependency, ``cls(name='')(func)``, so they still run in order, and the permissions are
+    checked by a combined dependency after them.
+    """
+    if any(_overrides_call(cls) for cls in authentication_classes):
+        dependencies = [cls(name='')(func) for cls in authentication_classes]
+        authorize = auth_dependency((), permission_classes, func)
+    else:
+        dependencies = []
+        authorize = auth_dependency(authentication_classes, permission_classes, func)
+    if authorize is not None:
+        dependencies.append(authorize)
+    return dependencies
@@ -8,6 +8,18 @@ from fastapi import Request
 
 
 class BasePermission:
+    """
+    Checked after authentication, ``g.user`` is set.
+
+    Views instantiate each class once per route without arguments (``perm`` is None) and call
+    ``has_permission`` for async routes, ``has_permission_sync`` for sync ones. A falsy result
+    rejects the request with a 403 (PermissionDenyError), raising an ApiError rejects it with that
+    error. ``__call__`` is not used by views, only by a ``Depends`` wired by hand.
+
+    Set ``blocking = False`` when ``has_permission_sync`` does no I/O, sync routes then check it
+    on the event loop instead of in the threadpool.
+    """
+    blocking = True
 
     def __init__(self, perm=None):
         self.perm = perm
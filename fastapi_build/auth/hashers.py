@@ -0,0 +1,130 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 23:30
+# @Author : PinBar
+# @File : hashers.py
+"""
+Password hashing off the event loop.
+
+bcrypt takes 100-300 ms of CPU per call. ``averify_password`` / ``aget_password_hash`` run it in a
+small process pool owned by this worker, so a login burst only queues behind itself. Jobs waiting
+or running are capped by ``PASSWORD_HASH_MAX_PENDING``, beyond that the call is rejected with a 503
+instead of piling up. This module is imported by the pool processes, keep its imports light.
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Callable
+
+from passlib.context import CryptContext
+
+from common import metrics
+from config.settings import PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, ADMISSION_RETRY_AFTER
+from exceptions.custom_exception import ServiceBusyError
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+password_hash_pending = metrics.Gauge("password_hash_pending", "Password hash jobs queued or running in the pool")
+password_hash_rejected_total = metrics.Counter("password_hash_rejected", "Password hash jobs rejected, pool full")
+
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+
+def _noop():
+    return None
+
+
+class HashPool:
+    """
+    Bounded ProcessPoolExecutor, created on first use in each worker.
+
+    Pool processes are spawned rather than forked, a fork of the server process would copy its
+    threads' locks (log queue, metrics and trace exporters) in whatever state they are in.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # 调用方持有 self._lock, 并发的 submit 只会创建一个池
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _replace_executor(self, broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        """Shut down a broken pool and create a new one, once however many submits saw it broken."""
+        with self._lock:
+            if self._executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            return self._get_executor()
+
+    def _done(self, future: Future):
+        # 在线程池的管理线程里回调
+        with self._lock:
+            self.pending -= 1
+            password_hash_pending.labels().set(self.pending)
+
+    def submit(self, func: Callable, *args) -> Future:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                password_hash_rejected_total.labels().inc()
+                raise ServiceBusyError(retry_after=ADMISSION_RETRY_AFTER)
+            self.pending += 1
+            password_hash_pending.labels().set(self.pending)
+            executor = self._get_executor()
+        try:
+            try:
+                future = executor.submit(func, *args)
+            except BrokenProcessPool:
+                # 池中进程异常退出后整个池不可用, 换一个新的
+                future = self._replace_executor(executor).submit(func, *args)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def warm_up(self):
+        """Start the pool processes ahead of the first login, called on startup."""
+        if self.workers > 0:
+            with self._lock:
+                executor = self._get_executor()
+            for _ in range(self.workers):
+                executor.submit(_noop)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+hash_pool = HashPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+
+async def _run(func: Callable, *args):
+    if hash_pool.workers <= 0:
+        from fastapi.concurrency import run_in_threadpool
+
+        return await run_in_threadpool(func, *args)
+    return await asyncio.wrap_future(hash_pool.submit(func, *args))
+
+
+async def averify_password(plain_password, hashed_password) -> bool:
+    return await _run(verify_password, plain_password, hashed_password)
+
+
+async def aget_password_hash(password) -> str:
+    return await _run(get_password_hash, password)
@@ -0,0 +1,415 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 23:50
+# @Author : PinBar
+# @File : permissions.py
+"""
+Permission sets resolved once per user.
+
+The project registers how a user's permission codes are read (usually user -> role -> permission
+tables) with ``set_permission_loader``. ``load_permissions`` / ``aload_permissions`` return them as
+a frozenset, cached for the request in ``g.extra_data``, per user in this worker for
+``PERMISSION_CACHE_TTL`` seconds and in Redis for the other workers, so a check on the hot path is
+a set lookup without SQL. Models holding role assignments are passed to ``watch_permission_models``,
+committing a change to them drops the affected users' sets in every worker. A set loaded while
+such a change was being applied is returned but not cached, locally or in Redis::
+
+    set_permission_loader(load_user_permissions, aload_user_permissions)
+    watch_permission_models(UserRole, RolePermission)
+
+    class OrderView(BaseView):
+        authentication_classes = [TokenAuthentication]
+        permissions_classes = [require("order.view")]
+"""
+import asyncio
+import json
+import time
+from typing import Callable, Iterable, Optional, Awaitable, Type
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import Session, ORMExecuteState, object_session
+from sqlalchemy.util.concurrency import in_greenlet, await_only
+
+from auth.base_permission import BasePermission
+from common.log import logger
+from common.ttl_cache import TTLCache
+from config.settings import PERMISSION_CACHE_TTL, PERMISSION_CACHE_SIZE
+from core.context import g
+
+PERMISSION_CACHE_PREFIX = "perm_cache"
+# 各 worker 订阅的失效广播: 用户 id 或 "*"
+INVALIDATE_CHANNEL = f"{PERMISSION_CACHE_PREFIX}:invalidate"
+# session.info 上的键, 本事务改动过权限的用户 id; ALL_USERS 表示无法确定用户
+CHANGED_USERS = "perm_changed_users"
+ALL_USERS = "*"
+# g.extra_data 上的键, 当前请求已加载的 (用户 id, 权限集合)
+REQUEST_KEY = "permissions"
+# Redis 出错后这段时间(秒)内不再访问, 只用本进程缓存
+REDIS_RETRY_SECONDS = 5
+# 版本号的过期时间(秒), 需要长于一次加载权限的耗时
+GENERATION_TTL = int(PERMISSION_CACHE_TTL) + 60
+# KEYS: 权限集合, 用户的版本号, 全部用户的版本号; ARGV: 权限集合, 加载前读到的两个版本号, 过期秒数
+# 加载期间版本号变了(有失效)就不写入, 否则会把失效前读到的旧集合写回 Redis
+SET_IF_CURRENT_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[2] and (redis.call('GET', KEYS[3]) or '0') == ARGV[3] then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[4])
+    return 1
+end
+return 0
+"""
+
+# 用户 id -> 权限集合
+permission_cache = TTLCache(PERMISSION_CACHE_SIZE, PERMISSION_CACHE_TTL)
+_redis_down_until = 0.0
+_watched_mappers = set()
+# Redis 客户端 -> 注册的 SET_IF_CURRENT_SCRIPT
+_scripts = {}
+
+
+def _no_permissions(user) -> Iterable[str]:
+    return getattr(user, "permissions", None) or ()
+
+
+_loader: Callable[[object], Iterable[str]] = _no_permissions
+_aloader: Optional[Callable[[object], Awaitable[Iterable[str]]]] = None
+
+
+def set_permission_loader(loader: Callable[[object], Iterable[str]],
+                          aloader: Callable[[object], Awaitable[Iterable[str]]] = None):
+    """
+    Register how the permission codes of a user are read. Async routes use ``aloader``, without
+    one ``loader`` runs in the threadpool. The default reads ``user.permissions`` if present.
+    """
+    global _loader, _aloader
+    _loader, _aloader = loader, aloader
+
+
+def _redis_key(user_id: str) -> str:
+    return f"{PERMISSION_CACHE_PREFIX}:user:{user_id}"
+
+
+def _generation_key(user_id: str) -> str:
+    """Incremented when the user's (or with ALL_USERS every user's) permissions are invalidated."""
+    return f"{PERMISSION_CACHE_PREFIX}:gen:{user_id}"
+
+
+def _set_script(client):
+    script = _scripts.get(client)
+    if script is None:
+        script = _scripts[client] = client.register_script(SET_IF_CURRENT_SCRIPT)
+    return script
+
+
+def _cache_keys(user_id: str) -> list[str]:
+    return [_redis_key(user_id), _generation_key(user_id), _generation_key(ALL_USERS)]
+
+
+def _parse(values: list) -> tuple[Optional[frozenset], list]:
+    value, *generations = values
+    return (None if value is None else frozenset(json.loads(value))), [generation or 0 for generation in generations]
+
+
+def _set_args(permissions: frozenset, generations: list) -> list:
+    return [json.dumps(sorted(permissions)), *generations, int(PERMISSION_CACHE_TTL) or 1]
+
+
+def _redis_available() -> bool:
+    return time.monotonic() >= _redis_down_until
+
+
+def _redis_failed(action: str):
+    global _redis_down_until
+    _redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+    logger.warning(f"permission cache redis unavailable, {action}")
+
+
+def _from_request(user_id: str) -> Optional[frozenset]:
+    extra_data = g.extra_data
+    if extra_data is not None:
+        cached = extra_data.get(REQUEST_KEY)
+        if cached is not None and cached[0] == user_id:
+            return cached[1]
+    return None
+
+
+def _to_request(user_id: str, permissions: frozenset):
+    extra_data = g.extra_data
+    if extra_data is not None:
+        extra_data[REQUEST_KEY] = (user_id, permissions)
+
+
+def _redis_get(user_id: str) -> tuple[Optional[frozenset], Optional[list]]:
+    """The cached set and the generations to pass to ``_redis_set``, (None, None) without Redis."""
+    if not _redis_available():
+        return None, None
+    try:
+        from db.redis_client import r_cache
+
+        return _parse(r_cache.mget(_cache_keys(user_id)))
+    except Exception:
+        _redis_failed("permissions loaded from the database")
+        return None, None
+
+
+def _redis_set(user_id: str, permissions: frozenset, generations: Optional[list]):
+    """Store the set unless the user was invalidated since ``generations`` were read."""
+    if generations is None or not _redis_available():
+        return
+    try:
+        from db.redis_client import r_cache
+
+        _set_script(r_cache)(keys=_cache_keys(user_id), args=_set_args(permissions, generations))
+    except Exception:
+        _redis_failed("permissions only cached in this worker")
+
+
+async def _aredis_get(user_id: str) -> tuple[Optional[frozenset], Optional[list]]:
+    if not _redis_available():
+        return None, None
+    try:
+        from db.redis_client import aio_r_cache
+
+        return _parse(await aio_r_cache.mget(_cache_keys(user_id)))
+    except Exception:
+        _redis_failed("permissions loaded from the database")
+        return None, None
+
+
+async def _aredis_set(user_id: str, permissions: frozenset, generations: Optional[list]):
+    if generations is None or not _redis_available():
+        return
+    try:
+        from db.redis_client import aio_r_cache
+
+        await _set_script(aio_r_cache)(keys=_cache_keys(user_id), args=_set_args(permissions, generations))
+    except Exception:
+        _redis_failed("permissions only cached in this worker")
+
+
+def load_permissions(user) -> frozenset:
+    """Permission codes of ``user``, empty without a user."""
+    if user is None:
+        return frozenset()
+    user_id = str(user.id)
+    permissions = _from_request(user_id)
+    if permissions is not None:
+        return permissions
+    if PERMISSION_CACHE_TTL:
+        permissions = permission_cache.get(user_id)
+        if permissions is None:
+            # 版本号都在加载之前读取, 加载期间发生的失效会让这次的结果不写入缓存
+            generation = permission_cache.generation
+            permissions, generations = _redis_get(user_id)
+            if permissions is None:
+                permissions = frozenset(_loader(user))
+                _redis_set(user_id, permissions, generations)
+            permission_cache.set(user_id, permissions, generation=generation)
+    else:
+        permissions = frozenset(_loader(user))
+    _to_request(user_id, permissions)
+    return permissions
+
+
+async def aload_permissions(user) -> frozenset:
+    if user is None:
+        return frozenset()
+    user_id = str(user.id)
+    permissions = _from_request(user_id)
+    if permissions is not None:
+        return permissions
+    if PERMISSION_CACHE_TTL:
+        permissions = permission_cache.get(user_id)
+        if permissions is None:
+            generation = permission_cache.generation
+            permissions, generations = await _aredis_get(user_id)
+            if permissions is None:
+                permissions = await _aload(user)
+                await _aredis_set(user_id, permissions, generations)
+            permission_cache.set(user_id, permissions, generation=generation)
+    else:
+        permissions = await _aload(user)
+    _to_request(user_id, permissions)
+    return permissions
+
+
+async def _aload(user) -> frozenset:
+    if _aloader is not None:
+        return frozenset(await _aloader(user))
+    return frozenset(await run_in_threadpool(_loader, user))
+
+
+class HasPermission(BasePermission):
+    """Allows users whose permission set contains every code in ``required``, see ``require``."""
+    required: frozenset = frozenset()
+
+    def has_permission_sync(self, request: Request) -> bool:
+        return self.required <= load_permissions(g.user)
+
+    async def has_permission(self, request: Request) -> bool:
+        return self.required <= await aload_permissions(g.user)
+
+
+def require(*codes: str) -> Type[HasPermission]:
+    """Permission class for ``permissions_classes`` / ``api_description(permission_classes=...)``."""
+    return type(f"Require[{','.join(codes)}]", (HasPermission,), {"required": frozenset(codes)})
+
+
+def _apply_invalidation(message: str):
+    if message == ALL_USERS:
+        permission_cache.clear()
+    else:
+        permission_cache.pop(message)
+
+
+def _purge(messages: list[str]):
+    from db.redis_client import r_cache
+
+    # 先增加版本号再删除, 正在加载的请求不会再把旧集合写回
+    with r_cache.pipeline(transaction=False) as pipe:
+        for message in messages:
+            pipe.incr(_generation_key(message))
+            pipe.expire(_generation_key(message), GENERATION_TTL)
+        pipe.execute()
+    if ALL_USERS in messages:
+        keys = list(r_cache.scan_iter(match=_redis_key("*")))
+    else:
+        keys = [_redis_key(user_id) for user_id in messages]
+    if keys:
+        r_cache.delete(*keys)
+    for message in messages:
+        r_cache.publish(INVALIDATE_CHANNEL, message)
+
+
+async def _apurge(messages: list[str]):
+    from db.redis_client import aio_r_cache
+
+    async with aio_r_cache.pipeline(transaction=False) as pipe:
+        for message in messages:
+            pipe.incr(_generation_key(message))
+            pipe.expire(_generation_key(message), GENERATION_TTL)
+        await pipe.execute()
+    if ALL_USERS in messages:
+        keys = [key async for key in aio_r_cache.scan_iter(match=_redis_key("*"))]
+    else:
+        keys = [_redis_key(user_id) for user_id in messages]
+    if keys:
+        await aio_r_cache.delete(*keys)
+    for message in messages:
+        await aio_r_cache.publish(INVALIDATE_CHANNEL, message)
+
+
+def _messages(user_ids: Iterable) -> list[str]:
+    user_ids = {str(user_id) for user_id in user_ids}
+    return [ALL_USERS] if ALL_USERS in user_ids else sorted(user_ids)
+
+
+def _broadcast(messages: list[str]):
+    """Apply locally, drop the Redis copies and publish to the other workers."""
+    for message in messages:
+        _apply_invalidation(message)
+    if not PERMISSION_CACHE_TTL or not _redis_available():
+        return
+    try:
+        if in_greenlet():
+            # AsyncSession 提交时事件运行在 greenlet 中, 可以直接等待异步客户端
+            await_only(_apurge(messages))
+        else:
+            _purge(messages)
+    except Exception:
+        _redis_failed("permission change only applied in this worker")
+
+
+def invalidate_permissions(*user_ids):
+    """Reload the permission sets of ``user_ids`` (of every user when none are given) in every worker."""
+    _broadcast(_messages(user_ids or [ALL_USERS]))
+
+
+async def ainvalidate_permissions(*user_ids):
+    messages = _messages(user_ids or [ALL_USERS])
+    for message in messages:
+        _apply_invalidation(message)
+    if not PERMISSION_CACHE_TTL or not _redis_available():
+        return
+    try:
+        await _apurge(messages)
+    except Exception:
+        _redis_failed("permission change only applied in this worker")
+
+
+async def listen_invalidations():
+    """
+    Apply the invalidations published by other workers, started with the app (``middleware.startup``).
+    Messages may be missed while disconnected, so the whole cache is dropped on every (re)subscribe.
+    """
+    try:
+        from db.redis_client import aio_r_cache
+    except ImportError:
+        return
+    failures = 0
+    while True:
+        try:
+            async with aio_r_cache.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                permission_cache.clear()
+                failures = 0
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        data = message["data"]
+                        _apply_invalidation(data.decode() if isinstance(data, bytes) else data)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            failures += 1
+            if failures == 1:
+                logger.warning("permission cache invalidation listener disconnected, other workers' changes "
+                               "reach this worker after PERMISSION_CACHE_TTL")
+            await asyncio.sleep(min(REDIS_RETRY_SECONDS * failures, 60))
+
+
+def _changed_users(session: Session) -> set:
+    return session.info.setdefault(CHANGED_USERS, set())
+
+
+def watch_permission_models(*models, user_id_attr: str = "user_id"):
+    """
+    Drop cached permission sets when rows of ``models`` are committed. Rows with a ``user_id_attr``
+    column (e.g. user -> role assignments) invalidate that user, old and new value; other rows
+    (e.g. role -> permission) and bulk update/delete statements invalidate every user.
+    """
+    for model in models:
+        per_user = hasattr(model, user_id_attr)
+
+        def record(mapper, connection, target, per_user=per_user):
+            session = object_session(target)
+            if session is None:
+                return
+            if not per_user:
+                _changed_users(session).add(ALL_USERS)
+                return
+            history = sa_inspect(target).attrs[user_id_attr].history
+            user_ids = {getattr(target, user_id_attr), *history.deleted}
+            _changed_users(session).update(user_id for user_id in user_ids if user_id is not None)
+
+        for name in ("after_insert", "after_update", "after_delete"):
+            event.listen(model, name, record)
+        _watched_mappers.add(sa_inspect(model))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _record_permission_statement(orm_execute_state: ORMExecuteState):
+    if ((orm_execute_state.is_update or orm_execute_state.is_delete)
+            and orm_execute_state.bind_mapper in _watched_mappers):
+        _changed_users(orm_execute_state.session).add(ALL_USERS)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session: Session):
+    user_ids = session.info.pop(CHANGED_USERS, None)
+    if user_ids:
+        _broadcast(_messages(user_ids))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session: Session):
+    session.info.pop(CHANGED_USERS, None)
@@ -0,0 +1,388 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 19:40
+# @Author : PinBar
+# @File : metrics.py
+import atexit
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+from typing import Sequence, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from config.settings import METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+# 文件头 8 字节记录已使用的长度, 之后每条记录: 4 字节 key 长度 + key(补齐到 8 字节) + 8 字节 double
+_HEADER = struct.Struct("Q")
+_KEY_LENGTH = struct.Struct("I")
+_INITIAL_SIZE = 64 * 1024
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+class _ValueStore:
+    """
+    Per-process table of float values.
+
+    Updates are a plain ``values[index] += amount`` on a Python list, a lost increment under a
+    rare GIL switch between sync pool threads is accepted for metrics. With ``METRICS_DIR`` set the
+    values are mirrored every ``METRICS_FLUSH_INTERVAL`` seconds by a daemon thread into the mmap'd
+    ``METRICS_DIR/<pid>.db``, which other workers read when serving ``/metrics``. A record is
+    visible to readers once the header length covers it.
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.lock = threading.Lock()
+        self.index: dict[str, int] = {}
+        self.keys: list[str] = []
+        self.values: list[float] = []
+        self.path = Path(METRICS_DIR) / f"{pid}.db" if METRICS_DIR else None
+        self.buffer: Optional[mmap.mmap] = None
+        # 每个值在 mmap 中的位置 (以 8 字节为单位)
+        self._offsets: list[int] = []
+        self._used = _HEADER.size
+        if self.path is not None:
+            self._map(_INITIAL_SIZE)
+            threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+            atexit.register(self.flush)
+
+    def _map(self, size: int):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        try:
+            if self.buffer is None:
+                # pid 复用时清掉旧文件的内容
+                os.ftruncate(fd, 0)
+            os.ftruncate(fd, size)
+            self.buffer = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._mmap_values = memoryview(self.buffer).cast("d")
+
+    def slot(self, key: str) -> int:
+        index = self.index.get(key)
+        if index is not None:
+            return index
+        with self.lock:
+            index = self.index.get(key)
+            if index is not None:
+                return index
+            if self.path is not None:
+                self._append_record(key)
+            self.keys.append(key)
+            self.values.append(0.0)
+            index = self.index[key] = len(self.values) - 1
+            return index
+
+    def _append_record(self, key: str):
+        encoded = key.encode("utf-8")
+        padded = len(encoded) + (-(_KEY_LENGTH.size + len(encoded)) % 8)
+        value_offset = self._used + _KEY_LENGTH.size + padded
+        end = value_offset + 8
+        if end > len(self.buffer):
+            self._map(max(len(self.buffer) * 2, end))
+        _KEY_LENGTH.pack_into(self.buffer, self._used, len(encoded))
+        self.buffer[self._used + _KEY_LENGTH.size:self._used + _KEY_LENGTH.size + len(encoded)] = encoded
+        struct.pack_into("d", self.buffer, value_offset, 0.0)
+        self._used = end
+        _HEADER.pack_into(self.buffer, 0, end)
+        self._offsets.append(value_offset // 8)
+
+    def flush(self):
+        # fork 出的子进程继承了 atexit 回调, 不能覆盖父进程的文件
+        if self.path is None or self.pid != os.getpid():
+            return
+        with self.lock:
+            mmap_values = self._mmap_values
+            for offset, value in zip(self._offsets, self.values):
+                mmap_values[offset] = value
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            if _store is not self:
+                return
+            self.flush()
+
+    def snapshot(self) -> dict[str, float]:
+        return dict(zip(self.keys, self.values))
+
+
+def read_values(data: bytes) -> dict[str, float]:
+    """Parse one process file into ``{key: value}``."""
+    values = {}
+    if len(data) < _HEADER.size:
+        return values
+    used = min(_HEADER.unpack_from(data, 0)[0], len(data))
+    offset = _HEADER.size
+    while offset + _KEY_LENGTH.size <= used:
+        length = _KEY_LENGTH.unpack_from(data, offset)[0]
+        key_start = offset + _KEY_LENGTH.size
+        value_offset = key_start + length + (-(_KEY_LENGTH.size + length) % 8)
+        if value_offset + 8 > used:
+            break
+        values[data[key_start:key_start + length].decode("utf-8")] = struct.unpack_from("d", data, value_offset)[0]
+        offset = value_offset + 8
+    return values
+
+
+_store: Optional[_ValueStore] = None
+_metrics: dict[str, "Metric"] = {}
+
+
+def get_store() -> _ValueStore:
+    global _store
+    if _store is None:
+        _store = _ValueStore(os.getpid())
+    return _store
+
+
+def _reset_after_fork():
+    # 预加载应用时 worker 从 master fork, 需要写自己的文件
+    global _store
+    _store = None
+    for metric in _metrics.values():
+        metric.children.clear()
+    _request_recorders.clear()
+    _in_progress_indexes.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _sample_key(metric: str, sample: str, labels: dict) -> str:
+    return json.dumps([metric, sample, labels], separators=(",", ":"))
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        if name in _metrics:
+            raise ValueError(f"Duplicated metric {name}")
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: dict[tuple, object] = {}
+        _metrics[name] = self
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            labels = dict(zip(self.labelnames, map(str, values)))
+            child = self.children[values] = self._child(get_store(), labels)
+        return child
+
+    def _child(self, store: _ValueStore, labels: dict):
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("store", "index")
+
+    def __init__(self, store: _ValueStore, index: int):
+        self.store = store
+        self.index = index
+
+    def inc(self, amount: float = 1):
+        self.store.values[self.index] += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1):
+        self.store.values[self.index] -= amount
+
+    def set(self, value: float):
+        self.store.values[self.index] = value
+
+
+class _HistogramChild:
+    __slots__ = ("store", "upper_bounds", "bucket_indexes", "sum_index")
+
+    def __init__(self, store: _ValueStore, upper_bounds: tuple, bucket_indexes: list, sum_index: int):
+        self.store = store
+        self.upper_bounds = upper_bounds
+        self.bucket_indexes = bucket_indexes
+        self.sum_index = sum_index
+
+    def observe(self, amount: float):
+        values = self.store.values
+        # 按桶分别计数 (不累加), 导出时再累加成 le 语义
+        values[self.bucket_indexes[bisect_left(self.upper_bounds, amount)]] += 1
+        values[self.sum_index] += amount
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _child(self, store, labels):
+        return _CounterChild(store, store.slot(_sample_key(self.name, "_total", labels)))
+
+
+class Gauge(Metric):
+    """Gauges of exited workers are dropped from ``/metrics``, counters and histograms are kept."""
+    type = "gauge"
+
+    def _child(self, store, labels):
+        return _GaugeChild(store, store.slot(_sample_key(self.name, "", labels)))
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.upper_bounds = tuple(sorted(buckets))
+
+    def _child(self, store, labels):
+        bucket_indexes = [
+            store.slot(_sample_key(self.name, "_bucket", {**labels, "le": _format_value(bound)}))
+            for bound in (*self.upper_bounds, float("inf"))
+        ]
+        sum_index = store.slot(_sample_key(self.name, "_sum", labels))
+        return _HistogramChild(store, self.upper_bounds, bucket_indexes, sum_index)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else f"{int(value)}.0"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _collect_values() -> dict[str, float]:
+    """Sum the values of every process. Files of exited workers (``.dead``) only contribute counters."""
+    if not METRICS_DIR:
+        return get_store().snapshot()
+    get_store().flush()
+    totals: dict[str, float] = defaultdict(float)
+    for path in Path(METRICS_DIR).glob("*"):
+        if path.suffix not in (".db", ".dead"):
+            continue
+        try:
+            values = read_values(path.read_bytes())
+        except OSError:
+            continue
+        for key, value in values.items():
+            if path.suffix == ".dead" and _metrics.get(json.loads(key)[0], Counter).type == "gauge":
+                continue
+            totals[key] += value
+    return totals
+
+
+def generate_latest() -> bytes:
+    """Render every metric in the Prometheus text exposition format."""
+    samples: dict[str, list] = defaultdict(list)
+    for key, value in _collect_values().items():
+        metric, sample, labels = json.loads(key)
+        samples[metric].append((sample, labels, value))
+    lines = []
+    for name, metric in sorted(_metrics.items()):
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        if metric.type != "histogram":
+            for sample, labels, value in sorted(samples.get(name, ()), key=lambda s: str(s[1])):
+                lines.append(f"{name}{sample}{_format_labels(labels)} {_format_value(value)}")
+            continue
+        series = defaultdict(lambda: {"buckets": {}, "sum": 0.0})
+        for sample, labels, value in samples.get(name, ()):
+            if sample == "_bucket":
+                le = labels.pop("le")
+                series[json.dumps(labels, sort_keys=True)]["buckets"][le] = value
+            else:
+                series[json.dumps(labels, sort_keys=True)]["sum"] = value
+        for labels_key, data in sorted(series.items()):
+            labels = json.loads(labels_key)
+            cumulative = 0.0
+            for bound in (*metric.upper_bounds, float("inf")):
+                le = _format_value(bound)
+                cumulative += data["buckets"].get(le, 0.0)
+                lines.append(f"{name}_bucket{_format_labels({**labels, 'le': le})} {_format_value(cumulative)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {_format_value(cumulative)}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(data['sum'])}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def mark_process_dead(pid: int):
+    """gunicorn ``child_exit`` hook: keep the counters of the exited worker, drop its gauges."""
+    if not METRICS_DIR:
+        return
+    path = Path(METRICS_DIR) / f"{pid}.db"
+    if path.exists():
+        path.rename(path.with_suffix(".dead"))
+
+
+def clear_metrics_dir():
+    """gunicorn ``on_starting`` hook: values of the previous run must not be added to the new one."""
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    for path in Path(METRICS_DIR).glob("*"):
+        if path.suffix in (".db", ".dead"):
+            path.unlink(missing_ok=True)
+
+
+async def metrics_view(request: Request) -> Response:
+    return Response(generate_latest(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+http_requests_total = Counter("http_requests", "HTTP requests", ("method", "route", "status"))
+http_request_duration_seconds = Histogram("http_request_duration_seconds", "HTTP request latency",
+                                          ("method", "route"))
+http_requests_in_progress = Gauge("http_requests_in_progress", "HTTP requests being processed", ("method",))
+db_query_duration_seconds = Histogram("db_query_duration_seconds", "Database statement latency", ("operation",))
+redis_command_duration_seconds = Histogram("redis_command_duration_seconds", "Redis command latency",
+                                           ("command",))
+write_buffer_rows_total = Counter("write_buffer_rows", "Rows flushed by write-behind buffers", ("model", "result"))
+write_buffer_flush_duration_seconds = Histogram("write_buffer_flush_duration_seconds",
+                                                "Write-behind buffer flush latency", ("model",))
+write_buffer_depth = Gauge("write_buffer_depth", "Rows queued in write-behind buffers", ("model",))
+
+# (method, route, status) -> (in_progress, count, buckets, sum) 的槽位, 请求路径上只做一次字典查找
+_request_recorders: dict[tuple, tuple] = {}
+_in_progress_indexes: dict[str, int] = {}
+
+
+def request_started(method: str):
+    index = _in_progress_indexes.get(method)
+    if index is None:
+        index = _in_progress_indexes[method] = http_requests_in_progress.labels(method).index
+    _store.values[index] += 1
+
+
+def request_finished(method: str, route: str, status_code: int, duration: float):
+    """Record one finished request: in-flight gauge, status counter and latency histogram."""
+    recorder = _request_recorders.get((method, route, status_code))
+    if recorder is None:
+        in_progress = http_requests_in_progress.labels(method)
+        histogram = http_request_duration_seconds.labels(method, route)
+        recorder = _request_recorders[(method, route, status_code)] = (
+            in_progress.index, http_requests_total.labels(method, route, status_code).index,
+            histogram.bucket_indexes, histogram.sum_index,
+        )
+    in_progress_index, count_index, bucket_indexes, sum_index = recorder
+    values = _store.values
+    values[in_progress_index] -= 1
+    values[count_index] += 1
+    values[bucket_indexes[bisect_left(http_request_duration_seconds.upper_bounds, duration)]] += 1
+    values[sum_index] += duration
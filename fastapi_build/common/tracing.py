@@ -0,0 +1,270 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 22:30
+# @Author : PinBar
+# @File : tracing.py
+"""
+In-process request tracing without a tracing backend.
+
+A sampled request opens a root span in RequestLogMiddleware. Authentication, every SQL statement,
+row conversion, closing the DB session, Redis/ES commands and JSON rendering add child spans, the
+parent is tracked with a ContextVar. Requests that are not sampled only pay for one ContextVar
+lookup per span.
+
+Finished spans are written in batches by a daemon thread as JSON lines to
+``TRACE_DIR/spans-<pid>.jsonl``, one span per line with OTLP field names. Fold them into flamegraph
+input with::
+
+    python -m common.tracing log/traces/spans-*.jsonl > folded.txt
+    flamegraph.pl folded.txt > trace.svg
+"""
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque, defaultdict
+from typing import Optional, Any, Callable
+
+from config.settings import TRACE_ENABLED, TRACE_SAMPLE_RATE, TRACE_DIR, TRACE_FLUSH_INTERVAL, PROJECT_NAME
+
+# 达到这个数量时立即唤醒写入线程
+BATCH_SIZE = 512
+# 写入跟不上时最多缓存的 span 数量, 超出后丢弃最早的
+MAX_QUEUE_SIZE = 20000
+# OTLP status code
+STATUS_ERROR = 2
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+
+
+def _new_id(size: int) -> str:
+    return random.getrandbits(size * 8).to_bytes(size, "big").hex()
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "error",
+                 "start_ns", "_start_counter", "duration_ns", "_token")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self._start_counter = time.perf_counter_ns()
+        self.duration_ns: Optional[int] = None
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def finish(self, error: BaseException = None):
+        if self.duration_ns is not None:
+            return
+        self.duration_ns = time.perf_counter_ns() - self._start_counter
+        if error is not None:
+            self.error = f"{error.__class__.__name__}: {error}"
+        _exporter.add(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.finish(exc)
+
+    def to_dict(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.start_ns + self.duration_ns,
+            "attributes": self.attributes,
+            "resource": {"service.name": PROJECT_NAME, "process.pid": os.getpid()},
+        }
+        if self.error is not None:
+            span["status"] = {"code": STATUS_ERROR, "message": self.error}
+        return span
+
+
+class _NoopSpan:
+    """Returned when the current request is not traced."""
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def finish(self, error: BaseException = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def __bool__(self):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def start_trace(name: str, **attributes):
+    """Root span of a request, sampled with ``TRACE_SAMPLE_RATE``; use it with ``with``."""
+    if not TRACE_ENABLED or random.random() >= TRACE_SAMPLE_RATE:
+        return NOOP_SPAN
+    return Span(name, _new_id(16), None, attributes)
+
+
+def span(name: str, **attributes):
+    """
+    Child of the current span, a no-op outside a sampled trace.
+
+    ``with span(...)`` makes it the parent of spans opened inside, leaves created from callbacks
+    (e.g. SQLAlchemy events) call ``finish()`` without entering it.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(name, parent.trace_id, parent.span_id, attributes)
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def traced(name: str = None) -> Callable:
+    """Decorator, wraps every call of a sync or async function in a span."""
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class _BatchExporter:
+    """Buffer finished spans, a daemon thread appends them to ``TRACE_DIR/spans-<pid>.jsonl``."""
+
+    def __init__(self, directory: str, interval: float):
+        self.directory = directory
+        self.interval = interval
+        self.spans: deque = deque(maxlen=MAX_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pid: Optional[int] = None
+
+    def add(self, finished: Span):
+        if self.pid is None:
+            self._start()
+        self.spans.append(finished)
+        if len(self.spans) >= BATCH_SIZE:
+            self.wakeup.set()
+
+    def _start(self):
+        with self.lock:
+            if self.pid is not None:
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, name="trace-export", daemon=True).start()
+
+    def _after_fork(self):
+        # fork 出的 worker 不继承父进程未写出的 span 和线程, 首次导出时重新启动
+        self.spans = deque(maxlen=MAX_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pid = None
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        if not self.spans or self.pid != os.getpid():
+            return
+        with self.lock:
+            lines = []
+            while self.spans:
+                lines.append(json.dumps(self.spans.popleft().to_dict(), ensure_ascii=False, default=str))
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f"spans-{self.pid}.jsonl"), "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+
+
+_exporter = _BatchExporter(TRACE_DIR, TRACE_FLUSH_INTERVAL)
+os.register_at_fork(after_in_child=_exporter._after_fork)
+atexit.register(_exporter.flush)
+
+
+def flush():
+    _exporter.flush()
+
+
+def _covered(intervals: list[tuple[int, int]]) -> int:
+    covered, end = 0, None
+    for start, stop in sorted(intervals):
+        if end is None or start > end:
+            covered += stop - start
+            end = stop
+        elif stop > end:
+            covered += stop - end
+            end = stop
+    return covered
+
+
+def fold(paths: list[str]) -> dict[str, int]:
+    """
+    Collapse exported spans into ``root;child;leaf -> self time (us)`` stacks for flamegraph tools.
+    Overlapping children (e.g. ``asyncio.gather``) are only subtracted once from their parent.
+    """
+    spans = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    spans[item["spanId"]] = item
+    children = defaultdict(list)
+    for item in spans.values():
+        if item["parentSpanId"] in spans:
+            children[item["parentSpanId"]].append((item["startTimeUnixNano"], item["endTimeUnixNano"]))
+    stacks = defaultdict(int)
+    for span_id, item in spans.items():
+        names = []
+        parent = item
+        while parent is not None:
+            names.append(parent["name"].replace(";", ","))
+            parent = spans.get(parent["parentSpanId"])
+        self_time = item["endTimeUnixNano"] - item["startTimeUnixNano"] - _covered(children[span_id])
+        stacks[";".join(reversed(names))] += max(self_time, 0) // 1000
+    return stacks
+
+
+if __name__ == "__main__":
+    for stack, micros in sorted(fold(sys.argv[1:]).items()):
+        print(stack, micros)
@@ -33,6 +33,15 @@ DATABASE_CHARSET = os.getenv("DATABASE_CHARSET", "utf8mb4")
 
 
 CREATE_DEPENDS_SESSION = int(os.getenv("CREATE_DEPENDS_SESSION", 1))
+# 记录 QuerySet 的过滤/排序字段, 供 fbuild suggest_indexes 分析索引, 为空则不记录
+QUERY_SHAPE_DIR = os.getenv("QUERY_SHAPE_DIR", "")
+QUERY_SHAPE_FLUSH_INTERVAL = int(os.getenv("QUERY_SHAPE_FLUSH_INTERVAL", 60))
+# 追加写缓冲: 每批最多插入行数、最长等待秒数、队列上限(满了之后写入方等待)
+WRITE_BUFFER_BATCH_SIZE = int(os.getenv("WRITE_BUFFER_BATCH_SIZE", 500))
+WRITE_BUFFER_FLUSH_INTERVAL = float(os.getenv("WRITE_BUFFER_FLUSH_INTERVAL", 1))
+WRITE_BUFFER_MAX_SIZE = int(os.getenv("WRITE_BUFFER_MAX_SIZE", 10000))
+# 写入失败的批次重试次数(间隔按 FLUSH_INTERVAL 翻倍), 仍失败时逐行插入, 只丢弃插入失败的行
+WRITE_BUFFER_MAX_RETRIES = int(os.getenv("WRITE_BUFFER_MAX_RETRIES", 3))
 
 # [es]
 ES_HOST = os.getenv("ES_HOST", "http://127.0.0.1:9200")
@@ -45,9 +54,56 @@ PROJECT_NAME = os.getenv("PROJECT_NAME", "")
 LOG_DIR = os.getenv("LOG_DIR", "log")
 SECRET_KEY = os.getenv("SECRET_KEY", "")
 TOKEN_EXPIRE_SECONDS = int(os.getenv("TOKEN_EXPIRE_SECONDS", 3600 * 24 * 7))
+# 指标采集, 多 worker 部署时设置 METRICS_DIR 为共享目录 (各进程写 <pid>.db), 为空时只统计当前进程
+METRICS_ENABLED = int(os.getenv("METRICS_ENABLED", 1))
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+# 进程内指标写入共享文件的间隔(秒)
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 1))
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+# 准入控制: api_description(concurrency_limit=...) 未指定时的默认并发上限, 0 表示不限制
+ADMISSION_DEFAULT_LIMIT = int(os.getenv("ADMISSION_DEFAULT_LIMIT", 0))
+# 超出并发时的等待队列长度和最长等待时间(秒), 排不上或等待超时直接返回 503
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 100))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 3))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 1))
+# 限流: 每次从 Redis 预取 容量*比例 个令牌在本地消费, 0 表示每次请求都访问 Redis
+RATE_LIMIT_LEASE_RATIO = float(os.getenv("RATE_LIMIT_LEASE_RATIO", 0))
+# Redis 不可用时改用进程内限流, 并在这段时间(秒)内不再尝试 Redis
+RATE_LIMIT_FALLBACK_SECONDS = float(os.getenv("RATE_LIMIT_FALLBACK_SECONDS", 5))
+# 客户端断开后取消仍在处理的请求并中断正在执行的查询
+DISCONNECT_CANCEL = int(os.getenv("DISCONNECT_CANCEL", 1))
+# 访问日志采样率 (0~1), 5xx 和慢请求始终记录
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", 1))
+ACCESS_LOG_SLOW_SECONDS = float(os.getenv("ACCESS_LOG_SLOW_SECONDS", 1))
+# 访问日志记录的请求体最大字节数, 0 时不记录请求体
+ACCESS_LOG_BODY_LIMIT = int(os.getenv("ACCESS_LOG_BODY_LIMIT", 2048))
+# 链路追踪: 按采样率记录请求内各阶段(认证/数据库/Redis/ES/序列化)的耗时, 写入 TRACE_DIR/spans-<pid>.jsonl
+TRACE_ENABLED = int(os.getenv("TRACE_ENABLED", 0))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+TRACE_DIR = os.getenv("TRACE_DIR", os.path.join(LOG_DIR, "traces"))
+# 批量写出 span 的间隔(秒)
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", 1))
 # [gunicorn & fastapi]
 USE_GUNICORN_WORKER = int(os.getenv("USE_GUNICORN_WORKER", 0))
 SYNC_THREAD_COUNT = int(os.getenv("SYNC_THREAD_COUNT", 800))
+# 默认使用 orjson 渲染响应 (core.response.FastJSONResponse), 未安装 orjson 时退回 json
+FAST_JSON_RESPONSE = int(os.getenv("FAST_JSON_RESPONSE", 0))
+# 接口响应缓存总开关, 关闭后 api_description(cache_ttl=...) 不生效; 只有注册了 cache_ttl 路由的进程在写操作提交时刷新表版本
+# (celery 等只写数据的进程需要调用 core.cache.enable_invalidation())
+RESPONSE_CACHE = int(os.getenv("RESPONSE_CACHE", 1))
+# 合并并发的相同请求 (api_description(single_flight=...)): 等待领头请求的最长时间(秒), 也是跨 worker 锁的过期时间
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", 5))
+# 跨 worker 模式下轮询领头请求结果的间隔(秒)
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", 0.02))
+# 认证缓存: 按 token 摘要缓存解码结果和用户快照, 最长 AUTH_CACHE_TTL 秒且不超过 token 的 exp, 0 表示关闭
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+# 权限缓存: 用户的权限集合在本进程和 Redis 中缓存的秒数, 0 表示只在请求内缓存
+PERMISSION_CACHE_TTL = float(os.getenv("PERMISSION_CACHE_TTL", 300))
+PERMISSION_CACHE_SIZE = int(os.getenv("PERMISSION_CACHE_SIZE", 10000))
+# 密码哈希 (bcrypt) 进程池: 每个 worker 的进程数, 0 表示改用线程池; 排队和计算中的任务超过上限时返回 503
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 32))
 
 # 根据开发环境导入不同配置文件
 try:
@@ -2,19 +2,39 @@
 # @Time : 2024/5/15 17:04
 # @Author : PinBar
 # @File : base_view.py
+import asyncio
+import functools
 import inspect
-from typing import Union, Type, Any
+import time
+from typing import Union, Type, Any, Callable, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func
 
-from auth.base_authentication import BaseTokenAuthentication
-from config.settings import CREATE_DEPENDS_SESSION
+from auth.base_authentication import BaseTokenAuthentication, auth_dependencies
+from config.settings import CREATE_DEPENDS_SESSION, RESPONSE_CACHE, ADMISSION_DEFAULT_LIMIT
+from core import cache as response_cache, single_flight
+from core.admission import admission_dependency
+from core.conditional import (CONDITIONAL_ETAG, CONDITIONAL_LAST_MODIFIED, enable_conditional, make_etag, http_date,
+                              is_not_modified, not_modified_response)
 from core.context import g
+from core.rate_limit import RateLimiter
+from core.response import SoftResponseModel, FastJSONResponse, contains_raw_json
+from core.streaming import QuerySetStreamingResponse
+from exceptions.custom_exception import RequestTimeoutError
 
 
 base_router = APIRouter()
 
 
+def deadline_dependency(timeout: float) -> Callable:
+    async def set_deadline():
+        g.deadline = time.monotonic() + timeout
+
+    return set_deadline
+
+
 class BaseView:
     authentication_classes = [BaseTokenAuthentication]
     permissions_classes = []
@@ -47,8 +67,19 @@ class BaseView:
                                   else self.authentication_classes)
         permission_classes = (custom_permission_classes if custom_permission_classes is not None else
                               self.permissions_classes)
-        dependencies = [Depends(_(name='')(method)) for _ in authentication_classes] + \
-                       [Depends(_(method)) for _ in permission_classes]
+        dependencies = [Depends(dependency) for dependency in
+                        auth_dependencies(authentication_classes, permission_classes, method)]
+        rate_limit = extra_params.pop("rate_limit", None)
+        rate_limit_key = extra_params.pop("rate_limit_key", None) or "user|ip"
+        if rate_limit:
+            # 放在认证之后, 按用户限流时需要 g.user_id
+            dependencies.append(Depends(RateLimiter(method.__qualname__, rate_limit, rate_limit_key).dependency()))
+        timeout = extra_params.get("timeout")
+        if timeout:
+            # 截止时间在第一个依赖里设置, 认证和权限里的查询也受它约束
+            dependencies.insert(0, Depends(deadline_dependency(timeout)))
+        if extra_params.pop("etag", False):
+            dependencies.append(Depends(enable_conditional))
         depend_session: bool = extra_params.pop("depend_session", CREATE_DEPENDS_SESSION)
         if depend_session:
             try:
@@ -60,6 +91,14 @@ class BaseView:
                     dependencies.insert(0, Depends(sessionmanager.get_db))
                 else:
                     dependencies.insert(0, Depends(sessionmanager.get_db_sync))
+        concurrency_limit = extra_params.pop("concurrency_limit", None) or ADMISSION_DEFAULT_LIMIT
+        queue_size = extra_params.pop("queue_size", None)
+        queue_timeout = extra_params.pop("queue_timeout", None)
+        priority = extra_params.pop("priority", None)
+        if concurrency_limit:
+            # 准入控制放在最前面, 被拒绝的请求不占用数据库连接
+            dependencies.insert(0, Depends(admission_dependency(
+                method.__qualname__, concurrency_limit, queue_size, queue_timeout, priority)))
         return dependencies
 
     def register_routes(self):
@@ -79,11 +118,75 @@ class BaseView:
             if self.is_method_overridden(method_name):
                 extra_params = getattr(method, '_extra_params', {})
                 dependencies = self.get_dependencies(extra_params, method)
-                base_router.add_api_route(router_info['path'], method,
+                endpoint = self.wrap_endpoint(method, extra_params)
+                base_router.add_api_route(router_info['path'], endpoint,
                                           methods=router_info['methods'],
                                           dependencies=dependencies,
                                           tags=self.tags, **extra_params)
 
+    @staticmethod
+    def wrap_endpoint(method: Callable, extra_params: dict) -> Callable:
+        """
+        Routes whose response model is a ``validate=False`` envelope return a FastJSONResponse
+        themselves, FastAPI passes a Response through without validating and ``jsonable_encoder``.
+        The response model is still registered for the OpenAPI schema.
+
+        Routes with ``cache_ttl`` are answered from the response cache (see ``core.cache``) before
+        the method runs, routes with ``single_flight`` share one run among identical concurrent GETs
+        (see ``core.single_flight``). Routes with ``timeout`` are cancelled when ``g.deadline`` passes.
+        """
+        timeout = extra_params.pop("timeout", None)
+        cache_ttl = extra_params.pop("cache_ttl", None)
+        vary_on = extra_params.pop("vary_on", None) or ()
+        cache_compress = extra_params.pop("cache_compress", False)
+        cache_enabled = bool(cache_ttl) and RESPONSE_CACHE
+        if cache_enabled:
+            response_cache.enable_invalidation()
+        flight_mode = single_flight.flight_mode(extra_params.pop("single_flight", None))
+        response_model = extra_params.get("response_model")
+        if response_model is None:
+            response_model = inspect.signature(method).return_annotation
+        soft = inspect.isclass(response_model) and issubclass(response_model, SoftResponseModel)
+        if not soft and not cache_enabled and not timeout and not flight_mode:
+            return method
+        status_code = extra_params.get("status_code") or 200
+        route = method.__qualname__
+
+        @functools.wraps(method)
+        async def endpoint(*args, **kwargs):
+            request = g.request
+            caching = cache_enabled and request is not None and request.method == "GET"
+            if caching:
+                cached = await response_cache.lookup(route, request, cache_ttl, vary_on, cache_compress)
+                if cached is not None:
+                    return cached
+            if flight_mode and request is not None and request.method == "GET":
+                shared = await single_flight.join(route, request, flight_mode, vary_on)
+                if shared is not None:
+                    if caching:
+                        response_cache.discard(request)
+                    return shared
+            if inspect.iscoroutinefunction(method):
+                call = method(*args, **kwargs)
+            else:
+                call = run_in_threadpool(method, *args, **kwargs)
+            try:
+                if timeout:
+                    try:
+                        result = await asyncio.wait_for(call, max(g.remaining_time(), 0))
+                    except asyncio.TimeoutError:
+                        raise RequestTimeoutError() from None
+                else:
+                    result = await call
+            finally:
+                if caching:
+                    response_cache.finish_recording(request)
+            if not soft or isinstance(result, Response):
+                return result
+            return FastJSONResponse(result, status_code=status_code)
+
+        return endpoint
+
     def is_method_overridden(self, method_name: str) -> bool:
         subclass_method = getattr(self, method_name, None)
         base_method = getattr(BaseView, method_name, None)
@@ -94,11 +197,62 @@ class BaseView:
 
     @staticmethod
     def response(code: int = 0, message: str = 'success', data: Union[dict, None, list, str, Any] = None):
-        return {
+        content = {
             "code": code,
             "message": message,
             "data": data
         }
+        if contains_raw_json(data):
+            # data 已经是序列化好的 JSON (QuerySet.values/pagination(as_json=True)), 直接输出
+            return FastJSONResponse(content)
+        return content
+
+    def _check_not_modified(self, queryset, result: Optional[dict]) -> Optional[Response]:
+        if not result or result["last_modified"] is None:
+            etag, last_modified = make_etag(f"{queryset.model_cls.__tablename__}:empty".encode(), weak=True), None
+        else:
+            last_modified = http_date(result["last_modified"])
+            etag = make_etag(
+                f"{queryset.model_cls.__tablename__}:{result['count']}:{result['last_modified'].isoformat()}".encode(),
+                weak=True
+            )
+        setattr(self.request.state, CONDITIONAL_ETAG, etag)
+        setattr(self.request.state, CONDITIONAL_LAST_MODIFIED, last_modified)
+        if is_not_modified(self.request.headers, etag, last_modified):
+            return not_modified_response(etag, last_modified)
+        return None
+
+    @staticmethod
+    def _validator_aggregates(queryset) -> tuple:
+        return (func.max(queryset.model_cls.update_time).label("last_modified"),
+                func.count().label("count"))
+
+    async def a_not_modified(self, queryset) -> Optional[Response]:
+        """
+        Conditional GET from ``update_time``, one ``SELECT max(update_time), count(*)`` over the queryset.
+
+        Returns a 304 response when the request validators match, otherwise None and the validators are
+        sent with the normal response (the route needs ``api_description(etag=True)``), e.g.::
+
+            if response := await self.a_not_modified(User.objects.filter(User.id == _id)):
+                return response
+        """
+        result = await queryset.a_aggregate(*self._validator_aggregates(queryset))
+        return self._check_not_modified(queryset, result)
+
+    def not_modified(self, queryset) -> Optional[Response]:
+        result = queryset.aggregate(*self._validator_aggregates(queryset))
+        return self._check_not_modified(queryset, result)
+
+    @staticmethod
+    def export(queryset, format: str = 'csv', filename: str = None, gzip: bool = False,
+               chunk_size: int = 1000) -> QuerySetStreamingResponse:
+        """
+        Stream a QuerySet as a csv/ndjson/arrow file, e.g. ``return self.export(User.objects.filter(...), 'ndjson')``.
+        ``gzip`` compresses the body when the request sends ``Accept-Encoding: gzip``.
+        """
+        return QuerySetStreamingResponse(queryset, format=format, filename=filename, gzip=gzip,
+                                         chunk_size=chunk_size)
 
     def get(self, *args, **kwargs):
         raise ImportError("Not implemented")
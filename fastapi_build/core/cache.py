@@ -0,0 +1,266 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 18:30
+# @Author : PinBar
+# @File : cache.py
+import contextvars
+import gzip
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
+from itertools import chain
+from typing import Optional, Iterable
+
+from fastapi import Request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, ORMExecuteState
+from sqlalchemy.sql.util import find_tables
+from sqlalchemy.util.concurrency import in_greenlet, await_only
+from starlette.responses import Response
+
+from common.log import logger
+from config.settings import RESPONSE_CACHE
+from core.context import g
+from core.response import accepts_encoding
+
+CACHE_PREFIX = "resp_cache"
+# 不写入缓存的响应头: 每个用户不同的, 以及命中时重新生成的
+UNCACHED_HEADERS = (b"set-cookie", b"content-length", b"x-cache")
+# request.state 上的键, 记录待写入的缓存项, 由 ResponseCacheMiddleware 在响应完成后写入
+CACHE_ENTRY = "response_cache"
+# session.info 上的键, 记录本事务写过的表
+WRITTEN_TABLES = "cache_written_tables"
+
+# 当前请求读过的表, 仅在开启缓存的路由里记录
+_read_tables: contextvars.ContextVar[Optional[set]] = contextvars.ContextVar("cache_read_tables", default=None)
+# 路由 -> 上次读过的表, 用来在一次 pipeline 里同时取缓存和表版本
+_route_tags: dict[str, frozenset] = {}
+# 注册了 cache_ttl 路由的进程才需要在提交时刷新表版本, 见 enable_invalidation
+_invalidation_enabled = False
+# Redis 出错后这段时间(秒)内不再刷新表版本
+REDIS_RETRY_SECONDS = 5
+_redis_down_until = 0.0
+
+
+def enable_invalidation():
+    """
+    Bump table versions on commit in this process. Called when a ``cache_ttl`` route is registered,
+    processes that write without serving cached routes (celery, scripts) call it themselves.
+    """
+    global _invalidation_enabled
+    _invalidation_enabled = bool(RESPONSE_CACHE)
+
+
+def _redis_available() -> bool:
+    return time.monotonic() >= _redis_down_until
+
+
+def _redis_failed(action: str):
+    global _redis_down_until
+    _redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+    logger.warning(f"response cache redis unavailable, {action}")
+
+
+def tag_key(table: str) -> str:
+    return f"{CACHE_PREFIX}:tag:{table}"
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    route: str
+    ttl: int
+    compress: bool
+    versions: dict[str, int]
+    tables: set = field(default_factory=set)
+    # 响应随之变化的请求头, 写入 Vary
+    vary_on: tuple = ()
+
+
+def request_digest(request: Request, vary_on: Iterable[str] = ()) -> str:
+    """Digest of path, query string and user, plus the request headers listed in ``vary_on``."""
+    parts = [request.url.path, str(sorted(request.query_params.multi_items())), str(g.user_id)]
+    parts.extend(f"{name}={request.headers.get(name, '')}" for name in vary_on if name != "user")
+    return hashlib.blake2b("\n".join(parts).encode(), digest_size=16).hexdigest()
+
+
+def make_cache_key(route: str, request: Request, vary_on: Iterable[str] = ()) -> str:
+    return f"{CACHE_PREFIX}:{route}:{request_digest(request, vary_on)}"
+
+
+def add_vary(headers: list[tuple[bytes, bytes]], names: Iterable[str]) -> list[tuple[bytes, bytes]]:
+    """Add ``names`` to the Vary header of raw ``headers``, keeping the names already listed."""
+    names = [name for name in names if name != "user"]
+    if not names:
+        return headers
+    current = [value.decode("latin-1") for key, value in headers if key.lower() == b"vary"]
+    listed = {name.strip().lower() for value in current for name in value.split(",") if name.strip()}
+    if "*" in listed:
+        return headers
+    merged = current + [name for name in names if name.lower() not in listed]
+    return [(key, value) for key, value in headers if key.lower() != b"vary"] + \
+        [(b"vary", ", ".join(merged).encode("latin-1"))]
+
+
+def _encode_entry(entry: CacheEntry, status_code: int, headers: list[tuple[bytes, bytes]], body: bytes) -> bytes:
+    header = {"v": entry.versions, "s": status_code, "z": entry.compress,
+              "h": [[k.decode("latin-1"), v.decode("latin-1")] for k, v in headers if k.lower() not in UNCACHED_HEADERS]}
+    if entry.compress:
+        body = gzip.compress(body, compresslevel=6)
+    return json.dumps(header).encode() + b"\n" + body
+
+
+def _decode_entry(value: bytes) -> tuple[dict, bytes]:
+    header, body = value.split(b"\n", 1)
+    return json.loads(header), body
+
+
+def _cached_response(request: Request, header: dict, body: bytes) -> Response:
+    if "h" in header:
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in header["h"]]
+    else:
+        # 旧格式的缓存项只记录了 media type
+        headers = [(b"content-type", header["m"].encode("latin-1"))] if header.get("m") else []
+    if header["z"]:
+        if accepts_encoding(request.headers.get("accept-encoding", "")):
+            headers.append((b"content-encoding", b"gzip"))
+        else:
+            body = gzip.decompress(body)
+        headers = add_vary(headers, ["Accept-Encoding"])
+    response = Response(body, status_code=header["s"])
+    response.raw_headers = [(b"content-length", str(len(body)).encode()), *headers, (b"x-cache", b"HIT")]
+    return response
+
+
+async def lookup(route: str, request: Request, ttl: int, vary_on: Iterable[str] = (),
+                 compress: bool = False) -> Optional[Response]:
+    """
+    Return the cached response or None. On a miss the pending entry is stored on ``request.state``
+    and read tables start being recorded, ResponseCacheMiddleware saves the body once it is sent.
+
+    The entry and the versions of the tables the route read last time are fetched in one pipeline,
+    an entry is valid while every table version it was built with is unchanged.
+    """
+    from db.redis_client import aio_r_cache
+
+    key = make_cache_key(route, request, vary_on)
+    tables = sorted(_route_tags.get(route, ()))
+    try:
+        async with aio_r_cache.pipeline(transaction=False) as pipe:
+            if tables:
+                pipe.mget([tag_key(t) for t in tables])
+            pipe.get(key)
+            results = await pipe.execute()
+    except Exception:
+        logger.warning(f"response cache lookup fail, route={route}")
+        return None
+    versions = dict(zip(tables, (int(v or 0) for v in results[0]))) if tables else {}
+    value = results[-1]
+    if value is not None:
+        header, body = _decode_entry(value)
+        if header["v"] == versions:
+            return _cached_response(request, header, body)
+    setattr(request.state, CACHE_ENTRY, CacheEntry(key=key, route=route, ttl=ttl, compress=compress,
+                                                   versions=versions, vary_on=tuple(vary_on)))
+    _read_tables.set(set())
+    return None
+
+
+def finish_recording(request: Request):
+    """Called when the endpoint returns, moves the recorded read tables onto the pending entry."""
+    entry: Optional[CacheEntry] = getattr(request.state, CACHE_ENTRY, None)
+    tables = _read_tables.get()
+    if entry is not None and tables is not None:
+        entry.tables = tables
+    _read_tables.set(None)
+
+
+def discard(request: Request):
+    """Drop the pending entry, the response was not built by this request (see ``core.single_flight``)."""
+    setattr(request.state, CACHE_ENTRY, None)
+    _read_tables.set(None)
+
+
+async def store(entry: CacheEntry, status_code: int, headers: list[tuple[bytes, bytes]], body: bytes):
+    """Save the sent response, its headers except the per-client ``UNCACHED_HEADERS`` are replayed on a hit."""
+    from db.redis_client import aio_r_cache
+
+    tables = frozenset(entry.tables)
+    if tables != set(entry.versions):
+        # 表版本必须在读数据之前取到, 读过的表与预取的不一致时只更新路由的表, 下次未命中再写缓存
+        _route_tags[entry.route] = tables
+        return
+    try:
+        await aio_r_cache.set(entry.key, _encode_entry(entry, status_code, headers, body), ex=entry.ttl)
+    except Exception:
+        logger.warning(f"response cache store fail, route={entry.route}")
+
+
+def bump_tags(tables: Iterable[str]):
+    """Invalidate every cached response built from these tables."""
+    tables = sorted(set(tables))
+    if not tables or not _redis_available():
+        return
+    try:
+        if in_greenlet():
+            # AsyncSession 提交时事件运行在 greenlet 中, 可以直接等待异步客户端
+            await_only(abump_tags(tables))
+        else:
+            from db.redis_client import r_cache
+
+            pipe = r_cache.pipeline(transaction=False)
+            for table in tables:
+                pipe.incr(tag_key(table))
+            pipe.execute()
+    except Exception:
+        _redis_failed(f"cached responses of {tables} expire by ttl")
+
+
+async def abump_tags(tables: Iterable[str]):
+    from db.redis_client import aio_r_cache
+
+    async with aio_r_cache.pipeline(transaction=False) as pipe:
+        for table in tables:
+            pipe.incr(tag_key(table))
+        await pipe.execute()
+
+
+def _statement_tables(statement) -> set[str]:
+    return {table.name for table in find_tables(statement, include_crud=True) if hasattr(table, "name")}
+
+
+def _written_tables(session: Session) -> set:
+    return session.info.setdefault(WRITTEN_TABLES, set())
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _record_execute(orm_execute_state: ORMExecuteState):
+    if not _invalidation_enabled:
+        return
+    if orm_execute_state.is_select:
+        tables = _read_tables.get()
+        if tables is not None:
+            tables.update(_statement_tables(orm_execute_state.statement))
+    elif orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _written_tables(orm_execute_state.session).update(_statement_tables(orm_execute_state.statement))
+
+
+@event.listens_for(Session, "after_flush")
+def _record_flush(session: Session, flush_context):
+    if not _invalidation_enabled:
+        return
+    tables = _written_tables(session)
+    for obj in chain(session.new, session.dirty, session.deleted):
+        tables.update(table.name for table in inspect(obj).mapper.tables)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session: Session):
+    tables = session.info.pop(WRITTEN_TABLES, None)
+    if tables and _invalidation_enabled:
+        bump_tags(tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session: Session):
+    session.info.pop(WRITTEN_TABLES, None)
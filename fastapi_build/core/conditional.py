@@ -0,0 +1,73 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 17:40
+# @Author : PinBar
+# @File : conditional.py
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Mapping
+
+from fastapi import Request
+from starlette.responses import Response
+
+from config.settings import TZ
+
+# request.state 上的键: 路由是否开启 etag, 以及视图里根据数据库算出的校验值
+CONDITIONAL_ENABLED = "conditional"
+CONDITIONAL_ETAG = "etag"
+CONDITIONAL_LAST_MODIFIED = "last_modified"
+
+
+def make_etag(data: bytes, weak: bool = False) -> str:
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    return f'W/"{digest}"' if weak else f'"{digest}"'
+
+
+def http_date(dt: datetime) -> str:
+    """Format a model time (naive, in settings.TZ) as an HTTP date."""
+    if dt.tzinfo is None:
+        dt = TZ.localize(dt)
+    return format_datetime(dt.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def _strip_weak(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def is_not_modified(headers: Mapping[str, str], etag: Optional[str] = None,
+                    last_modified: Optional[str] = None) -> bool:
+    """
+    Evaluate If-None-Match (weak comparison) or, when absent, If-Modified-Since against the validators.
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        return _strip_weak(etag) in {_strip_weak(tag.strip()) for tag in if_none_match.split(",")}
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def validator_headers(etag: Optional[str] = None, last_modified: Optional[str] = None) -> dict:
+    headers = {}
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    return headers
+
+
+def not_modified_response(etag: Optional[str] = None, last_modified: Optional[str] = None) -> Response:
+    return Response(status_code=304, headers=validator_headers(etag, last_modified))
+
+
+async def enable_conditional(request: Request):
+    """Dependency added by ``api_description(etag=True)``, ConditionalGetMiddleware only handles these routes."""
+    setattr(request.state, CONDITIONAL_ENABLED, True)
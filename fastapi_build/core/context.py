@@ -3,7 +3,8 @@
 # @Author : zhuo.wang
 # @File : context.py
 import contextvars
-from typing import Union, Any
+import time
+from typing import Union, Any, Optional
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -16,10 +17,11 @@ _user = contextvars.ContextVar("user", default=None)
 _session = contextvars.ContextVar("session", default=None)
 _session_sync = contextvars.ContextVar("session_sync", default=None)
 _extra_data = contextvars.ContextVar("extra_data", default=None)
+_deadline = contextvars.ContextVar("deadline", default=None)
 
 
 class ContextVarsManager:
-    _support_keys = ("request", "user_id", "user", "extra_data", "session", "session_sync")
+    _support_keys = ("request", "user_id", "user", "extra_data", "session", "session_sync", "deadline")
 
     @property
     def request(self) -> Request:
@@ -69,6 +71,20 @@ class ContextVarsManager:
     def extra_data(self, value: dict):
         _extra_data.set(value)
 
+    @property
+    def deadline(self) -> Optional[float]:
+        """``time.monotonic()`` value after which the request should give up, see ``api_description(timeout=)``."""
+        return _deadline.get()
+
+    @deadline.setter
+    def deadline(self, value: Optional[float]):
+        _deadline.set(value)
+
+    def remaining_time(self) -> Optional[float]:
+        """Seconds left before the deadline, None when the request has no deadline."""
+        deadline = _deadline.get()
+        return None if deadline is None else deadline - time.monotonic()
+
     def __setattr__(self, name: str, value: Any):
         if name not in self._support_keys:
             raise ValueError(f"Invalid key {name}, supported keys: {'、'.join(self._support_keys)}")
@@ -2,6 +2,7 @@
 # @Time : 2024/5/16 10:14
 # @Author : PinBar
 # @File : decorator.py
+from typing import List, Type, Optional, Union, Dict
 
 from fastapi.routing import *
 
@@ -14,6 +15,18 @@ def api_description(
         authentication_classes: List[Type[BaseAuthentication]] = None,
         permission_classes: List[Type[BasePermission]] = None,
         depend_session: bool = CREATE_DEPENDS_SESSION,
+        etag: bool = False,
+        cache_ttl: Optional[int] = None,
+        vary_on: Optional[List[str]] = None,
+        cache_compress: bool = False,
+        single_flight: Union[bool, str] = False,
+        concurrency_limit: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        priority: Optional[int] = None,
+        rate_limit: Optional[str] = None,
+        rate_limit_key: Union[str, Callable[[Request], str]] = "user|ip",
+        timeout: Optional[float] = None,
         response_model: Any = Default(None),
         status_code: Optional[int] = None,
         tags: Optional[List[Union[str, Enum]]] = None,
@@ -69,7 +82,19 @@ def api_description(
         ]
         params = {"permission_classes": permission_classes,
                   "authentication_classes": authentication_classes,
-                  "depend_session": depend_session
+                  "depend_session": depend_session,
+                  "etag": etag,
+                  "cache_ttl": cache_ttl,
+                  "vary_on": vary_on,
+                  "cache_compress": cache_compress,
+                  "single_flight": single_flight,
+                  "concurrency_limit": concurrency_limit,
+                  "queue_size": queue_size,
+                  "queue_timeout": queue_timeout,
+                  "priority": priority,
+                  "rate_limit": rate_limit,
+                  "rate_limit_key": rate_limit_key,
+                  "timeout": timeout,
                   }
         for field, value in names:
             if value:
@@ -0,0 +1,215 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 20:40
+# @Author : PinBar
+# @File : rate_limit.py
+import math
+import re
+import time
+from dataclasses import dataclass
+from typing import Callable, Union, Optional
+
+from fastapi import Request
+
+from common import metrics
+from common.log import logger
+from config.settings import RATE_LIMIT_LEASE_RATIO, RATE_LIMIT_FALLBACK_SECONDS
+from core.context import g
+from exceptions.custom_exception import TooManyRequestsError
+
+RATE_LIMIT_PREFIX = "rate_limit"
+# 本地租约令牌的有效期(秒), 过期未用完的令牌直接丢弃
+LEASE_SECONDS = 1.0
+# 本地记录的 key 上限, 超过后清空 (只会多访问一次 Redis)
+LOCAL_MAX_KEYS = 10000
+
+_PERIODS = {
+    "s": 1, "sec": 1, "second": 1,
+    "m": 60, "min": 60, "minute": 60,
+    "h": 3600, "hour": 3600,
+    "d": 86400, "day": 86400,
+}
+_RATE_PATTERN = re.compile(r"^\s*(\d+)\s*/\s*(\d*)\s*([a-z]+)\s*$")
+
+# KEYS[1]: 桶, ARGV: 容量, 每毫秒补充的令牌数, 请求的令牌数; 返回 {拿到的令牌数, 需要等待的毫秒数}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local now_time = redis.call('TIME')
+local now = now_time[1] * 1000 + math.floor(now_time[2] / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local granted = 0
+if tokens >= 1 then
+    granted = math.min(requested, math.floor(tokens))
+    tokens = tokens - granted
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate) + 1000)
+local wait = 0
+if granted == 0 then
+    wait = math.ceil((1 - tokens) / rate)
+end
+return {granted, wait}
+"""
+
+rate_limited_total = metrics.Counter("rate_limited", "Requests rejected by the rate limiter", ("route",))
+
+
+@dataclass(frozen=True)
+class Rate:
+    limit: int
+    period: float
+
+    @property
+    def per_ms(self) -> float:
+        return self.limit / self.period / 1000
+
+
+def parse_rate(rate: str) -> Rate:
+    """``"100/min"``, ``"10/s"``, ``"5/10s"``, ``"1000/hour"``."""
+    match = _RATE_PATTERN.match(rate.lower())
+    if not match or match.group(3) not in _PERIODS:
+        raise ValueError(f"Invalid rate limit {rate!r}, expected like '100/min'")
+    count, multiplier, unit = match.groups()
+    return Rate(int(count), int(multiplier or 1) * _PERIODS[unit])
+
+
+def _client_ip(request: Request) -> Optional[str]:
+    return request.client.host if request.client else None
+
+
+_KEY_SOURCES = {
+    "user": lambda request: None if g.user_id is None else str(g.user_id),
+    "ip": _client_ip,
+    "global": lambda request: "global",
+}
+
+
+def make_key_func(key: Union[str, Callable[[Request], str]]) -> Callable[[Request], str]:
+    """
+    ``"user|ip"`` uses the first source with a value: the user id, else the client ip.
+    A callable receives the request and returns the key.
+    """
+    if callable(key):
+        return key
+    sources = []
+    for name in key.split("|"):
+        if name.strip() not in _KEY_SOURCES:
+            raise ValueError(f"Invalid rate limit key {name!r}, supported: {', '.join(_KEY_SOURCES)}")
+        sources.append((name.strip(), _KEY_SOURCES[name.strip()]))
+
+    def key_func(request: Request) -> str:
+        for name, source in sources:
+            value = source(request)
+            if value is not None:
+                return f"{name}:{value}"
+        return "anonymous"
+
+    return key_func
+
+
+class LocalTokenBucket:
+    """In-process token buckets, used while Redis is unavailable. Limits apply per worker."""
+
+    def __init__(self, rate: Rate):
+        self.rate = rate
+        self._buckets: dict[str, list] = {}
+
+    def acquire(self, key: str) -> tuple[int, int]:
+        now = time.monotonic() * 1000
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) > LOCAL_MAX_KEYS:
+                self._buckets.clear()
+            bucket = self._buckets[key] = [float(self.rate.limit), now]
+        tokens = min(self.rate.limit, bucket[0] + (now - bucket[1]) * self.rate.per_ms)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 1, 0
+        bucket[0] = tokens
+        return 0, math.ceil((1 - tokens) / self.rate.per_ms)
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every worker through one Lua script on ``aio_r_cache``.
+
+    The script is registered once and sent with EVALSHA. Two local shortcuts keep hot routes off
+    Redis: a rejected key is refused locally until its wait time is over, and with
+    ``RATE_LIMIT_LEASE_RATIO`` a request takes a batch of tokens and spends the rest locally for up
+    to ``LEASE_SECONDS``. When Redis fails the limiter switches to ``LocalTokenBucket`` for
+    ``RATE_LIMIT_FALLBACK_SECONDS``.
+    """
+
+    def __init__(self, name: str, rate: Union[str, Rate], key: Union[str, Callable] = "user|ip",
+                 lease_ratio: float = RATE_LIMIT_LEASE_RATIO):
+        self.name = name
+        self.rate = parse_rate(rate) if isinstance(rate, str) else rate
+        self.key_func = make_key_func(key)
+        self.lease_size = max(1, int(self.rate.limit * lease_ratio))
+        self.local = LocalTokenBucket(self.rate)
+        self._script = None
+        self._redis_down_until = 0.0
+        self._leases: dict[str, list] = {}
+        self._blocked_until: dict[str, float] = {}
+
+    def _get_script(self):
+        if self._script is None:
+            from db.redis_client import aio_r_cache
+
+            self._script = aio_r_cache.register_script(TOKEN_BUCKET_SCRIPT)
+        return self._script
+
+    def _reject(self, wait_seconds: float) -> TooManyRequestsError:
+        rate_limited_total.labels(self.name).inc()
+        return TooManyRequestsError(retry_after=max(1, math.ceil(wait_seconds)))
+
+    async def _acquire_remote(self, key: str) -> tuple[int, int]:
+        now = time.monotonic()
+        if now < self._redis_down_until:
+            return self.local.acquire(key)
+        try:
+            granted, wait = await self._get_script()(
+                keys=[f"{RATE_LIMIT_PREFIX}:{self.name}:{key}"],
+                args=[self.rate.limit, self.rate.per_ms, self.lease_size],
+            )
+        except Exception:
+            logger.warning(f"rate limit redis unavailable, use local limiter for {RATE_LIMIT_FALLBACK_SECONDS}s")
+            self._redis_down_until = now + RATE_LIMIT_FALLBACK_SECONDS
+            return self.local.acquire(key)
+        return int(granted), int(wait)
+
+    async def check(self, key: str):
+        now = time.monotonic()
+        blocked_until = self._blocked_until.get(key)
+        if blocked_until is not None:
+            if now < blocked_until:
+                raise self._reject(blocked_until - now)
+            del self._blocked_until[key]
+        lease = self._leases.get(key)
+        if lease is not None and lease[0] > 0 and now < lease[1]:
+            lease[0] -= 1
+            return
+        granted, wait = await self._acquire_remote(key)
+        if granted == 0:
+            if len(self._blocked_until) > LOCAL_MAX_KEYS:
+                self._blocked_until.clear()
+            self._blocked_until[key] = now + wait / 1000
+            raise self._reject(wait / 1000)
+        if granted > 1:
+            if len(self._leases) > LOCAL_MAX_KEYS:
+                self._leases.clear()
+            self._leases[key] = [granted - 1, now + LEASE_SECONDS]
+
+    def dependency(self) -> Callable:
+        """Route dependency, runs after authentication so ``user`` keys see ``g.user_id``."""
+
+        async def rate_limit(request: Request):
+            await self.check(self.key_func(request))
+
+        rate_limit.limiter = self
+        return rate_limit
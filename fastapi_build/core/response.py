@@ -2,11 +2,26 @@
 # @Time : 2024/5/16 11:16
 # @Author : PinBar
 # @File : response.py
-from datetime import datetime
+import json
+import os
+from datetime import datetime, date, time
+from decimal import Decimal
+from enum import Enum
 from typing import Any, Annotated, Union
 
 from pydantic import BaseModel, WrapValidator, ConfigDict
 from pydantic_core.core_schema import ValidatorFunctionWrapHandler, ValidationInfo
+from starlette.responses import JSONResponse
+
+from common import tracing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# RawJSON 在输出中的占位字符串, 带进程随机数避免与业务数据冲突
+_RAW_JSON_MARKER = f"__raw_json_{os.urandom(8).hex()}_"
 
 
 def maybe_strip_whitespace(
@@ -16,7 +31,10 @@ def maybe_strip_whitespace(
 
 
 def datetime_to_gmt_str(dt: datetime) -> str:
-    return dt.strftime("%Y-%m-%d %H:%M:%S")
+    # 等价于 dt.strftime("%Y-%m-%d %H:%M:%S"), isoformat 快 3 倍左右
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None)
+    return dt.isoformat(" ", "seconds")
 
 
 model_config = ConfigDict(
@@ -32,45 +50,171 @@ class CustomModel(BaseModel):
     )
 
 
-def Res(data_model = None, validate: bool = True):
+class SoftResponseModel(CustomModel):
+    """Base of the ``validate=False`` envelopes, BaseView renders their routes with FastJSONResponse directly."""
+
+
+def fast_json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return datetime_to_gmt_str(value)
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, BaseModel):
+        return value.model_dump(by_alias=True)
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    if hasattr(value, "_asdict"):
+        return value._asdict()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, bytes):
+        return value.decode()
+    raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+
+class RawJSON(bytes):
+    """Already serialized JSON, FastJSONResponse embeds it into the body as is."""
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with orjson (json when orjson is not installed).
+
+    ORM objects, rows, pydantic models and datetimes are serialized by ``fast_json_default``
+    while dumping, so the content does not have to go through ``jsonable_encoder`` first.
+    ``RawJSON`` values are spliced into the output without being parsed again.
+    """
+
+    def render(self, content: Any) -> bytes:
+        with tracing.span("serialize"):
+            return self._render(content)
+
+    def _render(self, content: Any) -> bytes:
+        fragments: list[RawJSON] = []
+
+        def default(value: Any) -> Any:
+            if isinstance(value, RawJSON):
+                fragments.append(value)
+                return f"{_RAW_JSON_MARKER}{len(fragments) - 1}"
+            return fast_json_default(value)
+
+        if orjson is not None:
+            body = orjson.dumps(
+                content, default=default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        else:
+            body = json.dumps(
+                content, default=default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+            ).encode("utf-8")
+        for index, fragment in enumerate(fragments):
+            body = body.replace(f'"{_RAW_JSON_MARKER}{index}"'.encode(), fragment, 1)
+        return body
+
+
+def contains_raw_json(data: Any) -> bool:
+    if isinstance(data, RawJSON):
+        return True
+    if isinstance(data, dict):
+        return any(isinstance(value, RawJSON) for value in data.values())
+    return False
+
+
+# (工厂, data_model, validate) -> 响应模型, 相同的响应结构共用一个已编译的 pydantic 模型
+_response_models: dict[tuple, type[BaseModel]] = {}
+
+
+def _cached_response_model(factory, data_model, validate: bool) -> type[BaseModel]:
+    key = (factory, data_model, validate)
+    try:
+        return _response_models[key]
+    except KeyError:
+        model = _response_models[key] = factory(data_model, validate)
+        return model
+    except TypeError:
+        # data_model 不可哈希时不缓存
+        return factory(data_model, validate)
+
+
+def _build_res(data_model, validate: bool) -> type[BaseModel]:
     data_model = data_model or Union[dict, None, list, str, Any]
-    class ResponseModel(CustomModel):
-        model_config = model_config
-        code: int = 0
-        data: data_model
-        message: str = "Success"
+    if validate:
+        class ResponseModel(CustomModel):
+            model_config = model_config
+            code: int = 0
+            data: data_model
+            message: str = "Success"
+
+        return ResponseModel
 
-    class ResponseSoftModel(CustomModel):
+    class ResponseSoftModel(SoftResponseModel):
         model_config = model_config
         code: int = 0
         data: Annotated[data_model, WrapValidator(maybe_strip_whitespace)] = None
         message: str = "Success"
 
-    if validate:
-        return ResponseModel
-    else:
-        return ResponseSoftModel
+    return ResponseSoftModel
 
 
-def ListRes(data_model, validate: bool = True):
+def _build_list_res(data_model, validate: bool) -> type[BaseModel]:
     class ListResponseModel(CustomModel):
         model_config = model_config
         total: int = 0
         items: list[data_model]
 
-    class ResponseModel(CustomModel):
-        model_config = model_config
-        code: int = 0
-        data: ListResponseModel
-        message: str = "Success"
+    if validate:
+        class ResponseModel(CustomModel):
+            model_config = model_config
+            code: int = 0
+            data: ListResponseModel
+            message: str = "Success"
 
-    class ResponseSoftModel(CustomModel):
+        return ResponseModel
+
+    class ResponseSoftModel(SoftResponseModel):
         model_config = model_config
         code: int = 0
         data: Annotated[ListResponseModel, WrapValidator(maybe_strip_whitespace)] = None
         message: str = "Success"
 
-    if validate:
-        return ResponseModel
-    else:
-        return ResponseSoftModel
+    return ResponseSoftModel
+
+
+def Res(data_model = None, validate: bool = True):
+    return _cached_response_model(_build_res, data_model, validate)
+
+
+def ListRes(data_model, validate: bool = True):
+    return _cached_response_model(_build_list_res, data_model, validate)
+
+
+def accepts_encoding(accept_encoding: str, coding: str = "gzip") -> bool:
+    """
+    Whether an ``Accept-Encoding`` header value allows ``coding``: listed (or matched by ``*``)
+    with a q-value above 0, so ``gzip;q=0`` refuses gzip.
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    coding = coding.lower()
+    if coding in qualities:
+        return qualities[coding] > 0
+    if coding == "gzip" and "x-gzip" in qualities:
+        return qualities["x-gzip"] > 0
+    return qualities.get("*", 0) > 0
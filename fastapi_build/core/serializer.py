@@ -0,0 +1,61 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 17:05
+# @Author : PinBar
+# @File : serializer.py
+import json
+from typing import Callable, Sequence, Iterable
+
+from sqlalchemy import types
+from sqlalchemy.sql.elements import ColumnElement
+
+from core.response import RawJSON, fast_json_default, orjson
+
+RowSerializer = Callable[[Iterable[Sequence]], RawJSON]
+
+# (列名, 列类型) -> 编译好的序列化函数
+_serializers: dict[tuple, RowSerializer] = {}
+
+
+def _dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=fast_json_default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=fast_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _value_expression(index: int, column_type: types.TypeEngine) -> str:
+    value = f"r[{index}]"
+    if isinstance(column_type, types.DateTime) and column_type.timezone is not True:
+        # naive datetime 直接 isoformat, 与 datetime_to_gmt_str 输出一致, 省去 default 回调
+        return f"({value}.isoformat(' ', 'seconds') if {value} is not None else None)"
+    if isinstance(column_type, types.Numeric) and not isinstance(column_type, types.Float) \
+            and getattr(column_type, "asdecimal", False):
+        return f"(float({value}) if {value} is not None else None)"
+    return value
+
+
+def compile_row_serializer(keys: Sequence[str], column_types: Sequence[types.TypeEngine]) -> RowSerializer:
+    """
+    Build a function turning row tuples into a JSON array of objects in one dumps call.
+
+    The generated code reads every value by index and converts datetime / decimal columns inline,
+    so a row costs one dict instead of ``_asdict()`` + pydantic model + ``jsonable_encoder`` copies.
+    Serializers are cached by the column names and types.
+    """
+    cache_key = (tuple(keys), tuple(repr(t) for t in column_types))
+    serializer = _serializers.get(cache_key)
+    if serializer is not None:
+        return serializer
+    fields = ", ".join(
+        f"{key!r}: {_value_expression(index, column_type)}"
+        for index, (key, column_type) in enumerate(zip(keys, column_types))
+    )
+    source = f"def serialize(rows):\n    return _RawJSON(_dumps([{{{fields}}} for r in rows]))\n"
+    namespace = {"_dumps": _dumps, "_RawJSON": RawJSON}
+    exec(compile(source, f"<row_serializer {', '.join(keys)}>", "exec"), namespace)
+    serializer = _serializers[cache_key] = namespace["serialize"]
+    return serializer
+
+
+def row_serializer(keys: Sequence[str], columns: Sequence[ColumnElement]) -> RowSerializer:
+    return compile_row_serializer(keys, [column.type for column in columns])
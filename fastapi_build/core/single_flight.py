@@ -0,0 +1,198 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 22:00
+# @Author : PinBar
+# @File : single_flight.py
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional, Iterable, Union
+
+from fastapi import Request
+from starlette.responses import Response
+
+from common import metrics
+from common.log import logger
+from config.settings import SINGLE_FLIGHT_TIMEOUT, SINGLE_FLIGHT_POLL_INTERVAL
+from core.cache import request_digest
+from core.context import g
+
+SINGLE_FLIGHT_PREFIX = "single_flight"
+# request.state 上的键, 领头请求的 Flight, 由 SingleFlightMiddleware 在响应发送后交给等待的请求
+FLIGHT_LEADER = "single_flight"
+MODE_LOCAL = "local"
+MODE_REDIS = "redis"
+# 不共享的响应头, 同一 key 下可能是不同的客户端 (如匿名用户)
+PRIVATE_HEADERS = (b"set-cookie",)
+
+# KEYS[1]: 锁, ARGV: 本次的 token, 过期毫秒数; 拿到锁返回 false, 否则返回持锁请求的 token
+ACQUIRE_SCRIPT = """
+local token = redis.call('GET', KEYS[1])
+if token then
+    return token
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return false
+"""
+# KEYS[1]: 锁, KEYS[2]: 结果; ARGV: token, 结果, 过期毫秒数. 结果为空表示领头请求没有可共享的响应
+RELEASE_SCRIPT = """
+redis.call('SET', KEYS[2], ARGV[2], 'PX', ARGV[3])
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+return 1
+"""
+
+shared_total = metrics.Counter("single_flight_shared", "Requests answered with the response of an identical request",
+                               ("route", "mode"))
+
+_flights: dict[str, "Flight"] = {}
+_scripts: dict[str, object] = {}
+
+
+@dataclass
+class SharedResponse:
+    status_code: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+
+    def to_response(self) -> Response:
+        response = Response(self.body, status_code=self.status_code)
+        response.raw_headers = [*self.headers, (b"x-single-flight", b"shared")]
+        return response
+
+    def encode(self) -> bytes:
+        header = {"s": self.status_code, "h": [[k.decode("latin-1"), v.decode("latin-1")] for k, v in self.headers]}
+        return json.dumps(header).encode() + b"\n" + self.body
+
+    @classmethod
+    def decode(cls, value: bytes) -> "SharedResponse":
+        header, body = value.split(b"\n", 1)
+        header = json.loads(header)
+        return cls(header["s"], [(k.encode("latin-1"), v.encode("latin-1")) for k, v in header["h"]], body)
+
+
+class Flight:
+    """One computation in flight in this worker, identical requests await ``future``."""
+
+    def __init__(self, key: str, route: str):
+        self.key = key
+        self.route = route
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # 跨 worker 模式下本请求持有的 Redis 锁
+        self.token: Optional[str] = None
+
+
+def flight_mode(single_flight: Union[bool, str, None]) -> Optional[str]:
+    """``api_description(single_flight=...)``: True / ``"local"`` within a worker, ``"redis"`` across workers."""
+    if not single_flight:
+        return None
+    mode = MODE_LOCAL if single_flight is True else single_flight
+    if mode not in (MODE_LOCAL, MODE_REDIS):
+        raise ValueError(f"Invalid single_flight {single_flight!r}, expected True, 'local' or 'redis'")
+    return mode
+
+
+def _lock_key(key: str) -> str:
+    return f"{SINGLE_FLIGHT_PREFIX}:lock:{key}"
+
+
+def _result_key(key: str, token: str) -> str:
+    return f"{SINGLE_FLIGHT_PREFIX}:result:{key}:{token}"
+
+
+def _get_script(source: str):
+    script = _scripts.get(source)
+    if script is None:
+        from db.redis_client import aio_r_cache
+
+        script = _scripts[source] = aio_r_cache.register_script(source)
+    return script
+
+
+def _wait_seconds() -> float:
+    remaining = g.remaining_time()
+    return SINGLE_FLIGHT_TIMEOUT if remaining is None else max(0.0, min(SINGLE_FLIGHT_TIMEOUT, remaining))
+
+
+async def _follow_remote(key: str, token: str) -> Optional[SharedResponse]:
+    """Poll for the response of the request holding the lock in another worker."""
+    from db.redis_client import aio_r_cache
+
+    deadline = time.monotonic() + _wait_seconds()
+    result_key = _result_key(key, token)
+    while time.monotonic() < deadline:
+        await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+        value = await aio_r_cache.get(result_key)
+        if value is not None:
+            return SharedResponse.decode(value) if value else None
+    return None
+
+
+async def join(route: str, request: Request, mode: str, vary_on: Iterable[str] = ()) -> Optional[Response]:
+    """
+    Return the response of an identical request already in flight, or None when this request has to
+    run the endpoint itself.
+
+    The first request for a key in a worker leads: its ``Flight`` is stored on ``request.state`` and
+    SingleFlightMiddleware hands the sent response to the followers. In ``redis`` mode the leader
+    also takes a short Redis lock, leaders in other workers then wait for its published response
+    instead of running the endpoint. Without a shared response (the leader failed, timed out or
+    streamed) a follower runs the endpoint itself.
+    """
+    key = f"{route}:{request_digest(request, vary_on)}"
+    flight = _flights.get(key)
+    if flight is not None:
+        try:
+            shared = await asyncio.wait_for(asyncio.shield(flight.future), _wait_seconds())
+        except asyncio.TimeoutError:
+            return None
+        if shared is None:
+            return None
+        shared_total.labels(route, mode).inc()
+        return shared.to_response()
+
+    flight = _flights[key] = Flight(key, route)
+    setattr(request.state, FLIGHT_LEADER, flight)
+    if mode != MODE_REDIS:
+        return None
+    token = uuid.uuid4().hex
+    try:
+        holder = await _get_script(ACQUIRE_SCRIPT)(keys=[_lock_key(key)],
+                                                   args=[token, int(SINGLE_FLIGHT_TIMEOUT * 1000)])
+        if holder is None:
+            flight.token = token
+            return None
+        shared = await _follow_remote(key, holder.decode() if isinstance(holder, bytes) else holder)
+    except Exception:
+        logger.warning(f"single flight redis unavailable, route={route}")
+        return None
+    if shared is None:
+        return None
+    # 本 worker 里等待的请求一并拿到结果
+    setattr(request.state, FLIGHT_LEADER, None)
+    _complete_local(flight, shared)
+    shared_total.labels(route, mode).inc()
+    return shared.to_response()
+
+
+def _complete_local(flight: Flight, shared: Optional[SharedResponse]):
+    if _flights.get(flight.key) is flight:
+        del _flights[flight.key]
+    if not flight.future.done():
+        flight.future.set_result(shared)
+
+
+async def complete(flight: Flight, shared: Optional[SharedResponse]):
+    """Called by SingleFlightMiddleware once the leader's response is sent, or when it failed."""
+    _complete_local(flight, shared)
+    if flight.token is None:
+        return
+    try:
+        await _get_script(RELEASE_SCRIPT)(
+            keys=[_lock_key(flight.key), _result_key(flight.key, flight.token)],
+            args=[flight.token, shared.encode() if shared is not None else b"", int(SINGLE_FLIGHT_TIMEOUT * 1000)],
+        )
+    except Exception:
+        logger.warning(f"single flight publish fail, route={flight.route}")
@@ -0,0 +1,181 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 13:05
+# @Author : PinBar
+# @File : streaming.py
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Any, Union, TYPE_CHECKING
+from urllib.parse import quote
+
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+
+from core.context import g
+from core.response import datetime_to_gmt_str, accepts_encoding
+
+if TYPE_CHECKING:
+    import pyarrow as pa  # noqa
+    from sqlalchemy import Select  # noqa
+    from dao.base.queryset import QuerySet  # noqa
+
+
+def _default(value: Any):
+    if isinstance(value, datetime):
+        return datetime_to_gmt_str(value)
+    return str(value)
+
+
+class CSVEncoder:
+    """The header comes from the selected columns, an empty export is still a header line."""
+    media_type = "text/csv"
+    suffix = "csv"
+
+    def __init__(self, query: "Select"):
+        self.header = [column.name for column in query.selected_columns]
+        self.header_written = False
+
+    def _header(self, writer):
+        writer.writerow(self.header)
+        self.header_written = True
+
+    def encode(self, rows: list[dict]) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not self.header_written:
+            self._header(writer)
+        writer.writerows(
+            [datetime_to_gmt_str(v) if isinstance(v, datetime) else v for v in row.values()] for row in rows
+        )
+        return buffer.getvalue().encode("utf-8")
+
+    def finish(self) -> bytes:
+        if self.header_written:
+            return b""
+        buffer = io.StringIO()
+        self._header(csv.writer(buffer))
+        return buffer.getvalue().encode("utf-8")
+
+
+class NDJSONEncoder:
+    media_type = "application/x-ndjson"
+    suffix = "ndjson"
+
+    def __init__(self, query: "Select"):
+        pass
+
+    def encode(self, rows: list[dict]) -> bytes:
+        return "".join(
+            json.dumps(row, default=_default, ensure_ascii=False) + "\n" for row in rows
+        ).encode("utf-8")
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class ArrowIPCEncoder:
+    """
+    Encode record batches as an arrow IPC stream. The schema message goes out with the first batch, or
+    from the selected columns at the end of an empty export.
+    """
+    media_type = "application/vnd.apache.arrow.stream"
+    suffix = "arrow"
+
+    def __init__(self, query: "Select"):
+        self.query = query
+        self.sink = io.BytesIO()
+        self.writer = None
+
+    def _drain(self) -> bytes:
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def encode(self, batch) -> bytes:
+        import pyarrow as pa
+
+        if self.writer is None:
+            self.writer = pa.ipc.new_stream(self.sink, batch.schema)
+        self.writer.write_batch(batch)
+        return self._drain()
+
+    def finish(self) -> bytes:
+        if self.writer is None:
+            # 没有数据时也要输出 schema, 否则不是合法的 IPC stream
+            from dao.base.arrow import RecordBatchBuilder, arrow_fields
+            import pyarrow as pa
+
+            schema = RecordBatchBuilder(arrow_fields(self.query)).schema
+            self.writer = pa.ipc.new_stream(self.sink, schema)
+        self.writer.close()
+        return self._drain()
+
+
+ENCODERS = {
+    "csv": CSVEncoder,
+    "ndjson": NDJSONEncoder,
+    "arrow": ArrowIPCEncoder,
+}
+
+
+class QuerySetStreamingResponse(StreamingResponse):
+    """
+    Stream the rows of a QuerySet as a csv, ndjson or arrow IPC (requires pyarrow) export file.
+    With ``gzip`` the body is compressed only when the request (``g.request`` by default) accepts it.
+
+    The rows are read through a server-side cursor ``chunk_size`` rows at a time and every chunk is
+    encoded (and gzip compressed if asked) as soon as it arrives, so the worker memory stays flat
+    whatever the export size. The body opens its own session, the request session is already closed
+    when the response starts streaming.
+    """
+
+    def __init__(self, queryset: "QuerySet", format: str = "csv", filename: str = None, gzip: bool = False,
+                 chunk_size: int = 1000, headers: dict = None, request: Request = None):
+        if format not in ENCODERS:
+            raise ValueError(f"Invalid export format {format}, supported formats: {'、'.join(ENCODERS)}")
+        self.queryset = queryset
+        self.encoder = ENCODERS[format](queryset.query)
+        self.chunk_size = chunk_size
+        request = request or g.request
+        self.gzip = gzip and request is not None and accepts_encoding(request.headers.get("accept-encoding", ""))
+        headers = dict(headers or {})
+        filename = filename or f"{queryset.model_cls.__tablename__}.{self.encoder.suffix}"
+        headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+        if gzip:
+            headers["Vary"] = "Accept-Encoding"
+        if self.gzip:
+            headers["Content-Encoding"] = "gzip"
+        super().__init__(self.iter_body(), media_type=self.encoder.media_type, headers=headers)
+
+    async def iter_rows(self) -> AsyncIterator[Union[list[dict], "pa.RecordBatch"]]:
+        from db.database import sessionmanager
+
+        session = sessionmanager.session_maker()
+        try:
+            if isinstance(self.encoder, ArrowIPCEncoder):
+                chunks = self.queryset.aiter_arrow_batches(self.chunk_size, _session=session)
+            else:
+                chunks = self.queryset.aiter_chunks(self.chunk_size, _session=session)
+            async for rows in chunks:
+                if len(rows):
+                    yield rows
+        finally:
+            await session.close()
+
+    async def iter_body(self) -> AsyncIterator[bytes]:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if self.gzip else None
+        async for rows in self.iter_rows():
+            data = self.encoder.encode(rows)
+            if compressor:
+                # 每个分块都 sync flush, 避免压缩缓冲推迟首字节
+                data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        tail = self.encoder.finish()
+        if compressor:
+            tail = compressor.compress(tail) + compressor.flush()
+        if tail:
+            yield tail
@@ -0,0 +1,173 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 14:10
+# @Author : PinBar
+# @File : arrow.py
+import json
+from typing import Iterator, AsyncIterator, Optional, Union, IO, Callable
+
+from sqlalchemy import types
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+try:
+    from sqlalchemy.sql import Select
+except:  # noqa
+    from sqlalchemy import Select
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from dao.base.database_fetch import database
+
+PYARROW_NOT_INSTALLED_MESSAGE = """
+pyarrow is not installed. Please install it using the following command:
+    pip install fastapi_build[arrow]
+"""
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError(PYARROW_NOT_INSTALLED_MESSAGE)
+
+
+def arrow_type(column_type: types.TypeEngine) -> "pa.DataType":
+    """
+    Map a SQLAlchemy column type to an arrow type. JSON and unmapped types are exported as
+    strings (see ``value_converter``), the schema is then known before the first row.
+    """
+    if isinstance(column_type, types.Boolean):
+        return pa.bool_()
+    if isinstance(column_type, types.SmallInteger):
+        return pa.int16()
+    if isinstance(column_type, types.Integer):
+        return pa.int64()
+    if isinstance(column_type, types.Float):
+        return pa.float64()
+    if isinstance(column_type, types.Numeric):
+        if column_type.precision and column_type.scale is not None:
+            return pa.decimal128(column_type.precision, column_type.scale)
+        return pa.float64()
+    if isinstance(column_type, types.DateTime):
+        # DateTime(3) is used as a precision on the models, only timezone=True means tz-aware
+        return pa.timestamp("us", tz="UTC" if column_type.timezone is True else None)
+    if isinstance(column_type, types.Date):
+        return pa.date32()
+    if isinstance(column_type, types.Time):
+        return pa.time64("us")
+    if isinstance(column_type, types.Interval):
+        return pa.duration("us")
+    if isinstance(column_type, types.LargeBinary):
+        return pa.binary()
+    return pa.string()
+
+
+def _dump_json(value) -> Optional[str]:
+    return None if value is None else json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _to_str(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def value_converter(column_type: types.TypeEngine) -> Optional[Callable]:
+    """How values of the column are turned into ``arrow_type``'s type, None when they already match."""
+    if isinstance(column_type, types.JSON):
+        return _dump_json
+    if isinstance(column_type, (types.Boolean, types.Integer, types.Float, types.Numeric, types.DateTime, types.Date,
+                                types.Time, types.Interval, types.LargeBinary, types.String)):
+        return None
+    return _to_str
+
+
+def column_query(query: Select) -> Select:
+    """``select(Model)`` returns ORM objects, select the plain columns instead so rows stay tuples."""
+    return query.with_only_columns(*query.selected_columns)
+
+
+def arrow_fields(query: Select) -> list[tuple[str, "pa.DataType", Optional[Callable]]]:
+    """(name, arrow type, value converter) of every selected column."""
+    require_pyarrow()
+    return [(column.name, arrow_type(column.type), value_converter(column.type))
+            for column in query.selected_columns]
+
+
+class RecordBatchBuilder:
+    """Build record batches column by column from row tuples, every batch has the same ``schema``."""
+
+    def __init__(self, fields: list[tuple[str, "pa.DataType", Optional[Callable]]]):
+        self.converters = [converter for _, _, converter in fields]
+        self.schema: "pa.Schema" = pa.schema([(name, t) for name, t, _ in fields])
+
+    def build(self, rows: list) -> "pa.RecordBatch":
+        columns = list(zip(*rows)) if rows else [[] for _ in self.converters]
+        arrays = [pa.array(values if converter is None else [converter(value) for value in values], type=field.type)
+                  for values, converter, field in zip(columns, self.converters, self.schema)]
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+
+def iter_record_batches(query: Select, batch_size: int = 10000,
+                        _session: Session = None) -> Iterator["pa.RecordBatch"]:
+    builder = RecordBatchBuilder(arrow_fields(query))
+    for rows in database.fetch_chunks(column_query(query), batch_size, _session=_session):
+        if rows:
+            yield builder.build(rows)
+
+
+async def aiter_record_batches(query: Select, batch_size: int = 10000,
+                               _session: AsyncSession = None) -> AsyncIterator["pa.RecordBatch"]:
+    builder = RecordBatchBuilder(arrow_fields(query))
+    async for rows in database.a_fetch_chunks(column_query(query), batch_size, _session=_session):
+        if rows:
+            yield builder.build(rows)
+
+
+def empty_table(query: Select) -> "pa.Table":
+    builder = RecordBatchBuilder(arrow_fields(query))
+    return pa.Table.from_batches([builder.build([])])
+
+
+def to_arrow(query: Select, batch_size: int = 10000, _session: Session = None) -> "pa.Table":
+    batches = list(iter_record_batches(query, batch_size, _session))
+    return pa.Table.from_batches(batches) if batches else empty_table(query)
+
+
+async def ato_arrow(query: Select, batch_size: int = 10000, _session: AsyncSession = None) -> "pa.Table":
+    batches = [batch async for batch in aiter_record_batches(query, batch_size, _session)]
+    return pa.Table.from_batches(batches) if batches else empty_table(query)
+
+
+def to_parquet(query: Select, path_or_stream: Union[str, IO], batch_size: int = 10000,
+               _session: Session = None, **kwargs) -> int:
+    writer, total = None, 0
+    try:
+        for batch in iter_record_batches(query, batch_size, _session):
+            if writer is None:
+                writer = pq.ParquetWriter(path_or_stream, batch.schema, **kwargs)
+            writer.write_batch(batch)
+            total += batch.num_rows
+        if writer is None:
+            pq.write_table(empty_table(query), path_or_stream, **kwargs)
+    finally:
+        if writer is not None:
+            writer.close()
+    return total
+
+
+async def ato_parquet(query: Select, path_or_stream: Union[str, IO], batch_size: int = 10000,
+                      _session: AsyncSession = None, **kwargs) -> int:
+    writer, total = None, 0
+    try:
+        async for batch in aiter_record_batches(query, batch_size, _session):
+            if writer is None:
+                writer = pq.ParquetWriter(path_or_stream, batch.schema, **kwargs)
+            writer.write_batch(batch)
+            total += batch.num_rows
+        if writer is None:
+            pq.write_table(empty_table(query), path_or_stream, **kwargs)
+    finally:
+        if writer is not None:
+            writer.close()
+    return total
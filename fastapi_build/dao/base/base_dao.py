@@ -3,7 +3,7 @@
 # @Author : PinBar
 # @File : base_dao.py
 
-from typing import TypeVar, Type, Optional, Union, Any, TYPE_CHECKING
+from typing import TypeVar, Type, Optional, Union, Any, Callable, TYPE_CHECKING
 
 from sqlalchemy import BinaryExpression, ColumnElement
 
@@ -84,21 +84,24 @@ class BaseDao(ModelManager):
         """
         return await QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().alast(field, to_dict)
 
-    def values(self, *fields: Union[ColumnElement, str]) -> list[dict]:
+    def values(self, *fields: Union[ColumnElement, str], as_json: bool = False) -> list[dict]:
         """
         Retrieve rows as dictionaries based on selected fields.
 
+        :param as_json: Return the rows as RawJSON instead of dictionaries.
         :return: List of dictionaries representing rows.
         """
-        return QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().values(*fields)
+        return QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().values(*fields, as_json=as_json)
 
-    async def avalues(self, *fields: Union[ColumnElement, str]) -> list[dict]:
+    async def avalues(self, *fields: Union[ColumnElement, str], as_json: bool = False) -> list[dict]:
         """
         Asynchronously retrieve rows as dictionaries based on selected fields.
 
+        :param as_json: Return the rows as RawJSON instead of dictionaries.
         :return: List of dictionaries representing rows.
         """
-        return await QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().avalues(*fields)
+        return await QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().avalues(
+            *fields, as_json=as_json)
 
     def values_list(
             self, *fields: Union[ColumnElement, str], flat: bool = False
@@ -208,14 +211,75 @@ class BaseDao(ModelManager):
         return await QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().a_aggregate(*aggregates)
 
     def pagination(
-            self, page: int = None, per_page: int = None
+            self, page: int = None, per_page: int = None, as_json: bool = False
     ) -> tuple[int, list[dict]]:
-        return QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().pagination(page, per_page)
+        return QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().pagination(
+            page, per_page, as_json=as_json)
 
     async def a_pagination(
-            self, page: int = None, per_page: int = None
+            self, page: int = None, per_page: int = None, as_json: bool = False
     ) -> tuple[int, list[dict]]:
-        return await QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().a_pagination(page, per_page)
+        return await QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().a_pagination(
+            page, per_page, as_json=as_json)
+
+    def to_arrow(self, batch_size: int = 10000):
+        """
+        Build an arrow table of all rows, requires pyarrow.
+
+        :param batch_size: Rows per record batch.
+        :return: pyarrow.Table with the schema taken from the model columns.
+        """
+        return QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().to_arrow(batch_size)
+
+    async def ato_arrow(self, batch_size: int = 10000):
+        """
+        Asynchronously build an arrow table of all rows, requires pyarrow.
+
+        :param batch_size: Rows per record batch.
+        :return: pyarrow.Table with the schema taken from the model columns.
+        """
+        return await QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().ato_arrow(batch_size)
+
+    def to_parquet(self, path_or_stream, batch_size: int = 10000, **kwargs) -> int:
+        """
+        Write all rows to a parquet file batch by batch, requires pyarrow.
+
+        :return: The number of rows written.
+        """
+        return QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().to_parquet(
+            path_or_stream, batch_size, **kwargs
+        )
+
+    async def ato_parquet(self, path_or_stream, batch_size: int = 10000, **kwargs) -> int:
+        """
+        Asynchronously write all rows to a parquet file batch by batch, requires pyarrow.
+
+        :return: The number of rows written.
+        """
+        return await QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().ato_parquet(
+            path_or_stream, batch_size, **kwargs
+        )
+
+    def partition(self, n: int, method: str = "minmax") -> list[QuerySet]:
+        """
+        Split the table into at most ``n`` non-overlapping primary key ranges.
+
+        :param n: The number of partitions.
+        :param method: ``minmax`` or ``quantile``.
+        :return: One QuerySet per primary key range.
+        """
+        return QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().partition(n, method)
+
+    def parallel_map(self, func: Callable[[Any], Any], workers: int = None, partitions: int = None,
+                     method: str = "minmax", chunk_size: int = 1000) -> list:
+        """
+        Run ``func`` over every row of the table in a process pool.
+
+        :return: The results of ``func`` in primary key range order.
+        """
+        return QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().parallel_map(
+            func, workers=workers, partitions=partitions, method=method, chunk_size=chunk_size
+        )
 
     def with_columns(self, *columns: Union[ColumnElement, str]) -> QuerySet:
         return QuerySet(model_cls=self.model_cls, filters=self._base_filter).filter().with_columns(*columns)
@@ -2,11 +2,11 @@
 # @Time : 2024/5/27 11:39
 # @Author : PinBar
 # @File : sql_tools.py
-from typing import Union, Any
+from typing import Union, Any, Iterator, AsyncIterator
 
 from sqlalchemy import select, func, text
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Query
+from sqlalchemy.orm import Query, Session
 
 try:
     from sqlalchemy.engine import Row, Result
@@ -14,7 +14,13 @@ try:
 except:
     from sqlalchemy import Select, Result, Row
 
+from common import tracing
 from core.context import g
+from core.response import RawJSON
+from core.serializer import row_serializer
+
+# session.info 中记录 atomic() 的嵌套层数, 大于 0 时 DAO 的 commit 只 flush
+ATOMIC_DEPTH_KEY = "atomic_depth"
 
 
 class QueryConverter:
@@ -129,6 +135,10 @@ class QueryConverter:
         """
         if not result:
             return result
+        with tracing.span("convert rows", rows=len(result)):
+            return self._convert_all(result, to_dict, value_list)
+
+    def _convert_all(self, result: list[Row], to_dict: bool, value_list: bool):
         first_row = result[0]
         objects = []
         is_model_instance = self.check_model_instance(first_row[0])
@@ -225,6 +235,92 @@ class QueryConverter:
         result = result.all()
         return self.convert_all(result, to_dict, value_list)
 
+    def fetchall_json(self, query: Select, _session: Session = None) -> RawJSON:
+        """
+        Fetch all results of a Select query as a JSON array of objects, see ``core.serializer``.
+
+        Entity selects (``select(User)``) are turned into plain column selects, rows are serialized
+        by a compiled serializer without building ORM objects or intermediate dicts.
+
+        Example:
+            query = select(User.username, User.create_time).where(User.id.in_([1,2]))
+            print(fetchall_json(query))
+            b'[{"username":"John","create_time":"2024-12-01 08:30:00"}]'
+        """
+        query = query.with_only_columns(*query.selected_columns)
+        session = _session or g.session_sync
+        result = session.execute(query)
+        return self._serialize_rows(result, query)
+
+    async def a_fetchall_json(self, query: Select, _session: AsyncSession = None) -> RawJSON:
+        query = query.with_only_columns(*query.selected_columns)
+        result = await self.async_execute(_session, query)
+        return self._serialize_rows(result, query)
+
+    @staticmethod
+    def _serialize_rows(result: Result, query: Select) -> RawJSON:
+        rows = result.all()
+        with tracing.span("serialize rows", rows=len(rows)):
+            return row_serializer(list(result.keys()), query.selected_columns)(rows)
+
+    def fetch_chunks(
+            self, query: Select, chunk_size: int = 1000, to_dict: bool = False, _session: Session = None
+    ) -> Iterator[Union[list[Row], list[dict]]]:
+        """
+        Fetch the results through a server-side cursor, ``chunk_size`` rows per round trip.
+
+        Args:
+            query (Select): SQLAlchemy Select query.
+            chunk_size (int, optional): Rows fetched per round trip. Defaults to 1000.
+            to_dict (bool, optional): Convert results to dictionaries if True. Defaults to False.
+            _session (Session, optional): Session object to execute the query with. Defaults to None.
+
+        Returns:
+            Iterator[Union[list[Row], list[dict]]]: One list of rows per chunk.
+
+        Example:
+            query = select(User.username, User.email)
+            for rows in fetch_chunks(query, chunk_size=2, to_dict=True):
+                print(rows)
+            [{'username': 'John', 'email': '<EMAIL>'}, {'username': 'Tom', 'email': '<EMAIL>'}]
+        """
+        session = _session or g.session_sync
+        result = session.execute(query.execution_options(yield_per=chunk_size))
+        try:
+            for rows in result.partitions():
+                yield self.convert_all(rows, to_dict)
+        finally:
+            result.close()
+
+    async def a_fetch_chunks(
+            self, query: Select, chunk_size: int = 1000, to_dict: bool = False, _session: AsyncSession = None
+    ) -> AsyncIterator[Union[list[Row], list[dict]]]:
+        """
+        Asynchronously fetch the results through a server-side cursor, ``chunk_size`` rows per round trip.
+
+        Args:
+            query (Select): SQLAlchemy Select query.
+            chunk_size (int, optional): Rows fetched per round trip. Defaults to 1000.
+            to_dict (bool, optional): Convert results to dictionaries if True. Defaults to False.
+            _session (AsyncSession, optional): AsyncSession object to execute the query with. Defaults to None.
+
+        Returns:
+            AsyncIterator[Union[list[Row], list[dict]]]: One list of rows per chunk.
+
+        Example:
+            query = select(User.username, User.email)
+            async for rows in a_fetch_chunks(query, chunk_size=2, to_dict=True):
+                print(rows)
+            [{'username': 'John', 'email': '<EMAIL>'}, {'username': 'Tom', 'email': '<EMAIL>'}]
+        """
+        session = _session or g.session
+        result = await session.stream(query.execution_options(yield_per=chunk_size))
+        try:
+            async for rows in result.partitions():
+                yield self.convert_all(rows, to_dict)
+        finally:
+            await result.close()
+
     def scalar(self, query: Union[Select]) -> Any:
         result = g.session_sync.execute(query).scalar()
         return result
@@ -321,8 +417,8 @@ class QueryConverter:
         return result.first()[0]
 
     def pagination(
-            self, query: Union[Select, Query], page: int = 1, per_page: int = 10
-    ) -> tuple[int, list[dict]]:
+            self, query: Union[Select, Query], page: int = 1, per_page: int = 10, as_json: bool = False
+    ) -> tuple[int, Union[list[dict], RawJSON]]:
         """
         Perform pagination on a SQLAlchemy Select or Query object.
 
@@ -330,6 +426,7 @@ class QueryConverter:
             query (Union[Select, Query]): SQLAlchemy Select or Query object.
             page (int, optional): Page number. Defaults to 1.
             per_page (int, optional): Number of results per page. Defaults to 10.
+            as_json (bool, optional): Return the page as RawJSON (Select only). Defaults to False.
 
         Returns:
             tuple[int, list[dict]]: Total count of results and list of results for the requested page.
@@ -349,7 +446,7 @@ class QueryConverter:
         paginate = query.offset(offset).limit(per_page)
         if isinstance(query, Select):
             total = self.fetch_count(query)
-            result = self.fetchall(paginate, to_dict=True)
+            result = self.fetchall_json(paginate) if as_json else self.fetchall(paginate, to_dict=True)
         else:
             total = query.count()
             result = self.query_to_dict_list(query)
@@ -361,7 +458,8 @@ class QueryConverter:
             page: int = 1,
             per_page: int = 10,
             _session: AsyncSession = None,
-    ) -> tuple[int, list[dict]]:
+            as_json: bool = False,
+    ) -> tuple[int, Union[list[dict], RawJSON]]:
         """
         Perform asynchronous pagination on a SQLAlchemy Select object.
 
@@ -370,6 +468,7 @@ class QueryConverter:
             page (int, optional): Page number. Defaults to 1.
             per_page (int, optional): Number of results per page. Defaults to 10.
             _session (AsyncSession, optional): AsyncSession object to execute the query with. Defaults to None.
+            as_json (bool, optional): Return the page as RawJSON. Defaults to False.
 
         Returns:
             tuple[int, list[dict]]: Total count of results and list of results for the requested page.
@@ -389,24 +488,58 @@ class QueryConverter:
         offset = (page - 1) * per_page
         total = await self.a_fetch_count(query, _session)
         paginate = query.offset(offset).limit(per_page)
-        result = await self.a_fetchall(paginate, to_dict=True, _session=_session)
+        if as_json:
+            result = await self.a_fetchall_json(paginate, _session=_session)
+        else:
+            result = await self.a_fetchall(paginate, to_dict=True, _session=_session)
         return total, result
 
+    @staticmethod
+    def in_atomic(session: Union[Session, AsyncSession]) -> bool:
+        """Whether the session is inside ``sessionmanager.atomic()`` / ``aatomic()``."""
+        return session.info.get(ATOMIC_DEPTH_KEY, 0) > 0
+
+    def commit(self, _session: Session = None):
+        """Commit the session, inside an atomic block only flush and leave the commit to the block."""
+        session = _session or g.session_sync
+        if self.in_atomic(session):
+            session.flush()
+        else:
+            session.commit()
+
+    async def a_commit(self, _session: AsyncSession = None):
+        session = _session or g.session
+        if self.in_atomic(session):
+            await session.flush()
+        else:
+            await session.commit()
+
+    def rollback(self, _session: Session = None):
+        """Roll back the session, inside an atomic block the block rolls back its own savepoint."""
+        session = _session or g.session_sync
+        if not self.in_atomic(session):
+            session.rollback()
+
+    async def a_rollback(self, _session: AsyncSession = None):
+        session = _session or g.session
+        if not self.in_atomic(session):
+            await session.rollback()
+
     async def aexecute_update(self, stmt: Select) -> int:
         try:
             res = await g.session.execute(stmt)
-            await g.session.commit()
+            await self.a_commit()
         except Exception:
-            await g.session.rollback()
+            await self.a_rollback()
             raise
         return res.rowcount
 
     def execute_update(self, stmt: Select) -> int:
         try:
             res = g.session_sync.execute(stmt)
-            g.session_sync.commit()
+            self.commit()
         except Exception:
-            g.session_sync.rollback()
+            self.rollback()
             raise
         return res.rowcount
 
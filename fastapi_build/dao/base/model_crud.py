@@ -8,16 +8,19 @@ Time: 2024/12/2
 """
 from typing import Union, List, Dict, Any, Optional, TypeVar, Type, TYPE_CHECKING
 
-from sqlalchemy import update, delete, ColumnElement
+from sqlalchemy import update, delete, inspect, ColumnElement
 
+from dao.base.database_fetch import database
 from dao.base.queryset import QuerySet
+from dao.base.write_buffer import get_write_buffer
 
 try:
-    from sqlalchemy.engine import Row, Result
-    from sqlalchemy.sql import Select
+    from sqlalchemy.engine import Row, Result, Dialect
+    from sqlalchemy.sql import Select, Update
 except:  # noqa
-    from sqlalchemy import Select, Result, Row
+    from sqlalchemy import Select, Update, Result, Row, Dialect
 from sqlalchemy.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 
 from core.context import g
 from exceptions.custom_exception import NotFoundError
@@ -30,6 +33,32 @@ T = TypeVar("T", bound="Union[BaseModel,Table]")
 Rs = TypeVar("Rs", bound="Result[Union[BaseModel,Table, Any]]")
 
 
+async def a_refresh_unloaded(session: AsyncSession, obj: T, inserted: bool = False):
+    """
+    Server generated values come back with INSERT/UPDATE ... RETURNING on dialects that support it,
+    only SELECT the columns still unloaded, e.g. server defaults on MySQL.
+
+    :param inserted: obj was just inserted, columns left out of the INSERT without a server default are NULL
+    """
+    state = inspect(obj)
+    # 过期的属性(commit 时 expire_on_commit、flush 后待取回的服务端默认值)有真实值, 需要重新读取;
+    # 从未加载也未过期的才是 INSERT 中没有的列
+    expired = state.expired_attributes
+    refresh_keys = []
+    for key in state.unloaded:
+        prop = state.mapper.column_attrs.get(key)
+        if prop is None:
+            continue
+        column = prop.columns[0]
+        if (inserted and key not in expired
+                and column.server_default is None and column.server_onupdate is None):
+            set_committed_value(obj, key, None)
+        else:
+            refresh_keys.append(key)
+    if refresh_keys:
+        await session.refresh(obj, attribute_names=refresh_keys)
+
+
 class ModelManager(object):
     model_cls: Type[T] = None  # noqa
     base_filter = ()
@@ -56,9 +85,9 @@ class ModelManager(object):
             g.session_sync.add(obj)
             g.session_sync.flush()
             if commit:
-                g.session_sync.commit()
+                database.commit()
         except Exception as ex:  # pragma: no cover
-            g.session_sync.rollback()
+            database.rollback()
             raise ex
         return obj
 
@@ -73,11 +102,12 @@ class ModelManager(object):
         for key, value in properties.items():
             setattr(model, key if isinstance(key, str) else key.name, value)
         try:
-            g.session_sync.merge(model)
+            if model not in g.session_sync:
+                g.session_sync.merge(model)
             if commit:
-                g.session_sync.commit()
+                database.commit()
         except Exception as ex:  # pragma: no cover
-            g.session_sync.rollback()
+            database.rollback()
             raise ex
         return model
 
@@ -88,9 +118,38 @@ class ModelManager(object):
             commit: bool = True,
             raise_not_found: bool = False
     ) -> int:
-        obj = QuerySet(model_cls=self.model_cls, filters=self._base_filter).get_by_id(model_id, raise_not_found=raise_not_found)
-        new_obj = self.update_obj(obj, properties, commit=commit)
-        return new_obj
+        if not properties:
+            return QuerySet(model_cls=self.model_cls, filters=self._base_filter).get_by_id(model_id, raise_not_found=raise_not_found)
+        session = g.session_sync
+        stmt, returning = self._update_by_id_stmt(model_id, properties, session.get_bind().dialect)
+        try:
+            result = session.execute(stmt)
+            obj = result.scalars().first() if returning else None
+            updated = obj is not None if returning else result.rowcount > 0
+            if commit:
+                database.commit()
+        except Exception as ex:
+            database.rollback()
+            raise ex
+        if not updated:
+            if raise_not_found:
+                raise NotFoundError()
+            return None
+        if obj is None:
+            obj = QuerySet(model_cls=self.model_cls, filters=self._base_filter).get_by_id(model_id)
+        return obj
+
+    def _update_by_id_stmt(self, model_id: Union[int, str], properties: Dict[Union[ColumnElement, str], Any],
+                           dialect: Dialect) -> tuple[Update, bool]:
+        """
+        One ``UPDATE ... WHERE id = :id AND <base_filter>`` instead of SELECT + merge + refresh,
+        the updated row comes back with RETURNING when the dialect supports it.
+        """
+        col = getattr(self.model_cls, "id")
+        stmt = update(self.model_cls).where(col == model_id, *self.base_filter).values(properties)
+        if dialect.update_returning:
+            return stmt.returning(self.model_cls), True
+        return stmt, False
 
     def update_by_ids(
             self,
@@ -106,9 +165,9 @@ class ModelManager(object):
         if commit:
             try:
                 g.session_sync.flush()
-                g.session_sync.commit()
+                database.commit()
             except Exception as ex:
-                g.session_sync.rollback()
+                database.rollback()
                 raise ex
         return modify_count
 
@@ -117,9 +176,9 @@ class ModelManager(object):
         try:
             g.session_sync.delete(model)
             if commit:
-                g.session_sync.commit()
+                database.commit()
         except Exception as ex:  # pragma: no cover
-            g.session_sync.rollback()
+            database.rollback()
             raise ex
         return model
 
@@ -144,9 +203,9 @@ class ModelManager(object):
                 synchronize_session=False
             )
             if commit:
-                g.session_sync.commit()
+                database.commit()
         except Exception as ex:
-            g.session_sync.rollback()
+            database.rollback()
             raise ex
         return modify_count
 
@@ -166,20 +225,17 @@ class ModelManager(object):
             commit: bool = True,
             raise_not_found: bool = False
     ) -> int:
-        query = self.get_query()
         id_col = getattr(self.model_cls, "id", None)
+        stmt = update(self.model_cls).where(id_col == model_id, *self.base_filter).values({delete_field: 1})
         try:
-            query = query.filter(id_col == model_id)
-            if not query.first() and raise_not_found:
-                raise NotFoundError()
-            modify_count = query.update(
-                {delete_field: 1}
-            )
+            modify_count = g.session_sync.execute(stmt).rowcount
             if commit:
-                g.session_sync.commit()
+                database.commit()
         except Exception as ex:
-            g.session_sync.rollback()
+            database.rollback()
             raise ex
+        if not modify_count and raise_not_found:
+            raise NotFoundError()
         return modify_count
 
     def soft_delete_by_ids(
@@ -196,9 +252,9 @@ class ModelManager(object):
                 synchronize_session=False
             )
             if commit:
-                g.session_sync.commit()
+                database.commit()
         except Exception as ex:
-            g.session_sync.rollback()
+            database.rollback()
             raise ex
         return modify_count
 
@@ -214,13 +270,21 @@ class ModelManager(object):
             session.add(obj)
             await session.flush()
             if commit:
-                await session.commit()
+                await database.a_commit(session)
         except Exception as ex:
-            await session.rollback()
+            await database.a_rollback(session)
             raise ex
-        await session.refresh(obj)
+        await a_refresh_unloaded(session, obj, inserted=True)
         return obj
 
+    async def a_buffered_create(self, **properties: Dict[Union[ColumnElement, str], Any]) -> None:
+        """
+        Queue the row in the model's write-behind buffer instead of inserting it now,
+        for append-only rows (audit, events) that nobody reads back on the request path.
+        The row is inserted by the next bulk flush, so nothing is returned.
+        """
+        await get_write_buffer(self.model_cls).put(**properties)
+
     @staticmethod
     async def a_update_obj(
             model: Rs,
@@ -232,10 +296,10 @@ class ModelManager(object):
             setattr(model, key if isinstance(key, str) else key.name, value)
         try:
             if commit:
-                await session.commit()
-            await session.refresh(model)
+                await database.a_commit(session)
+            await a_refresh_unloaded(session, model)
         except Exception as ex:  # pragma: no cover
-            await session.rollback()
+            await database.a_rollback(session)
             raise ex
         return model
 
@@ -247,8 +311,26 @@ class ModelManager(object):
             properties: dict = None,
 
     ) -> int:
-        obj = await QuerySet(model_cls=self.model_cls, filters=self._base_filter).aget_by_id(model_id, raise_not_found=raise_not_found)
-        return await self.a_update_obj(obj, commit=commit, properties=properties)
+        if not properties:
+            return await QuerySet(model_cls=self.model_cls, filters=self._base_filter).aget_by_id(model_id, raise_not_found=raise_not_found)
+        session: AsyncSession = g.session
+        stmt, returning = self._update_by_id_stmt(model_id, properties, session.get_bind().dialect)
+        try:
+            result = await session.execute(stmt)
+            obj = result.scalars().first() if returning else None
+            updated = obj is not None if returning else result.rowcount > 0
+            if commit:
+                await database.a_commit(session)
+        except Exception as ex:
+            await database.a_rollback(session)
+            raise ex
+        if not updated:
+            if raise_not_found:
+                raise NotFoundError()
+            return None
+        if obj is None:
+            obj = await QuerySet(model_cls=self.model_cls, filters=self._base_filter).aget_by_id(model_id)
+        return obj
 
     async def a_update_by_ids(
             self,
@@ -267,9 +349,9 @@ class ModelManager(object):
             )
             result = await session.execute(stmt)
             if commit:
-                await session.commit()
+                await database.a_commit(session)
         except Exception as ex:
-            await g.session.rollback()
+            await database.a_rollback(session)
             raise ex
         else:
             return result.rowcount  # noqa
@@ -283,9 +365,9 @@ class ModelManager(object):
         try:
             await session.delete(model)
             if commit:
-                await session.commit()
+                await database.a_commit(session)
         except Exception as ex:
-            await session.rollback()
+            await database.a_rollback(session)
             raise ex
         return model
 
@@ -308,9 +390,9 @@ class ModelManager(object):
             query = delete(self.model_cls).where(self.model_cls.id.in_(model_ids))
             result = await session.execute(query)
             if commit:
-                await session.commit()
+                await database.a_commit(session)
         except Exception as ex:
-            await session.rollback()
+            await database.a_rollback(session)
             raise ex
         return result.rowcount  # noqa
 
@@ -0,0 +1,60 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 11:30
+# @Author : PinBar
+# @File : parallel.py
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import Callable, Any, TYPE_CHECKING
+
+from core.context import g
+from dao.base.database_fetch import database
+
+if TYPE_CHECKING:
+    from dao.base.queryset import QuerySet  # noqa
+
+_partitions: list["QuerySet"] = []
+_func: Callable = None
+_chunk_size: int = 1000
+
+
+def _init_worker(partitions: list["QuerySet"], func: Callable, chunk_size: int):
+    """
+    Runs once in every forked worker, the pooled connections inherited from the parent
+    process must not be shared, so drop them without closing the parent's sockets.
+    """
+    global _partitions, _func, _chunk_size
+    from db.database import sessionmanager
+
+    sessionmanager.engine_sync.dispose(close=False)
+    sessionmanager.engine.sync_engine.dispose(close=False)
+    _partitions, _func, _chunk_size = partitions, func, chunk_size
+
+
+def _run_partition(index: int) -> list:
+    from db.database import sessionmanager
+
+    queryset = _partitions[index]
+    results = []
+    with sessionmanager.bind_session_sync():
+        result = g.session_sync.execute(queryset.query.execution_options(yield_per=_chunk_size))
+        for rows in result.partitions():
+            results.extend(_func(row) for row in database.convert_all(rows))
+    return results
+
+
+def parallel_map(partitions: list["QuerySet"], func: Callable[[Any], Any], workers: int,
+                 chunk_size: int = 1000) -> list:
+    """
+    Run ``func`` over every row of each partition in a process pool, results keep the partition order.
+
+    Workers are forked, so ``func`` and the partitions are inherited instead of pickled,
+    only the return values of ``func`` must be picklable.
+    """
+    if not partitions:
+        return []
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=min(workers, len(partitions)), mp_context=context,
+                             initializer=_init_worker, initargs=(partitions, func, chunk_size)) as executor:
+        results = executor.map(_run_partition, range(len(partitions)))
+        return list(chain.from_iterable(results))
@@ -0,0 +1,120 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 10:12
+# @Author : PinBar
+# @File : query_recorder.py
+import atexit
+import json
+import os
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Optional
+
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, ColumnClause, UnaryExpression
+
+from config.settings import QUERY_SHAPE_DIR, QUERY_SHAPE_FLUSH_INTERVAL
+
+EQUALITY_OPERATORS = {operators.eq, operators.in_op, operators.is_}
+RANGE_OPERATORS = {
+    operators.lt, operators.le, operators.gt, operators.ge, operators.between_op,
+    operators.like_op, operators.ilike_op, operators.startswith_op,
+}
+
+
+def _column_name(element, table_name: str) -> Optional[str]:
+    if not isinstance(element, ColumnClause):
+        return None
+    table = getattr(element, "table", None)
+    if table is None or getattr(table, "name", None) != table_name:
+        return None
+    return element.name
+
+
+def extract_where_columns(table_name: str, where_clauses: Iterable) -> tuple[tuple, tuple]:
+    """
+    Split the columns referenced by where clauses into equality and range columns.
+
+    A ``LIKE '%xx'`` with a leading wildcard can not use an index, so it is ignored.
+    """
+    equality, ranges = set(), set()
+    for clause in where_clauses:
+        for element in visitors.iterate(clause):
+            if not isinstance(element, BinaryExpression):
+                continue
+            name = _column_name(element.left, table_name)
+            if name is None:
+                continue
+            if element.operator in EQUALITY_OPERATORS:
+                equality.add(name)
+            elif element.operator in RANGE_OPERATORS:
+                right = element.right
+                if (element.operator in (operators.like_op, operators.ilike_op)
+                        and isinstance(right, BindParameter) and str(right.value).startswith("%")):
+                    continue
+                ranges.add(name)
+    return tuple(sorted(equality)), tuple(sorted(ranges - equality))
+
+
+def extract_order_columns(table_name: str, order_by: Iterable) -> tuple:
+    columns = []
+    for clause in order_by:
+        desc = False
+        if isinstance(clause, UnaryExpression):
+            desc = clause.modifier is operators.desc_op
+            clause = clause.element
+        name = _column_name(clause, table_name)
+        if name is not None:
+            columns.append(f"-{name}" if desc else name)
+    return tuple(columns)
+
+
+class QueryShapeRecorder:
+    """
+    Opt-in recorder of the filter/order column sets used by QuerySet at runtime.
+
+    Enable it with the ``QUERY_SHAPE_DIR`` setting, every process dumps its counters to
+    ``<QUERY_SHAPE_DIR>/shapes_<pid>.json``, ``fbuild suggest_indexes`` reads them back.
+    """
+
+    def __init__(self, directory: str = None, flush_interval: int = 60):
+        self.directory = directory
+        self.enabled = bool(directory)
+        self.flush_interval = flush_interval
+        self._shapes = Counter()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        if self.enabled:
+            atexit.register(self.flush)
+
+    def record(self, table_name: str, where_clauses: Iterable, order_by: Iterable = ()):
+        equality, ranges = extract_where_columns(table_name, where_clauses)
+        order = extract_order_columns(table_name, order_by)
+        if not (equality or ranges or order):
+            return
+        with self._lock:
+            self._shapes[(table_name, equality, ranges, order)] += 1
+        if time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._last_flush = time.monotonic()
+            shapes = [
+                {"table": table, "equality": list(equality), "range": list(ranges), "order": list(order),
+                 "count": count}
+                for (table, equality, ranges, order), count in self._shapes.items()
+            ]
+        directory = Path(self.directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"shapes_{os.getpid()}.json"
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(shapes, fp)
+        os.replace(tmp_path, path)
+
+
+query_recorder = QueryShapeRecorder(QUERY_SHAPE_DIR, QUERY_SHAPE_FLUSH_INTERVAL)
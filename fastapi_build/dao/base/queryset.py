@@ -6,10 +6,13 @@ Author: Zoe
 File: queryset.py
 Time: 2024/11/26
 """
+import os
 from itertools import chain
-from typing import Type, Union, Optional, TypeVar, Any, TYPE_CHECKING, overload, Dict
+from typing import Type, Union, Optional, TypeVar, Any, TYPE_CHECKING, overload, Dict, Callable
 
-from sqlalchemy import select, exists, not_, update, delete
+from sqlalchemy import select, exists, not_, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 from sqlalchemy.sql.elements import BinaryExpression, ColumnElement
 
 try:
@@ -18,11 +21,15 @@ except:  # noqa
     from sqlalchemy import Select
 
 if TYPE_CHECKING:
+    import pyarrow as pa  # noqa
     from models import BaseModel  # noqa
     from sqlalchemy.schema import Table  # noqa
 
 from core.context import g
+from core.response import RawJSON
+from dao.base import parallel, arrow
 from dao.base.database_fetch import database
+from dao.base.query_recorder import query_recorder
 from exceptions.custom_exception import NotFoundError
 
 T = TypeVar("T", bound="Union[BaseModel,Table]")
@@ -45,6 +52,14 @@ class QuerySet:
         self.model_cls = model_cls
         self._iterator = None
 
+    def _clone(self) -> Self:
+        queryset = QuerySet(filters=list(self._filters), model_cls=self.model_cls)
+        queryset._order_by = list(self._order_by)
+        queryset._limit = self._limit
+        queryset._offset = self._offset
+        queryset._fields = list(self._fields)
+        return queryset
+
     def _get_model_field(self, *fields: Union[ColumnElement, str]) -> list[ColumnElement]:
         model_fields = []
         for field in fields:
@@ -78,6 +93,7 @@ class QuerySet:
         where = []
         if self._filters:
             where.extend(self._filters)
+        self._record_shape()
         query = entities.where(*where)
         if self._order_by:
             query = query.order_by(*self._order_by)
@@ -87,6 +103,10 @@ class QuerySet:
             query = query.offset(self._offset)
         return query
 
+    def _record_shape(self):
+        if query_recorder.enabled and self.model_cls is not None:
+            query_recorder.record(self.model_cls.__tablename__, self._filters, self._order_by)
+
     @overload
     def query(self) -> Select:
         ...
@@ -114,6 +134,47 @@ class QuerySet:
         row = await self._iterator.__anext__()
         return database.convert_one(row)
 
+    def iter_chunks(self, chunk_size: int = 1000, to_dict: bool = True, _session: Session = None):
+        """Iterate the results through a server-side cursor, one list of rows per ``chunk_size`` rows."""
+        return database.fetch_chunks(self.query, chunk_size, to_dict, _session=_session)
+
+    def aiter_chunks(self, chunk_size: int = 1000, to_dict: bool = True, _session: AsyncSession = None):
+        """Asynchronously iterate the results through a server-side cursor, one list per ``chunk_size`` rows."""
+        return database.a_fetch_chunks(self.query, chunk_size, to_dict, _session=_session)
+
+    def iter_arrow_batches(self, batch_size: int = 10000, _session: Session = None):
+        """Iterate the results as arrow record batches typed by the model columns, requires pyarrow."""
+        return arrow.iter_record_batches(self.query, batch_size, _session=_session)
+
+    def aiter_arrow_batches(self, batch_size: int = 10000, _session: AsyncSession = None):
+        """Asynchronously iterate the results as arrow record batches, requires pyarrow."""
+        return arrow.aiter_record_batches(self.query, batch_size, _session=_session)
+
+    def to_arrow(self, batch_size: int = 10000) -> "pa.Table":
+        """
+        Build an arrow table directly from the cursor chunks, requires pyarrow.
+
+        :param batch_size: Rows per record batch (and per round trip).
+        :return: pyarrow.Table with the schema taken from the selected columns.
+        """
+        return arrow.to_arrow(self.query, batch_size)
+
+    async def ato_arrow(self, batch_size: int = 10000) -> "pa.Table":
+        return await arrow.ato_arrow(self.query, batch_size)
+
+    def to_parquet(self, path_or_stream, batch_size: int = 10000, **kwargs) -> int:
+        """
+        Write the results to a parquet file batch by batch, requires pyarrow.
+
+        :param path_or_stream: File path or writable binary stream.
+        :param kwargs: Extra options of pyarrow.parquet.ParquetWriter, e.g. compression='zstd'.
+        :return: The number of rows written.
+        """
+        return arrow.to_parquet(self.query, path_or_stream, batch_size, **kwargs)
+
+    async def ato_parquet(self, path_or_stream, batch_size: int = 10000, **kwargs) -> int:
+        return await arrow.ato_parquet(self.query, path_or_stream, batch_size, **kwargs)
+
     def with_columns(self, *columns: Union[ColumnElement, str]) -> Self:
         columns = self._get_model_field(*columns)
         self._fields = columns
@@ -195,12 +256,17 @@ class QuerySet:
         query = self.query.order_by(field.desc()).limit(1)
         return await database.a_fetchone(query, to_dict=to_dict)
 
-    def values(self, *fields: Union[ColumnElement, str]) -> list[dict]:
+    def values(self, *fields: Union[ColumnElement, str], as_json: bool = False) -> Union[list[dict], RawJSON]:
+        """:param as_json: return the rows as RawJSON for FastJSONResponse, skipping the dicts"""
         query = self._get_values_query(*fields)
+        if as_json:
+            return database.fetchall_json(query)
         return database.fetchall(query, to_dict=True)
 
-    async def avalues(self, *fields: Union[ColumnElement, str]) -> list[dict]:
+    async def avalues(self, *fields: Union[ColumnElement, str], as_json: bool = False) -> Union[list[dict], RawJSON]:
         query = self._get_values_query(*fields)
+        if as_json:
+            return await database.a_fetchall_json(query)
         return await database.a_fetchall(query, to_dict=True)
 
     def values_list(self, *fields: Union[ColumnElement, str], flat: bool = False) -> Union[list[list], list]:
@@ -226,10 +292,12 @@ class QuerySet:
         return await database.a_fetch_count(self.query)
 
     def exists(self) -> bool:
+        self._record_shape()
         query = select(exists().where(*self._filters))
         return database.scalar(query)
 
     async def aexists(self) -> bool:
+        self._record_shape()
         query = select(exists().where(*self._filters))
         return await database.ascalar(query)
 
@@ -281,17 +349,20 @@ class QuerySet:
         result = await database.a_fetchone(aggregate_query, to_dict=True)
         return result
 
-    def pagination(self, page: int = None, per_page: int = None) -> tuple[int, list[dict]]:
-        total, data = database.pagination(self.query, page, per_page)
+    def pagination(self, page: int = None, per_page: int = None,
+                   as_json: bool = False) -> tuple[int, Union[list[dict], RawJSON]]:
+        total, data = database.pagination(self.query, page, per_page, as_json=as_json)
         return total, data
 
-    async def a_pagination(self, page: int = None, per_page: int = None) -> tuple[int, list[dict]]:
-        total, data = await database.a_pagination(self.query, page, per_page)
+    async def a_pagination(self, page: int = None, per_page: int = None,
+                           as_json: bool = False) -> tuple[int, Union[list[dict], RawJSON]]:
+        total, data = await database.a_pagination(self.query, page, per_page, as_json=as_json)
         return total, data
 
     async def aupdate(self, args: Dict[Union[ColumnElement, str], Any], **properties) -> int:
         if args:
             properties.update(args)
+        self._record_shape()
         stmt = update(self.model_cls).where(*self._filters).values(properties).execution_options(
             synchronize_session="fetch")
         return await database.aexecute_update(stmt)
@@ -299,15 +370,18 @@ class QuerySet:
     def update(self, args: Dict[Union[ColumnElement, str], Any], **properties) -> int:
         if args:
             properties.update(args)
+        self._record_shape()
         stmt = update(self.model_cls).where(*self._filters).values(properties).execution_options(
             synchronize_session="fetch")
         return database.execute_update(stmt)
 
     def delete(self) -> int:
+        self._record_shape()
         stmt = delete(self.model_cls).where(*self._filters)
         return database.execute_update(stmt)
 
     async def adelete(self):
+        self._record_shape()
         stmt = delete(self.model_cls).where(*self._filters)
         return await database.aexecute_update(stmt)
 
@@ -317,5 +391,64 @@ class QuerySet:
     async def asoft_delete(self) -> int:
         return await self.aupdate({self.model_cls.is_delete: True})
 
+    def _pk_boundaries(self, n: int, method: str = "minmax") -> list[int]:
+        pk = self.model_cls.id
+        if method == "quantile":
+            # 一次查询按 id 排序分成 n 桶, 取每桶的最小/最大 id, 不用逐个 OFFSET 扫描
+            bucket = func.ntile(n).over(order_by=pk).label("bucket")
+            ranked = select(pk.label("id"), bucket).where(*self._filters).subquery()
+            rows = database.fetchall(select(func.min(ranked.c.id), func.max(ranked.c.id))
+                                     .group_by(ranked.c.bucket).order_by(ranked.c.bucket))
+            rows = [(low, high) for low, high in rows if low is not None]
+            if not rows:
+                return []
+            return sorted({*(low for low, _ in rows), rows[-1][1] + 1})
+        if method != "minmax":
+            raise ValueError(f"Invalid partition method {method}, supported methods: minmax、quantile")
+        low, high = database.fetchone(select(func.min(pk), func.max(pk)).where(*self._filters))
+        if low is None:
+            return []
+        step = (high - low + 1) / n
+        return sorted({low, *(low + int(step * i) for i in range(1, n)), high + 1})
+
+    def partition(self, n: int, method: str = "minmax") -> list[Self]:
+        """
+        Split the query into at most ``n`` non-overlapping primary key ranges.
+
+        :param n: The number of partitions, at least 1.
+        :param method: ``minmax`` splits ``[min(id), max(id)]`` evenly, cheap but skewed by id gaps;
+            ``quantile`` buckets the ids with ``ntile(n)`` in one query, so partitions hold about the same
+            number of rows (needs window functions: MySQL 8+, SQLite 3.25+).
+        :return: One QuerySet per ``id >= low AND id < high`` range.
+        """
+        if n < 1:
+            raise ValueError(f"Invalid partition count {n}, must be at least 1")
+        if self._limit or self._offset:
+            # 每个分区都会带上 limit/offset, 合起来的结果与原查询不同
+            raise ValueError("Can not partition a QuerySet with limit or offset")
+        pk = self.model_cls.id
+        boundaries = self._pk_boundaries(n, method)
+        return [self._clone().filter(pk >= low, pk < high) for low, high in zip(boundaries, boundaries[1:])]
+
+    def parallel_map(self, func: Callable[[Any], Any], workers: int = None, partitions: int = None,
+                     method: str = "minmax", chunk_size: int = 1000) -> list:
+        """
+        Run ``func`` over every row of the query in a process pool, one primary key range per task.
+
+        Every worker process owns its engine and session, so CPU-heavy per-row processing scales with cores.
+
+        :param func: Called with each row, its return value must be picklable.
+        :param workers: Number of worker processes, defaults to the CPU count.
+        :param partitions: Number of primary key ranges, defaults to ``workers``.
+        :param method: ``minmax`` or ``quantile``, see ``partition``.
+        :param chunk_size: Rows fetched per round trip by the server-side cursor.
+        :return: The results of ``func`` in primary key range order.
+        """
+        workers = os.cpu_count() if workers is None else workers
+        if workers < 1:
+            raise ValueError(f"Invalid worker count {workers}, must be at least 1")
+        partitions = workers if partitions is None else partitions
+        return parallel.parallel_map(self.partition(partitions, method), func, workers, chunk_size)
+
     def as_sql(self):
         return self._build_query()
@@ -0,0 +1,201 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 15:02
+# @Author : PinBar
+# @File : write_buffer.py
+import asyncio
+import time
+from collections import defaultdict
+from typing import Type, Any, Optional, TYPE_CHECKING
+
+from sqlalchemy import insert
+
+from common import metrics
+from common.log import logger
+from config.settings import (WRITE_BUFFER_BATCH_SIZE, WRITE_BUFFER_FLUSH_INTERVAL, WRITE_BUFFER_MAX_SIZE,
+                             WRITE_BUFFER_MAX_RETRIES)
+from core.context import g
+
+if TYPE_CHECKING:
+    from models import BaseModel  # noqa
+
+
+class WriteBehindBuffer:
+    """
+    Collect the rows of an append-only model in memory and insert them in bulk.
+
+    ``put`` returns as soon as the row is queued, a background task flushes the queue every
+    ``batch_size`` rows or ``flush_interval`` seconds with one INSERT and one commit. The queue is
+    bounded, ``put`` waits when it is full so producers slow down instead of growing memory.
+    Rows still queued at shutdown are flushed by ``flush_write_buffers``.
+
+    A failed batch is retried ``max_retries`` times, the queue keeps filling (and producers wait)
+    meanwhile. After that its rows are inserted one by one, only the rows that still fail are
+    dropped and logged.
+    """
+
+    def __init__(self, model_cls: Type["BaseModel"], batch_size: int = WRITE_BUFFER_BATCH_SIZE,
+                 flush_interval: float = WRITE_BUFFER_FLUSH_INTERVAL, max_size: int = WRITE_BUFFER_MAX_SIZE,
+                 max_retries: int = WRITE_BUFFER_MAX_RETRIES):
+        self.model_cls = model_cls
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.flush_count = 0
+        self.last_flush_latency = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def metrics(self) -> dict:
+        return {
+            "depth": self.depth,
+            "flushed_rows": self.flushed_rows,
+            "failed_rows": self.failed_rows,
+            "flush_count": self.flush_count,
+            "last_flush_latency": self.last_flush_latency,
+        }
+
+    def _resolve_defaults(self, properties: dict) -> dict:
+        # python 端默认值在入队时计算, 例如 create_time、从 g 读取的 creator_id
+        row = dict(properties)
+        for column in self.model_cls.__table__.columns:
+            default = column.default
+            if column.key in row or default is None:
+                continue
+            if default.is_callable:
+                row[column.key] = default.arg(None)
+            elif default.is_scalar:
+                row[column.key] = default.arg
+        return row
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.max_size)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def put(self, **properties: Any):
+        """Queue one row, waits when the buffer is full."""
+        self._ensure_started()
+        await self._queue.put(self._resolve_defaults(properties))
+
+    def _drain(self, rows: list):
+        while len(rows) < self.batch_size and not self._queue.empty():
+            rows.append(self._queue.get_nowait())
+
+    async def _run(self):
+        # 后台任务复制了创建它的请求的上下文, 不能继承该请求的截止时间
+        g.deadline = None
+        while True:
+            rows = [await self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            self._drain(rows)
+            while len(rows) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    rows.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                self._drain(rows)
+            await self._flush(rows)
+
+    async def _insert(self, rows: list):
+        from db.database import sessionmanager
+
+        # executemany 按第一行的键生成 INSERT, 键不同的行分开插入, 否则后面行多出的列会被丢掉
+        groups = defaultdict(list)
+        for row in rows:
+            groups[tuple(sorted(row))].append(row)
+        async with sessionmanager.session_maker() as session:
+            for group in groups.values():
+                await session.execute(insert(self.model_cls.__table__), group)
+            await session.commit()
+
+    async def _insert_with_retry(self, rows: list) -> int:
+        """Insert the rows, returns how many were dropped."""
+        model_name = self.model_cls.__name__
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._insert(rows)
+                return 0
+            except Exception as e:
+                if attempt == self.max_retries:
+                    break
+                logger.warning(f"write buffer flush fail, retrying, model={model_name}, rows={len(rows)}, "
+                               f"attempt={attempt + 1}, error={e!r}")
+                await asyncio.sleep(self.flush_interval * 2 ** attempt)
+        if len(rows) == 1:
+            logger.exception(f"write buffer row dropped, model={model_name}, row={rows[0]}")
+            return 1
+        # 逐行插入, 找出导致整批失败的行
+        dropped = 0
+        for row in rows:
+            try:
+                await self._insert([row])
+            except Exception:
+                dropped += 1
+                logger.exception(f"write buffer row dropped, model={model_name}, row={row}")
+        return dropped
+
+    async def _flush(self, rows: list):
+        model_name = self.model_cls.__name__
+        start = time.perf_counter()
+        try:
+            try:
+                dropped = await self._insert_with_retry(rows)
+            except Exception:
+                dropped = len(rows)
+                logger.exception(f"write buffer flush fail, model={model_name}, rows={len(rows)}")
+            self.failed_rows += dropped
+            self.flushed_rows += len(rows) - dropped
+            if dropped:
+                metrics.write_buffer_rows_total.labels(model_name, "failed").inc(dropped)
+            if len(rows) > dropped:
+                metrics.write_buffer_rows_total.labels(model_name, "flushed").inc(len(rows) - dropped)
+        finally:
+            self.flush_count += 1
+            self.last_flush_latency = time.perf_counter() - start
+            metrics.write_buffer_flush_duration_seconds.labels(model_name).observe(self.last_flush_latency)
+            for _ in rows:
+                self._queue.task_done()
+            metrics.write_buffer_depth.labels(model_name).set(self.depth)
+
+    async def close(self):
+        """Wait until every queued row is flushed, then stop the background task."""
+        if self._queue is None:
+            return
+        if not self._queue.empty():
+            self._ensure_started()
+        await self._queue.join()
+        if self._task is not None:
+            # 队列已清空, 后台任务此时只会阻塞在 queue.get 上, 可以安全取消
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+write_buffers: dict[Type["BaseModel"], WriteBehindBuffer] = {}
+
+
+def get_write_buffer(model_cls: Type["BaseModel"]) -> WriteBehindBuffer:
+    buffer = write_buffers.get(model_cls)
+    if buffer is None:
+        buffer = write_buffers[model_cls] = WriteBehindBuffer(model_cls)
+    return buffer
+
+
+async def flush_write_buffers():
+    for buffer in list(write_buffers.values()):
+        await buffer.close()
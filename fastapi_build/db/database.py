@@ -2,17 +2,25 @@
 # @Time : 2024/5/27 11:22
 # @Author : PinBar
 # @File : database.py
+import asyncio
 import contextlib
+import time
 from typing import AsyncIterator, Annotated, Iterator
 
 from fastapi import Depends
 from fastapi.concurrency import run_in_threadpool
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, Session
 
-from config.settings import DB_URL, ASYNC_DB_URL
+from common import metrics, tracing
+from common.log import logger
+from config.settings import DB_URL, ASYNC_DB_URL, METRICS_ENABLED, TRACE_ENABLED
 from core.context import g
+from exceptions.custom_exception import RequestTimeoutError
+
+# 与 dao.base.database_fetch.ATOMIC_DEPTH_KEY 一致, db 不依赖 dao
+ATOMIC_DEPTH_KEY = "atomic_depth"
 
 engine_sync = create_engine(
     url=DB_URL,
@@ -37,6 +45,146 @@ engine = create_async_engine(
 )
 session_maker = async_sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
 
+METRIC_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.metrics_start_time = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    operation = statement.lstrip()[:6].upper()
+    metrics.db_query_duration_seconds.labels(operation if operation in METRIC_OPERATIONS else "OTHER").observe(
+        time.perf_counter() - context.metrics_start_time)
+
+
+if METRICS_ENABLED:
+    for _engine in (engine_sync, engine.sync_engine):
+        event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+
+# span 的 db.statement 属性最多保留的字符数
+TRACE_STATEMENT_LIMIT = 1000
+
+
+def _start_statement_span(conn, cursor, statement, parameters, context, executemany):
+    context.trace_span = tracing.span(f"sql {statement.lstrip()[:6].upper()}", **{
+        "db.system": conn.dialect.name, "db.statement": statement[:TRACE_STATEMENT_LIMIT]})
+
+
+def _finish_statement_span(conn, cursor, statement, parameters, context, executemany):
+    context.trace_span.finish()
+
+
+def _fail_statement_span(exception_context):
+    trace_span = getattr(exception_context.execution_context, "trace_span", None)
+    if trace_span is not None:
+        trace_span.finish(exception_context.original_exception)
+
+
+if TRACE_ENABLED:
+    for _engine in (engine_sync, engine.sync_engine):
+        event.listen(_engine, "before_cursor_execute", _start_statement_span)
+        event.listen(_engine, "after_cursor_execute", _finish_statement_span)
+        event.listen(_engine, "handle_error", _fail_statement_span)
+
+# connection.info 上的键: 连接上是否还留着上个请求的语句超时 (PostgreSQL statement_timeout / SQLite 进度回调)
+STATEMENT_TIMEOUT_KEY = "statement_timeout"
+
+
+def _sqlite_connection(conn):
+    driver_connection = conn.connection.driver_connection
+    # aiosqlite 的 Connection 包着 sqlite3.Connection
+    return getattr(driver_connection, "_conn", driver_connection)
+
+
+def _apply_deadline(conn, cursor, statement, parameters, context, executemany):
+    """
+    Bound every statement by the remaining request budget (``g.deadline``).
+
+    MySQL SELECTs get a ``MAX_EXECUTION_TIME`` optimizer hint. PostgreSQL gets a session
+    ``statement_timeout`` and SQLite a progress handler that interrupts the statement, both set
+    once per request and cleared by the next statement without a deadline. Statements issued
+    after the deadline fail at once.
+    """
+    deadline = g.deadline
+    dialect = conn.dialect.name
+    if deadline is None:
+        if conn.info.pop(STATEMENT_TIMEOUT_KEY, None) is not None:
+            if dialect == "postgresql":
+                cursor.execute("SET statement_timeout = 0")
+            elif dialect == "sqlite":
+                _sqlite_connection(conn).set_progress_handler(None, 0)
+        return statement, parameters
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise RequestTimeoutError()
+    timeout_ms = max(1, int(remaining * 1000))
+    if dialect == "mysql":
+        stripped = statement.lstrip()
+        if stripped[:6].upper() == "SELECT":
+            statement = f"SELECT /*+ MAX_EXECUTION_TIME({timeout_ms}) */{stripped[6:]}"
+    elif conn.info.get(STATEMENT_TIMEOUT_KEY) != deadline:
+        # 同一请求内只设置一次, 之后的语句由外层的 asyncio 超时兜底
+        if dialect == "postgresql":
+            cursor.execute(f"SET statement_timeout = {timeout_ms}")
+        elif dialect == "sqlite":
+            # 回调运行在 aiosqlite 的线程里, 读不到 contextvars, 截止时间通过闭包传入
+            _sqlite_connection(conn).set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        conn.info[STATEMENT_TIMEOUT_KEY] = deadline
+    return statement, parameters
+
+
+def _deadline_error(exception_context):
+    remaining = g.remaining_time()
+    if remaining is not None and remaining <= 0:
+        # 被语句超时中断的查询统一按请求超时返回
+        raise RequestTimeoutError() from exception_context.original_exception
+
+
+for _engine in (engine_sync, engine.sync_engine):
+    event.listen(_engine, "before_cursor_execute", _apply_deadline, retval=True)
+    event.listen(_engine, "handle_error", _deadline_error)
+
+
+# 正在执行的 KILL QUERY 任务, 保留引用防止被回收
+_kill_tasks: set = set()
+
+
+async def _kill_query(thread_id: int):
+    try:
+        async with engine.connect() as connection:
+            await connection.exec_driver_sql(f"KILL QUERY {int(thread_id)}")
+    except Exception:
+        logger.exception("kill query fail")
+
+
+def _interrupt_cancelled(dbapi_connection, connection_record, exception):
+    """
+    Stop the server-side statement when its request task was cancelled (client disconnect).
+
+    SQLAlchemy invalidates a connection whose await was cancelled mid-statement. Without this the
+    statement keeps running: aiosqlite would finish it before closing, MySQL until it completes.
+    SQLite gets ``sqlite3.Connection.interrupt``, MySQL a ``KILL QUERY`` from another connection.
+    asyncpg cancels the statement by itself.
+    """
+    if not isinstance(exception, asyncio.CancelledError):
+        return
+    dialect = engine.dialect.name
+    driver_connection = dbapi_connection.driver_connection
+    try:
+        if dialect == "sqlite":
+            getattr(driver_connection, "_conn", driver_connection).interrupt()
+        elif dialect == "mysql":
+            task = asyncio.get_running_loop().create_task(_kill_query(driver_connection.thread_id()))
+            _kill_tasks.add(task)
+            task.add_done_callback(_kill_tasks.discard)
+    except Exception:
+        logger.exception("interrupt cancelled statement fail")
+
+
+event.listen(engine.sync_engine.pool, "invalidate", _interrupt_cancelled)
+
 
 class DatabaseSessionManager:
     def __init__(self):
@@ -57,7 +205,9 @@ class DatabaseSessionManager:
             await g.session.rollback()
             raise
         finally:
-            await g.session.close()
+            # 回滚未提交的事务并归还连接
+            with tracing.span("db.close"):
+                await g.session.close()
 
     @contextlib.asynccontextmanager
     async def session_sync(self) -> Iterator[Session]:
@@ -68,7 +218,8 @@ class DatabaseSessionManager:
             await run_in_threadpool(lambda: g.session_sync.rollback())
             raise
         finally:
-            await run_in_threadpool(lambda: g.session_sync.close())
+            with tracing.span("db.close"):
+                await run_in_threadpool(lambda: g.session_sync.close())
 
     async def get_db(self):
         async with self.session() as session: # noqa
@@ -104,6 +255,64 @@ class DatabaseSessionManager:
         finally:
             g.session_sync.close()
 
+    @contextlib.contextmanager
+    def atomic(self) -> Iterator[Session]:
+        """
+        Run the DAO calls of the block in one transaction on ``g.session_sync``.
+
+        The commits of the DAO methods inside only flush, the block commits once at exit and
+        rolls back on exception. A nested block is a SAVEPOINT, its exception only rolls back
+        the nested block. A session is bound when none is bound yet.
+        """
+        session = g.session_sync
+        if session is None:
+            with self.bind_session_sync(), self.atomic() as session:
+                yield session
+            return
+        depth = session.info.get(ATOMIC_DEPTH_KEY, 0)
+        savepoint = session.begin_nested() if depth else None
+        session.info[ATOMIC_DEPTH_KEY] = depth + 1
+        try:
+            yield session
+            if savepoint is None:
+                session.commit()
+            else:
+                savepoint.commit()
+        except Exception:
+            if savepoint is None:
+                session.rollback()
+            else:
+                savepoint.rollback()
+            raise
+        finally:
+            session.info[ATOMIC_DEPTH_KEY] = depth
+
+    @contextlib.asynccontextmanager
+    async def aatomic(self) -> AsyncIterator[AsyncSession]:
+        """Async version of ``atomic`` on ``g.session``."""
+        session = g.session
+        if session is None:
+            async with self.bind_session(), self.aatomic() as session:
+                yield session
+            return
+        depth = session.info.get(ATOMIC_DEPTH_KEY, 0)
+        savepoint = await session.begin_nested() if depth else None
+        session.info[ATOMIC_DEPTH_KEY] = depth + 1
+        try:
+            yield session
+            if savepoint is None:
+                await session.commit()
+            else:
+                await savepoint.commit()
+        except Exception:
+            if savepoint is None:
+                await session.rollback()
+            else:
+                await savepoint.rollback()
+            raise
+        finally:
+            session.info[ATOMIC_DEPTH_KEY] = depth
+
 
 sessionmanager = DatabaseSessionManager()
 
@@ -2,22 +2,38 @@
 # @Time : 2024/5/15 18:26
 # @Author : PinBar
 # @File : es.py
-from elasticsearch import Elasticsearch
-from elasticsearch import AsyncElasticsearch
+from elasticsearch import Elasticsearch, Transport
+from elasticsearch import AsyncElasticsearch, AsyncTransport
 
+from common import tracing
 from config import settings
 
-if settings.ES_AUTH:
-    es = Elasticsearch(settings.ES_HOST, maxsize=30,
-                       http_auth=(settings.ES_USER, settings.ES_PASSWORD), timeout=30,
-                       max_retries=10, retry_on_timeout=True)
-    aio_es = AsyncElasticsearch(settings.ES_HOST, http_auth=(settings.ES_USER, settings.ES_PASSWORD), timeout=30,
-                                max_retries=10, retry_on_timeout=True )
-else:
-    es = Elasticsearch(settings.ES_HOST, maxsize=30, timeout=30, max_retries=10, retry_on_timeout=True)
-    aio_es = AsyncElasticsearch(settings.ES_HOST,  timeout=30, max_retries=10, retry_on_timeout=True )
 
+class TracedTransport(Transport):
+    """Every request of a traced API call becomes a span."""
+
+    def perform_request(self, method, url, *args, **kwargs):
+        with tracing.span(f"es {method}", **{"es.url": url}):
+            return super().perform_request(method, url, *args, **kwargs)
 
 
+class AsyncTracedTransport(AsyncTransport):
+    async def perform_request(self, method, url, *args, **kwargs):
+        with tracing.span(f"es {method}", **{"es.url": url}):
+            return await super().perform_request(method, url, *args, **kwargs)
 
 
+transport_options = dict(transport_class=TracedTransport) if settings.TRACE_ENABLED else {}
+aio_transport_options = dict(transport_class=AsyncTracedTransport) if settings.TRACE_ENABLED else {}
+
+if settings.ES_AUTH:
+    es = Elasticsearch(settings.ES_HOST, maxsize=30,
+                       http_auth=(settings.ES_USER, settings.ES_PASSWORD), timeout=30,
+                       max_retries=10, retry_on_timeout=True, **transport_options)
+    aio_es = AsyncElasticsearch(settings.ES_HOST, http_auth=(settings.ES_USER, settings.ES_PASSWORD), timeout=30,
+                                max_retries=10, retry_on_timeout=True, **aio_transport_options)
+else:
+    es = Elasticsearch(settings.ES_HOST, maxsize=30, timeout=30, max_retries=10, retry_on_timeout=True,
+                       **transport_options)
+    aio_es = AsyncElasticsearch(settings.ES_HOST, timeout=30, max_retries=10, retry_on_timeout=True,
+                                **aio_transport_options)
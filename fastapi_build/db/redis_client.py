@@ -1,7 +1,43 @@
+import time
+
 import redis
 import redis.asyncio as aioredis
 
-from config.settings import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD, REDIS_CACHE_DB
+from common import metrics, tracing
+from config.settings import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD, REDIS_CACHE_DB, METRICS_ENABLED, TRACE_ENABLED
+
+
+class InstrumentedRedis(redis.StrictRedis):
+    """
+    Record the latency of every command as a metric and, in traced requests, a span.
+    Pipelines are sent by the pipeline object and not timed.
+    """
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        trace_span = tracing.span(f"redis {args[0]}")
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            trace_span.finish()
+            if METRICS_ENABLED:
+                metrics.redis_command_duration_seconds.labels(args[0]).observe(time.perf_counter() - start)
+
+
+class AsyncInstrumentedRedis(aioredis.StrictRedis):
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        trace_span = tracing.span(f"redis {args[0]}")
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            trace_span.finish()
+            if METRICS_ENABLED:
+                metrics.redis_command_duration_seconds.labels(args[0]).observe(time.perf_counter() - start)
+
+
+RedisClient = InstrumentedRedis if METRICS_ENABLED or TRACE_ENABLED else redis.StrictRedis
+AsyncRedisClient = AsyncInstrumentedRedis if METRICS_ENABLED or TRACE_ENABLED else aioredis.StrictRedis
 
 normal_cache_pool = redis.ConnectionPool(
     host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_CACHE_DB
@@ -14,8 +50,8 @@ normal_cache_pool_decode = redis.ConnectionPool(
     decode_responses=True,
 )
 
-r_cache = redis.StrictRedis(connection_pool=normal_cache_pool)
-r_cache_decode = redis.StrictRedis(
+r_cache = RedisClient(connection_pool=normal_cache_pool)
+r_cache_decode = RedisClient(
     connection_pool=normal_cache_pool_decode,
 )
 
@@ -29,8 +65,8 @@ aio_normal_cache_pool_decode = aioredis.ConnectionPool(
     db=REDIS_CACHE_DB,
     decode_responses=True,
 )
-aio_r_cache = aioredis.StrictRedis(connection_pool=aio_normal_cache_pool)
-aio_r_cache_decode = aioredis.StrictRedis(
+aio_r_cache = AsyncRedisClient(connection_pool=aio_normal_cache_pool)
+aio_r_cache_decode = AsyncRedisClient(
     connection_pool=aio_normal_cache_pool_decode,
 )
 
@@ -12,6 +12,9 @@ from .error_code import (
     TokenNotExists,
     ExpireToken,
     CheckerError,
+    ServiceUnavailable,
+    TooManyRequests,
+    RequestTimeout,
 )
 from .http_status import (
     HTTP_400_BAD_REQUEST,
@@ -19,6 +22,9 @@ from .http_status import (
     HTTP_401_UNAUTHORIZED,
     HTTP_403_FORBIDDEN,
     HTTP_200_OK,
+    HTTP_429_TOO_MANY_REQUESTS,
+    HTTP_503_SERVICE_UNAVAILABLE,
+    HTTP_504_GATEWAY_TIMEOUT,
 )
 
 
@@ -93,6 +99,32 @@ class FileValidError(ApiError):
     default_http_code = HTTP_400_BAD_REQUEST
 
 
+class ServiceBusyError(ApiError):
+    default_code = ServiceUnavailable
+    default_message = "服务繁忙，请稍后再试"
+    default_http_code = HTTP_503_SERVICE_UNAVAILABLE
+
+    def __init__(self, message=None, retry_after: int = 1, *args, **kwargs):
+        super().__init__(message, *args, **kwargs)
+        self.headers = {"Retry-After": str(retry_after)}
+
+
+class TooManyRequestsError(ApiError):
+    default_code = TooManyRequests
+    default_message = "请求过于频繁，请稍后再试"
+    default_http_code = HTTP_429_TOO_MANY_REQUESTS
+
+    def __init__(self, message=None, retry_after: int = 1, *args, **kwargs):
+        super().__init__(message, *args, **kwargs)
+        self.headers = {"Retry-After": str(retry_after)}
+
+
+class RequestTimeoutError(ApiError):
+    default_code = RequestTimeout
+    default_message = "请求处理超时"
+    default_http_code = HTTP_504_GATEWAY_TIMEOUT
+
+
 if __name__ == "__main__":
     A = ParamsError()
     print(isinstance(A, ApiError))
@@ -18,6 +18,7 @@ DataNotFound = 1111
 DataUpdateError = 1112
 DataChangeError = 1113
 DataDelError = 1114
+TooManyRequests = 1115
 
 
 # 用户错误，以1200开头
@@ -72,6 +73,7 @@ MESSAGE = {
     DataUpdateError: {"message": "资源更新失败", "http_code": HTTP_400_BAD_REQUEST},
     DataChangeError: {"message": "资源修改失败", "http_code": HTTP_400_BAD_REQUEST},
     DataDelError: {"message": "资源删除失败", "http_code": HTTP_400_BAD_REQUEST},
+    TooManyRequests: {"message": "请求过于频繁", "http_code": HTTP_429_TOO_MANY_REQUESTS},
     # 用户错误，以1200开头
     UserError: {"message": "用户错误", "http_code": HTTP_400_BAD_REQUEST},
     ExpireToken: {
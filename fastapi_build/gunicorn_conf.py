@@ -9,3 +9,13 @@ accesslog = "-"
 workers = 5
 bind = "0.0.0.0:10001"
 worker_class = "uvicorn.workers.UvicornWorker"
+
+
+def on_starting(server):
+    from common.metrics import clear_metrics_dir
+    clear_metrics_dir()
+
+
+def child_exit(server, worker):
+    from common.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
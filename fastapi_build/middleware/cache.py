@@ -0,0 +1,51 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 18:50
+# @Author : PinBar
+# @File : cache.py
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from core.cache import CACHE_ENTRY, store, add_vary
+
+
+class ResponseCacheMiddleware:
+    """
+    Save the body of cache-enabled routes (``api_description(cache_ttl=...)``) after a cache miss.
+
+    The body is stored once it has been sent, so it is exactly what FastAPI serialized for the client,
+    together with the route's headers, and ``vary_on`` is added to its Vary header. Only complete 200
+    responses are cached, streaming bodies are skipped.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Message = None
+        cacheable = False
+        completed_body: bytes = None
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message, cacheable, completed_body
+            if message["type"] == "http.response.start":
+                entry = (scope.get("state") or {}).get(CACHE_ENTRY)
+                if entry is not None:
+                    message["headers"] = add_vary(list(message["headers"]), entry.vary_on)
+                cacheable = entry is not None and message["status"] == 200
+                start_message = message
+            elif cacheable:
+                if message.get("more_body", False):
+                    cacheable = False
+                else:
+                    completed_body = message.get("body", b"")
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+        if cacheable and completed_body is not None:
+            if "content-encoding" not in Headers(raw=start_message["headers"]):
+                await store(scope["state"][CACHE_ENTRY], start_message["status"], start_message["headers"],
+                            completed_body)
@@ -0,0 +1,76 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 17:55
+# @Author : PinBar
+# @File : conditional.py
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from core.conditional import (CONDITIONAL_ENABLED, CONDITIONAL_ETAG, CONDITIONAL_LAST_MODIFIED, make_etag,
+                              is_not_modified, validator_headers)
+
+
+class ConditionalGetMiddleware:
+    """
+    ETag / Last-Modified for GET routes declared with ``api_description(etag=True)``.
+
+    Validators computed by ``BaseView.a_not_modified`` are added to the 200 response. Without them
+    the body is buffered and hashed into a strong ETag, a matching If-None-Match gets a 304 without
+    the body. Streaming bodies are passed through untouched.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Message = None
+        passthrough = False
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                state = scope.get("state") or {}
+                if message["status"] != 200 or not state.get(CONDITIONAL_ENABLED):
+                    passthrough = True
+                    await send(message)
+                    return
+                etag, last_modified = state.get(CONDITIONAL_ETAG), state.get(CONDITIONAL_LAST_MODIFIED)
+                if etag or last_modified:
+                    headers = MutableHeaders(scope=message)
+                    for key, value in validator_headers(etag, last_modified).items():
+                        headers[key] = value
+                    passthrough = True
+                    await send(message)
+                    return
+                start_message = message
+                return
+            # http.response.body
+            if message.get("more_body", False):
+                # 流式响应不缓冲
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+            content = message.get("body", b"")
+            etag = make_etag(content)
+            headers = MutableHeaders(scope=start_message)
+            if is_not_modified(Headers(scope=scope), etag):
+                start_message["status"] = 304
+                for key in ("content-length", "content-type"):
+                    if key in headers:
+                        del headers[key]
+                headers["ETag"] = etag
+                await send(start_message)
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+            headers["ETag"] = etag
+            await send(start_message)
+            await send({"type": "http.response.body", "body": content, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
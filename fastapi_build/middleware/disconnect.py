@@ -0,0 +1,89 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 21:10
+# @Author : PinBar
+# @File : disconnect.py
+import asyncio
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+# request.state 上的键, 客户端在响应完成前断开时为 True
+CLIENT_DISCONNECTED = "client_disconnected"
+
+
+class DisconnectMiddleware:
+    """
+    Cancel the handler task when the client goes away before the response is complete.
+
+    Once the request body has been read (right away for requests without a body) a watcher waits
+    on ``receive`` and cancels the handler on ``http.disconnect``. The body itself is never
+    read ahead, so uploads still stream. A query cancelled mid-statement is interrupted on the server
+    and its connection dropped (``db.database._interrupt_cancelled``).
+    Work after the response is complete, e.g. background tasks, is not cancelled.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        has_body = headers.get("content-length", "0") != "0" or "transfer-encoding" in headers
+        messages: asyncio.Queue = asyncio.Queue()
+        watcher: asyncio.Task = None
+        disconnected = False
+        response_complete = False
+        handler: asyncio.Task = None
+
+        async def watch(body_complete: bool):
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    disconnected = True
+                    if not response_complete:
+                        scope.setdefault("state", {})[CLIENT_DISCONNECTED] = True
+                        handler.cancel()
+                    return
+                if body_complete:
+                    # 请求体读完后服务器只会再发 http.disconnect, 其它消息不再等待
+                    return
+                body_complete = not message.get("more_body", False)
+
+        def start_watcher(body_complete: bool):
+            nonlocal watcher
+            watcher = asyncio.get_running_loop().create_task(watch(body_complete))
+
+        async def receive_wrapper() -> Message:
+            if watcher is None:
+                message = await receive()
+                if message["type"] == "http.request" and not message.get("more_body", False):
+                    start_watcher(True)
+                return message
+            if disconnected and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        async def send_wrapper(message: Message):
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        handler = asyncio.get_running_loop().create_task(self.app(scope, receive_wrapper, send_wrapper))
+        if not has_body:
+            start_watcher(False)
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not handler.cancelled() or not disconnected:
+                # 外层任务被取消 (如服务关闭), 处理任务一并取消
+                handler.cancel()
+                raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
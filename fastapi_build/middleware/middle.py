@@ -2,21 +2,24 @@
 # @Time : 2024/5/16 11:13
 # @Author : PinBar
 # @File : middle.py
-import time
-
 from fastapi import Request, FastAPI
 from fastapi.exceptions import RequestValidationError, ResponseValidationError
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, ValidationError
-from starlette.middleware.base import BaseHTTPMiddleware
 
-from core.context import g
 from common.log import logger
+from common.metrics import metrics_view
+from config.settings import METRICS_ENABLED, METRICS_PATH, DISCONNECT_CANCEL
 from exceptions.base import ApiError
 from exceptions.error_code import ParamCheckError
 from exceptions.http_status import HTTP_400_BAD_REQUEST, HTTP_500_INTERNAL_SERVER_ERROR
-from middleware.startup import startup
+from middleware.cache import ResponseCacheMiddleware
+from middleware.conditional import ConditionalGetMiddleware
+from middleware.disconnect import DisconnectMiddleware
+from middleware.request_log import RequestLogMiddleware
+from middleware.single_flight import SingleFlightMiddleware
+from middleware.startup import startup, shutdown
 
 
 def register_middleware(app: FastAPI):
@@ -24,6 +27,8 @@ def register_middleware(app: FastAPI):
         "*"
     ]
 
+    # 放在最里层, 共享的响应头不含领头请求的 CORS 头
+    app.add_middleware(SingleFlightMiddleware)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=origins,
@@ -31,6 +36,8 @@ def register_middleware(app: FastAPI):
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(ResponseCacheMiddleware)
+    app.add_middleware(ConditionalGetMiddleware)
 
     def human_errors(exc: ValidationError) -> str:
         errors = exc.errors()
@@ -78,6 +85,7 @@ def register_middleware(app: FastAPI):
         return JSONResponse(
             status_code=exc.http_code,
             content={"message": f"{exc.message}", "code": exc.code},
+            headers=getattr(exc, "headers", None),
         )
 
     @app.exception_handler(Exception)
@@ -107,37 +115,11 @@ def register_middleware(app: FastAPI):
                                 content={"message": str(exc), "code": ParamCheckError})
         return JSONResponse(status_code=HTTP_400_BAD_REQUEST, content={"message": human_err, "code": ParamCheckError})
 
-    @app.middleware("http")
-    async def common_requests(request: Request, call_next):
-        # 记录请求开始时间
-        start_time = time.time()
-
-        # 获取请求信息
-        method = request.method
-        url = str(request.url.path)
-        client_ip = request.client.host
-        client_agent = request.headers.get("user-agent")
-        query_params = dict(request.query_params)
-        request_body = await request.body()
-        g.request = request
-        g.extra_data = {}
-        # 处理请求
-        try:
-            response = await call_next(request)
-        except Exception:
-            logger.exception(f"接口异常{url=}")
-            raise
-
-        # 计算请求处理时间
-        duration = time.time() - start_time
-
-        # 记录日志
-        try:
-            logger.info(
-                f"{method}: {url}, 用时: {duration:.4f}s, Query Params: {query_params},"
-                f" Body: {request_body.decode()} IP: {client_ip}, Agent: {client_agent}. ")
-        except Exception:
-            logger.exception("日志记录异常")
-        return response
+    if DISCONNECT_CANCEL:
+        app.add_middleware(DisconnectMiddleware)
+    app.add_middleware(RequestLogMiddleware)
+    if METRICS_ENABLED:
+        app.add_route(METRICS_PATH, metrics_view, include_in_schema=False)
 
     app.on_event("startup")(startup)
+    app.on_event("shutdown")(shutdown)
@@ -0,0 +1,103 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 19:20
+# @Author : PinBar
+# @File : request_log.py
+import random
+import time
+
+from fastapi import Request
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from common import metrics, tracing
+from common.log import logger
+from config.settings import ACCESS_LOG_SAMPLE_RATE, ACCESS_LOG_SLOW_SECONDS, ACCESS_LOG_BODY_LIMIT, METRICS_ENABLED
+from core.context import g
+from middleware.disconnect import CLIENT_DISCONNECTED
+
+# 客户端提前断开时记录的状态码 (同 nginx)
+CLIENT_CLOSED_REQUEST = 499
+# 只记录这些类型的请求体, 文件上传等二进制内容不进日志
+LOG_BODY_CONTENT_TYPES = ("application/json", "application/x-www-form-urlencoded", "text/")
+
+
+class RequestLogMiddleware:
+    """
+    Bind ``g.request`` / ``g.extra_data`` and write the access log.
+
+    The request body is never read here: chunks the endpoint receives are copied up to
+    ``ACCESS_LOG_BODY_LIMIT`` bytes for allowed content types, so uploads and streaming requests
+    are untouched. Successful fast requests are logged with ``ACCESS_LOG_SAMPLE_RATE``, errors and
+    requests slower than ``ACCESS_LOG_SLOW_SECONDS`` are always logged.
+
+    Request count, latency and in-flight metrics are labelled with the matched route template,
+    unmatched paths share one ``unmatched`` label. Sampled requests open the root trace span
+    (``common.tracing``).
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        g.request = Request(scope, receive)
+        g.extra_data = {}
+        g.deadline = None
+        status_code = 500
+        body = bytearray()
+        capture_body = ACCESS_LOG_BODY_LIMIT > 0 and Headers(scope=scope).get(
+            "content-type", "").startswith(LOG_BODY_CONTENT_TYPES)
+
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if capture_body and message["type"] == "http.request" and len(body) < ACCESS_LOG_BODY_LIMIT:
+                body.extend(message.get("body", b"")[:ACCESS_LOG_BODY_LIMIT - len(body)])
+            return message
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        if METRICS_ENABLED:
+            metrics.request_started(method)
+        with tracing.start_trace(method) as trace:
+            try:
+                await self.app(scope, receive_wrapper if capture_body else receive, send_wrapper)
+            except Exception:
+                logger.exception("接口异常 url={}", scope["path"])
+                raise
+            finally:
+                duration = time.perf_counter() - start_time
+                if (scope.get("state") or {}).get(CLIENT_DISCONNECTED):
+                    status_code = CLIENT_CLOSED_REQUEST
+                route = getattr(scope.get("route"), "path", "unmatched")
+                if METRICS_ENABLED:
+                    metrics.request_finished(method, route, status_code, duration)
+                if trace:
+                    trace.name = f"{method} {route}"
+                    trace.set_attribute("http.status_code", status_code)
+                if (status_code >= 500 or duration >= ACCESS_LOG_SLOW_SECONDS
+                        or random.random() < ACCESS_LOG_SAMPLE_RATE):
+                    self.log(scope, status_code, duration, body)
+
+    @staticmethod
+    def log(scope: Scope, status_code: int, duration: float, body: bytearray):
+        try:
+            headers = Headers(scope=scope)
+            client = scope.get("client")
+            # loguru 在日志级别过滤后才格式化参数
+            logger.info(
+                "{}: {}, 状态: {}, 用时: {:.4f}s, Query Params: {}, Body: {} IP: {}, Agent: {}. ",
+                scope["method"], scope["path"], status_code, duration,
+                scope.get("query_string", b"").decode("latin-1"),
+                body.decode("utf-8", "replace"), client[0] if client else None, headers.get("user-agent"),
+            )
+        except Exception:
+            logger.exception("日志记录异常")
@@ -0,0 +1,50 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 22:10
+# @Author : PinBar
+# @File : single_flight.py
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from core.single_flight import FLIGHT_LEADER, PRIVATE_HEADERS, SharedResponse, complete
+
+
+class SingleFlightMiddleware:
+    """
+    Hand the response of a single-flight leader (``api_description(single_flight=...)``) to the
+    identical requests waiting on it.
+
+    Registered innermost, so the shared headers are the route's own, without CORS headers of the
+    leader's origin. Streaming bodies and 5xx responses are not shared, the waiting requests run
+    the endpoint themselves.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        flight = None
+        start_message: Message = None
+        shared: SharedResponse = None
+
+        async def send_wrapper(message: Message):
+            nonlocal flight, start_message, shared
+            if message["type"] == "http.response.start":
+                flight = (scope.get("state") or {}).get(FLIGHT_LEADER)
+                if flight is not None and message["status"] < 500:
+                    start_message = message
+            elif start_message is not None:
+                if not message.get("more_body", False):
+                    headers = [(k, v) for k, v in start_message["headers"] if k.lower() not in PRIVATE_HEADERS]
+                    shared = SharedResponse(start_message["status"], headers, message.get("body", b""))
+                start_message = None
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            flight = flight or (scope.get("state") or {}).get(FLIGHT_LEADER)
+            if flight is not None:
+                await complete(flight, shared)
@@ -4,10 +4,44 @@
 # @File : startup.py
 
 
+import asyncio
+import sys
+
 from anyio.lowlevel import RunVar
 from anyio import CapacityLimiter
-from config.settings import SYNC_THREAD_COUNT
+from config.settings import SYNC_THREAD_COUNT, AUTH_CACHE_TTL, PERMISSION_CACHE_TTL
+
+# 后台任务的引用, 防止被回收
+_background_tasks = set()
+
+
+def _start_background(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
 
 def startup():
     RunVar("_default_thread_limiter").set(CapacityLimiter(SYNC_THREAD_COUNT))
+    authentication = sys.modules.get("auth.authentication")
+    if authentication is not None and AUTH_CACHE_TTL:
+        # 项目用到了 TokenAuthentication 时才订阅认证缓存的失效广播
+        _start_background(authentication.listen_invalidations())
+    permissions = sys.modules.get("auth.permissions")
+    if permissions is not None and PERMISSION_CACHE_TTL:
+        _start_background(permissions.listen_invalidations())
+    hashers = sys.modules.get("auth.hashers")
+    if hashers is not None:
+        # 提前启动密码哈希进程, 避免第一批登录请求等待进程启动
+        hashers.hash_pool.warm_up()
+
+
+async def shutdown():
+    hashers = sys.modules.get("auth.hashers")
+    if hashers is not None:
+        hashers.hash_pool.shutdown()
+    try:
+        from dao.base.write_buffer import flush_write_buffers
+    except ImportError:
+        return
+    await flush_write_buffers()
@@ -3,7 +3,7 @@
 # @Author : PinBar
 # @File : cli.py
 import click
-from . import startproject, startapp, add_plugin, migrate
+from . import startproject, startapp, add_plugin, migrate, suggest_indexes
 from .. import __version__
 
 # 自定义帮助命令类以保持命令的注册顺序并支持样式
@@ -53,3 +53,4 @@ cli.add_command(add_plugin.main, name="add_plugin")
 cli.add_command(migrate.makemigrations, name="makemigrations")
 cli.add_command(migrate.showmigrations, name="showmigrations")
 cli.add_command(migrate.migrate, name="migrate")
+cli.add_command(suggest_indexes.main, name="suggest_indexes")
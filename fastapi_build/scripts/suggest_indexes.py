@@ -0,0 +1,195 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 10:40
+# @Author : PinBar
+# @File : suggest_indexes.py
+import json
+import sys
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+import click
+
+from . import StyledCommand
+
+PARTIAL_INDEX_DIALECTS = {
+    "postgresql": ("postgresql_where", "is_delete = false"),
+    "sqlite": ("sqlite_where", "is_delete = 0"),
+}
+MIGRATION_TEMPLATE = '''"""{message}
+
+Revision ID: {revision}
+Revises: {down_revision}
+Create Date: {create_date}
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = {revision!r}
+down_revision: Union[str, None] = {down_revision!r}
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+{upgrades}
+
+
+def downgrade() -> None:
+{downgrades}
+'''
+
+
+def load_shapes(directory: Path) -> list[dict]:
+    """Merge the shape files dumped by every process, summing the counters of identical shapes."""
+    merged = Counter()
+    for path in directory.glob("shapes_*.json"):
+        with open(path, encoding="utf-8") as fp:
+            for shape in json.load(fp):
+                key = (shape["table"], tuple(shape["equality"]), tuple(shape["range"]), tuple(shape["order"]))
+                merged[key] += shape["count"]
+    return [
+        {"table": table, "equality": list(equality), "range": list(ranges), "order": list(order), "count": count}
+        for (table, equality, ranges, order), count in merged.most_common()
+    ]
+
+
+def load_project_metadata():
+    sys.path.insert(0, str(Path.cwd()))
+    try:
+        from config.settings import DB_URL
+        from common.load_model import import_api_module
+        import_api_module("models")
+        from models.base import Base
+    except ImportError as e:
+        click.secho('Error:', fg='red', bold=True)
+        click.echo(f'\nCan not load the project models: {e}\n')
+        click.echo('Please navigate to your_project/src directory and ensure you have added the db plugin.')
+        sys.exit(1)
+    from sqlalchemy.engine import make_url
+    return Base.metadata, make_url(DB_URL).get_backend_name()
+
+
+def existing_indexes(table) -> list[list[str]]:
+    indexes = [[c.name for c in table.primary_key.columns]]
+    indexes.extend([c.name for c in index.columns] for index in table.indexes)
+    indexes.extend([c.name for c in constraint.columns] for constraint in table.constraints
+                   if constraint.__class__.__name__ == "UniqueConstraint")
+    return [i for i in indexes if i]
+
+
+def is_covered(candidate: list[str], equality: set[str], indexes: list[list[str]]) -> bool:
+    """An index covers the shape if its leading columns are the equality columns (in any order)
+    followed by the rest of the candidate, ``is_delete`` is ignored on both sides."""
+    for index in indexes:
+        index = [c for c in index if c != "is_delete"]
+        if len(index) < len(candidate):
+            continue
+        head = index[:len(candidate)]
+        if set(head[:len(equality)]) == equality and head[len(equality):] == candidate[len(equality):]:
+            return True
+    return False
+
+
+def build_candidate(shape: dict, table) -> dict:
+    equality = [c for c in shape["equality"] if c != "is_delete"]
+    columns = list(equality)
+    if shape["range"]:
+        columns.append(shape["range"][0])
+    else:
+        for column in shape["order"]:
+            column = column.lstrip("-")
+            if column not in columns:
+                columns.append(column)
+    soft_delete = "is_delete" in table.columns and "is_delete" in shape["equality"]
+    return {"table": table.name, "columns": columns, "equality": set(equality),
+            "soft_delete": soft_delete, "count": shape["count"]}
+
+
+def suggest(shapes: list[dict], metadata, dialect: str, min_count: int) -> list[dict]:
+    suggestions = []
+    for shape in shapes:
+        table = metadata.tables.get(shape["table"])
+        if table is None or shape["count"] < min_count:
+            continue
+        candidate = build_candidate(shape, table)
+        if not candidate["columns"] or is_covered(candidate["columns"], candidate["equality"],
+                                                  existing_indexes(table)):
+            continue
+        # 已有建议的前缀可以直接复用, 不再重复建议
+        known = [s["columns"] for s in suggestions if s["table"] == table.name]
+        if is_covered(candidate["columns"], candidate["equality"], known):
+            continue
+        if candidate["soft_delete"] and dialect not in PARTIAL_INDEX_DIALECTS:
+            candidate["columns"].insert(0, "is_delete")
+            candidate["soft_delete"] = False
+        candidate["name"] = f"ix_{table.name}_{'_'.join(candidate['columns'])}"[:63]
+        suggestions.append(candidate)
+    return suggestions
+
+
+def render_migration(suggestions: list[dict], dialect: str, down_revision) -> tuple[str, str]:
+    upgrades, downgrades = [], []
+    for item in suggestions:
+        where = ""
+        if item["soft_delete"]:
+            option, clause = PARTIAL_INDEX_DIALECTS[dialect]
+            where = f", {option}=sa.text({clause!r})"
+        upgrades.append(f"    op.create_index({item['name']!r}, {item['table']!r}, {item['columns']!r}, "
+                        f"unique=False{where})")
+        downgrades.append(f"    op.drop_index({item['name']!r}, table_name={item['table']!r})")
+    revision = uuid.uuid4().hex[:12]
+    content = MIGRATION_TEMPLATE.format(
+        message="suggested indexes", revision=revision, down_revision=down_revision,
+        create_date=datetime.now(), upgrades="\n".join(upgrades), downgrades="\n".join(reversed(downgrades)),
+    )
+    return revision, content
+
+
+def current_head():
+    try:
+        from alembic.config import Config
+        from alembic.script import ScriptDirectory
+        return ScriptDirectory.from_config(Config(str(Path.cwd() / "alembic.ini"))).get_current_head()
+    except Exception:  # noqa
+        return None
+
+
+@click.command(cls=StyledCommand, help=click.style("Suggest composite indexes from the query shapes recorded "
+                                                   "with QUERY_SHAPE_DIR, and emit an alembic migration stub"))
+@click.option("--shape-dir", default="query_shapes", help="The QUERY_SHAPE_DIR of the project")
+@click.option("--min-count", default=1, help="Ignore the query shapes executed fewer times than this")
+@click.option("--write", is_flag=True, default=False, help="Write the migration stub into alembic/versions")
+def main(shape_dir: str, min_count: int, write: bool):
+    shape_dir = Path(shape_dir)
+    if not shape_dir.exists():
+        click.secho(f"Error: query shape directory {shape_dir} not found, set QUERY_SHAPE_DIR "
+                    f"and run the project to record the query shapes first.", fg='red', err=True)
+        sys.exit(1)
+    metadata, dialect = load_project_metadata()
+    suggestions = suggest(load_shapes(shape_dir), metadata, dialect, min_count)
+    if not suggestions:
+        click.secho("All recorded query shapes are covered by the existing indexes.", fg='green')
+        return
+    for item in suggestions:
+        partial = click.style(" WHERE is_delete = 0", fg='yellow') if item["soft_delete"] else ""
+        click.echo(f"{click.style(item['table'], fg='cyan')}({', '.join(item['columns'])}){partial}"
+                   f"  -- used {item['count']} times")
+    revision, content = render_migration(suggestions, dialect, current_head())
+    if not write:
+        click.echo("\n" + content)
+        return
+    versions_dir = Path.cwd() / "alembic" / "versions"
+    if not versions_dir.exists():
+        click.secho('Error: alembic/versions not found, install the migrate plugin first:', fg='red', err=True)
+        click.secho('    fbuild add_plugin migrate', fg='yellow')
+        sys.exit(1)
+    path = versions_dir / f"{revision}_suggested_indexes.py"
+    path.write_text(content, encoding="utf-8")
+    click.secho(f"Successfully wrote migration stub {path}, review it then run `fbuild migrate`.", fg='green')
@@ -3,14 +3,17 @@
 # @Author : PinBar
 # @File : server.py
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 
+from config.settings import FAST_JSON_RESPONSE
 from core.base_view import base_router
+from core.response import FastJSONResponse
 from common.load_model import import_api_module
 from middleware.middle import register_middleware
 
 
 def create_app() -> FastAPI:
-    app = FastAPI()
+    app = FastAPI(default_response_class=FastJSONResponse if FAST_JSON_RESPONSE else JSONResponse)
     import_api_module('api')
     import_api_module('db.models')
     # from db.models.base import create_tables
@@ -0,0 +1,106 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 16:40
+# @Author : PinBar
+# @File : bench_response.py
+"""
+ListRes endpoints with 1k items: validated envelope with JSONResponse / FastJSONResponse
+and the validate=False envelope rendered by FastJSONResponse directly.
+
+    python tests/bench_response.py
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from fastapi import FastAPI, APIRouter
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from core import base_view
+from core.base_view import BaseView
+from core.decorator import api_description
+from core.response import ListRes, FastJSONResponse
+
+ITEMS = [
+    {"id": i, "username": f"user_{i}", "nickname": f"nickname_{i}", "email": f"user_{i}@example.com",
+     "create_time": datetime(2024, 12, 1, 8, 30, i % 60)}
+    for i in range(1000)
+]
+
+
+class Item(BaseModel):
+    id: int
+    username: str
+    nickname: str
+    email: Optional[str] = None
+    create_time: datetime
+
+
+class ValidatedView(BaseView):
+    authentication_classes = []
+
+    @api_description(response_model=ListRes(Item), depend_session=False)
+    async def get(self):
+        return self.response(data={"total": len(ITEMS), "items": ITEMS})
+
+
+class SoftView(BaseView):
+    authentication_classes = []
+
+    @api_description(response_model=ListRes(Item, validate=False), depend_session=False)
+    async def get(self):
+        return self.response(data={"total": len(ITEMS), "items": ITEMS})
+
+
+def create_app(default_response_class) -> FastAPI:
+    base_view.base_router = APIRouter()
+    ValidatedView("/validated")
+    SoftView("/soft")
+    app = FastAPI(default_response_class=default_response_class)
+    app.include_router(base_view.base_router)
+    return app
+
+
+async def call(app: FastAPI, path: str) -> bytes:
+    scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "headers": [], "http_version": "1.1", "scheme": "http", "server": ("testserver", 80),
+             "client": ("testclient", 50000), "root_path": ""}
+    body = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+
+async def bench(app: FastAPI, path: str, rounds: int = 200) -> float:
+    for _ in range(10):
+        await call(app, path)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await call(app, path)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+async def main():
+    for label, response_class, path in (
+            ("ListRes(Item)               JSONResponse", JSONResponse, "/validated"),
+            ("ListRes(Item)               FastJSONResponse", FastJSONResponse, "/validated"),
+            ("ListRes(Item, validate=False) FastJSONResponse", JSONResponse, "/soft"),
+    ):
+        app = create_app(response_class)
+        print(f"{label}: {await bench(app, path):.2f} ms/request, {len(await call(app, path))} bytes")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
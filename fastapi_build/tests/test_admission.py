@@ -0,0 +1,65 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/20 14:00
+# @Author : PinBar
+# @File : test_admission.py
+"""
+Admission priority and queue eviction.
+
+    python tests/test_admission.py
+"""
+import asyncio
+import os
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+os.environ.setdefault("SECRET_KEY", "admission-test-secret-key-0123456789")
+
+from starlette.requests import Request
+
+from auth.authentication import create_access_token
+from core.admission import (AdmissionController, request_priority, PRIORITY_AUTHENTICATED, PRIORITY_ANONYMOUS)
+from exceptions.custom_exception import ServiceBusyError
+
+
+def make_request(authorization: str = None) -> Request:
+    headers = [(b"authorization", authorization.encode())] if authorization else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": b""})
+
+
+class TestAdmission:
+
+    async def test_priority_needs_valid_token(self):
+        token = create_access_token({"user_id": 1}, timedelta(minutes=5))
+        assert request_priority(make_request(f"Bearer {token}")) == PRIORITY_AUTHENTICATED
+        # 伪造的 Authorization 头不能提升优先级
+        assert request_priority(make_request("x")) == PRIORITY_ANONYMOUS
+        assert request_priority(make_request("Bearer forged.token.value")) == PRIORITY_ANONYMOUS
+        assert request_priority(make_request()) == PRIORITY_ANONYMOUS
+
+    async def test_full_queue_evicts_lower_priority(self):
+        controller = AdmissionController("test", limit=1, queue_size=1, timeout=5)
+        await controller.acquire(PRIORITY_ANONYMOUS)
+        anonymous = asyncio.create_task(controller.acquire(PRIORITY_ANONYMOUS))
+        await asyncio.sleep(0)
+        authenticated = asyncio.create_task(controller.acquire(PRIORITY_AUTHENTICATED))
+        await asyncio.sleep(0)
+        try:
+            await anonymous
+        except ServiceBusyError:
+            pass
+        else:
+            raise AssertionError("anonymous waiter not evicted")
+        controller.release()
+        await authenticated
+        assert controller.active == 1
+
+    async def run(self):
+        for func in self.__dir__():
+            if func.startswith("test"):
+                await getattr(self, func)()
+
+
+if __name__ == '__main__':
+    asyncio.run(TestAdmission().run())
@@ -0,0 +1,125 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/20 11:30
+# @Author : PinBar
+# @File : test_auth_cache.py
+"""
+Token -> user cache of ``aget_current_user``. Works without Redis (invalidations stay in this worker).
+
+    python tests/test_auth_cache.py
+"""
+import asyncio
+import os
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+os.environ.setdefault("SECRET_KEY", "auth-cache-test-secret-key-0123456789")
+
+from sqlalchemy import delete, event, update
+
+from auth.authentication import (auth_cache, aget_current_user, create_access_token, invalidate_user,
+                                 revoke_token, token_digest, _remember, decode_token)
+from core.context import g
+from db.database import engine, engine_sync, session_maker
+from exceptions.custom_exception import PermissionDenyError
+from models.base import Base
+from models.user import User
+
+
+class TestAuthCache:
+
+    def setup_class(self):
+        Base.metadata.create_all(bind=engine_sync, tables=[User.__table__])
+        with engine_sync.begin() as connection:
+            connection.execute(delete(User))
+
+    async def create_user(self, nickname: str) -> tuple[User, str]:
+        user = await User.objects.a_create(nickname=nickname)
+        return user, create_access_token({"user_id": user.id}, timedelta(minutes=5))
+
+    async def count_selects(self, coro) -> tuple[object, int]:
+        statements = []
+
+        def count(*args):
+            if args[2].lstrip().upper().startswith("SELECT"):
+                statements.append(args[2])
+
+        event.listen(engine.sync_engine, "before_cursor_execute", count)
+        try:
+            return await coro, len(statements)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", count)
+
+    async def test_cache_hit(self):
+        user, token = await self.create_user("hit")
+        first, selects = await self.count_selects(aget_current_user(token))
+        assert first.id == user.id and selects == 1
+        second, selects = await self.count_selects(aget_current_user(token))
+        assert selects == 0
+        assert second.id == user.id and second.nickname == "hit"
+
+    async def test_invalidated_on_commit(self):
+        user, token = await self.create_user("before")
+        await aget_current_user(token)
+        await User.objects.a_update_by_id(user.id, properties={"nickname": "after"})
+        assert token_digest(token) not in auth_cache
+        assert (await aget_current_user(token)).nickname == "after"
+
+    async def test_update_by_id_keeps_other_users(self):
+        changed, changed_token = await self.create_user("changed")
+        other, other_token = await self.create_user("other")
+        await aget_current_user(changed_token)
+        await aget_current_user(other_token)
+        await User.objects.a_update_by_id(changed.id, properties={"nickname": "changed2"})
+        assert token_digest(changed_token) not in auth_cache
+        assert token_digest(other_token) in auth_cache
+
+    async def test_bulk_update_drops_all(self):
+        _, token = await self.create_user("bulk")
+        await aget_current_user(token)
+        await g.session.execute(update(User).where(User.nickname == "nobody").values(email="x@y"))
+        await g.session.commit()
+        assert token_digest(token) not in auth_cache
+
+    async def test_rollback_keeps_cache(self):
+        user, token = await self.create_user("rollback")
+        await aget_current_user(token)
+        await User.objects.a_update_by_id(user.id, properties={"nickname": "x"}, commit=False)
+        await g.session.rollback()
+        assert token_digest(token) in auth_cache
+
+    async def test_revoke_token(self):
+        _, token = await self.create_user("revoked")
+        await aget_current_user(token)
+        revoke_token(token)
+        assert token_digest(token) not in auth_cache
+        try:
+            await aget_current_user(token)
+        except PermissionDenyError:
+            pass
+        else:
+            raise AssertionError("revoked token accepted")
+
+    async def test_stale_load_not_cached(self):
+        user, token = await self.create_user("stale")
+        generation = auth_cache.generation
+        # 读取用户期间提交了改动, 读到的旧值不能写入缓存
+        invalidate_user(user.id)
+        _remember(token_digest(token), decode_token(token), user, generation)
+        assert token_digest(token) not in auth_cache
+
+    async def run(self):
+        self.setup_class()
+        for func in self.__dir__():
+            if func.startswith("test"):
+                auth_cache.clear()
+                g.session = session_maker()
+                try:
+                    await getattr(self, func)()
+                finally:
+                    await g.session.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(TestAuthCache().run())
@@ -0,0 +1,245 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/20 12:30
+# @Author : PinBar
+# @File : test_auth_dependency.py
+"""
+Authentication and permission classes run by the routes' ``auth_dependency``.
+
+    python tests/test_auth_dependency.py
+"""
+import asyncio
+import json
+import sys
+import threading
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from fastapi import FastAPI, APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from auth.base_authentication import BaseAuthentication, AnonymousUser
+from auth.base_permission import BasePermission
+from core import base_view
+from core.base_view import BaseView
+from core.context import g
+from core.decorator import api_description
+from exceptions.custom_exception import ApiError, AuthDenyError
+from middleware.request_log import RequestLogMiddleware
+
+MAIN_THREAD = threading.get_ident()
+# 调用过的方法 -> 认证: 是否在事件循环所在的主线程执行; 权限: 看到的 g.user.id
+calls = {}
+
+
+class InlineAuth(BaseAuthentication):
+    blocking = False
+
+    async def authenticate(self, request: Request):
+        calls["authenticate"] = threading.get_ident() == MAIN_THREAD
+        return AnonymousUser(id=7)
+
+    def authenticate_sync(self, request: Request):
+        calls["authenticate_sync"] = threading.get_ident() == MAIN_THREAD
+        return AnonymousUser(id=7)
+
+
+class BlockingAuth(BaseAuthentication):
+
+    def authenticate_sync(self, request: Request):
+        calls["authenticate_sync"] = threading.get_ident() == MAIN_THREAD
+        return AnonymousUser(id=8)
+
+
+class DenyAuth(InlineAuth):
+
+    def authenticate_sync(self, request: Request):
+        raise AuthDenyError()
+
+
+class CustomCallAuth(BaseAuthentication):
+    """Wires its own dependency, reading the user id from a header."""
+
+    def __call__(self, func):
+        async def run(request: Request):
+            calls["custom"] = True
+            self.set_context(request, AnonymousUser(id=int(request.headers["x-user-id"])))
+
+        return run
+
+
+class Allow(BasePermission):
+    blocking = False
+
+    async def has_permission(self, request: Request) -> bool:
+        calls["has_permission"] = g.user.id
+        return True
+
+    def has_permission_sync(self, request: Request) -> bool:
+        calls["has_permission_sync"] = g.user.id
+        return True
+
+
+class Deny(Allow):
+
+    async def has_permission(self, request: Request) -> bool:
+        return False
+
+    def has_permission_sync(self, request: Request) -> bool:
+        return False
+
+
+class BlockingDeny(Deny):
+    blocking = True
+
+
+class AsyncView(BaseView):
+    authentication_classes = [InlineAuth]
+    permissions_classes = [Allow]
+
+    @api_description(depend_session=False)
+    async def get(self):
+        return self.response(data=g.user.id)
+
+
+class InlineView(BaseView):
+    authentication_classes = [InlineAuth]
+    permissions_classes = [Allow]
+
+    @api_description(depend_session=False)
+    def get(self):
+        return self.response(data=g.user.id)
+
+
+class BlockingView(BaseView):
+    authentication_classes = [BlockingAuth]
+    permissions_classes = [Allow]
+
+    @api_description(depend_session=False)
+    def get(self, request: Request):
+        return self.response(data=[g.user.id, g.user_id, request.state.user_id])
+
+
+class DenyView(BaseView):
+    authentication_classes = [InlineAuth]
+    permissions_classes = [Allow, Deny]
+
+    @api_description(depend_session=False)
+    async def get(self):
+        return self.response(data="unreachable")
+
+    @api_description(depend_session=False)
+    def post(self):
+        return self.response(data="unreachable")
+
+    @api_description(depend_session=False, permission_classes=[BlockingDeny])
+    def multi_put(self):
+        return self.response(data="unreachable")
+
+
+class UnauthorizedView(BaseView):
+    authentication_classes = [DenyAuth]
+    permissions_classes = [Allow]
+
+    @api_description(depend_session=False)
+    def get(self):
+        return self.response(data="unreachable")
+
+
+class CustomCallView(BaseView):
+    authentication_classes = [CustomCallAuth]
+    permissions_classes = [Allow]
+
+    @api_description(depend_session=False)
+    def get(self):
+        return self.response(data=g.user.id)
+
+
+def create_app() -> FastAPI:
+    base_view.base_router = APIRouter()
+    AsyncView("/async")
+    InlineView("/inline")
+    BlockingView("/blocking")
+    DenyView("/deny")
+    UnauthorizedView("/unauthorized")
+    CustomCallView("/custom")
+    app = FastAPI()
+    app.include_router(base_view.base_router)
+    app.add_middleware(RequestLogMiddleware)
+
+    @app.exception_handler(ApiError)
+    async def api_error(request: Request, exc: ApiError):
+        return JSONResponse(status_code=exc.http_code, content={"message": exc.message, "code": exc.code})
+
+    return app
+
+
+async def call(app: FastAPI, method: str, path: str, headers: list = None):
+    scope = {"type": "http", "method": method, "path": path, "raw_path": path.encode(), "query_string": b"",
+             "headers": headers or [], "http_version": "1.1", "scheme": "http", "server": ("testserver", 80),
+             "client": ("testclient", 50000), "root_path": ""}
+    response = {"status": None, "body": b""}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        else:
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    response["json"] = json.loads(response["body"])
+    return response
+
+
+class TestAuthDependency:
+
+    def setup_class(self):
+        self.app = create_app()
+
+    async def test_async_route(self):
+        response = await call(self.app, "GET", "/async")
+        assert response["status"] == 200 and response["json"]["data"] == 7
+        assert calls == {"authenticate": True, "has_permission": 7}
+
+    async def test_sync_non_blocking_route(self):
+        response = await call(self.app, "GET", "/inline")
+        assert response["status"] == 200 and response["json"]["data"] == 7
+        # 全部非阻塞, 在事件循环上直接执行
+        assert calls == {"authenticate_sync": True, "has_permission_sync": 7}
+
+    async def test_sync_blocking_route(self):
+        response = await call(self.app, "GET", "/blocking")
+        assert response["status"] == 200
+        # 线程池中认证, 回到事件循环后重新设置的上下文在接口里可见
+        assert response["json"]["data"] == [8, 8, 8]
+        assert calls == {"authenticate_sync": False, "has_permission_sync": 8}
+
+    async def test_permission_denied(self):
+        for method in ("GET", "POST", "PUT"):
+            response = await call(self.app, method, "/deny")
+            assert response["status"] == 403, method
+            assert response["json"]["message"] == "权限错误"
+
+    async def test_authentication_denied(self):
+        response = await call(self.app, "GET", "/unauthorized")
+        assert response["status"] == 401
+        assert "has_permission_sync" not in calls
+
+    async def test_custom_call(self):
+        response = await call(self.app, "GET", "/custom", [(b"x-user-id", b"9")])
+        assert response["status"] == 200 and response["json"]["data"] == 9
+        assert calls == {"custom": True, "has_permission_sync": 9}
+
+    async def run(self):
+        self.setup_class()
+        for func in self.__dir__():
+            if func.startswith("test"):
+                calls.clear()
+                await getattr(self, func)()
+
+
+if __name__ == '__main__':
+    asyncio.run(TestAuthDependency().run())
@@ -163,6 +163,40 @@ class TestCRUD:
         new_users = User.objects.filter(User.id.in_([u1.id, u2.id]), User.is_delete == 0).values_list(flat=True)
         assert new_users == []
 
+    async def test_atomic_sync(self):
+        from db.database import sessionmanager
+        name = f"atomic_{time.time()}"
+        with sessionmanager.atomic():
+            user = User.objects.create(username=name, nickname="test", email="")
+            try:
+                with sessionmanager.atomic():
+                    User.objects.update_obj(user, properties={"nickname": "rollback"})
+                    raise ValueError
+            except ValueError:
+                pass
+        assert User.objects.filter(User.username == name).first().nickname == "test"
+        try:
+            with sessionmanager.atomic():
+                User.objects.create(username=f"{name}_2", nickname="test", email="")
+                raise ValueError
+        except ValueError:
+            pass
+        assert not User.objects.filter(User.username == f"{name}_2").exists()
+
+    async def test_atomic(self):
+        from db.database import sessionmanager
+        name = f"atomic_{time.time()}"
+        async with sessionmanager.aatomic():
+            await User.objects.a_create(username=name, nickname="test", email="")
+            try:
+                async with sessionmanager.aatomic():
+                    await User.objects.a_create(username=f"{name}_2", nickname="test", email="")
+                    raise ValueError
+            except ValueError:
+                pass
+        assert await User.objects.filter(User.username == name).aexists()
+        assert not await User.objects.filter(User.username == f"{name}_2").aexists()
+
     async def run(self):
         self.setup_class()
         async with with_session():
@@ -186,6 +220,8 @@ class TestCRUD:
             await self.test_soft_delete_by_id_sync()
             await self.test_soft_delete_by_ids()
             await self.test_soft_delete_by_ids_sync()
+            await self.test_atomic_sync()
+            await self.test_atomic()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,139 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/19 21:30
+# @Author : PinBar
+# @File : test_disconnect.py
+"""
+Client disconnects cancel the handler and free the DB connection before the query would finish.
+
+    python tests/test_disconnect.py
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from fastapi import FastAPI, APIRouter, Request
+from sqlalchemy import text
+
+from core import base_view
+from core.base_view import BaseView
+from core.context import g
+from core.decorator import api_description
+from db.database import engine
+from middleware.disconnect import DisconnectMiddleware
+from middleware.request_log import RequestLogMiddleware
+
+SLOW_QUERY_SECONDS = 2
+SLOW_QUERIES = {
+    "mysql": f"SELECT SLEEP({SLOW_QUERY_SECONDS})",
+    "postgresql": f"SELECT pg_sleep({SLOW_QUERY_SECONDS})",
+    "sqlite": "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 5000000) "
+              "SELECT count(*) FROM c",
+}
+
+
+class SlowView(BaseView):
+    authentication_classes = []
+
+    @api_description()
+    async def get(self):
+        result = await g.session.execute(text(SLOW_QUERIES[engine.dialect.name]))
+        return self.response(data=result.scalar())
+
+
+class UploadView(BaseView):
+    authentication_classes = []
+
+    @api_description(depend_session=False)
+    async def post(self, request: Request):
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+        return self.response(data=size)
+
+
+def create_app(cancel_on_disconnect: bool) -> FastAPI:
+    base_view.base_router = APIRouter()
+    SlowView("/slow")
+    UploadView("/upload")
+    app = FastAPI()
+    app.include_router(base_view.base_router)
+    if cancel_on_disconnect:
+        app.add_middleware(DisconnectMiddleware)
+    app.add_middleware(RequestLogMiddleware)
+    return app
+
+
+async def call(app: FastAPI, method: str, path: str, chunks: list[bytes] = None, disconnect_after: float = None):
+    chunks = list(chunks or [b""])
+    headers = [(b"content-length", str(sum(map(len, chunks))).encode())] if chunks != [b""] else []
+    scope = {"type": "http", "method": method, "path": path, "raw_path": path.encode(), "query_string": b"",
+             "headers": headers, "http_version": "1.1", "scheme": "http", "server": ("testserver", 80),
+             "client": ("testclient", 50000), "root_path": ""}
+    response = {"status": None, "body": b""}
+
+    async def receive():
+        if chunks:
+            body = chunks.pop(0)
+            return {"type": "http.request", "body": body, "more_body": bool(chunks)}
+        if disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(disconnect_after)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        else:
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response
+
+
+async def connection_release_seconds(app: FastAPI, disconnect_after: float = 0.2) -> float:
+    """Seconds between the client disconnect and the pool getting its connection back."""
+    task = asyncio.create_task(call(app, "GET", "/slow", disconnect_after=disconnect_after))
+    start = time.perf_counter()
+    while engine.pool.checkedout() == 0:
+        await asyncio.sleep(0.005)
+    disconnect_at = start + disconnect_after
+    while engine.pool.checkedout() > 0:
+        await asyncio.sleep(0.005)
+    released = time.perf_counter() - disconnect_at
+    await task
+    return released
+
+
+class TestDisconnect:
+
+    async def test_disconnect_frees_connection(self):
+        released_with_cancel = await connection_release_seconds(create_app(cancel_on_disconnect=True))
+        released_without_cancel = await connection_release_seconds(create_app(cancel_on_disconnect=False))
+        print(f"connection released {released_with_cancel:.3f}s after disconnect with DisconnectMiddleware, "
+              f"{released_without_cancel:.3f}s without")
+        assert released_with_cancel < 0.5
+        assert released_with_cancel < released_without_cancel
+
+    async def test_connection_reusable_after_cancel(self):
+        app = create_app(cancel_on_disconnect=True)
+        await connection_release_seconds(app)
+        async with engine.connect() as connection:
+            assert (await connection.execute(text("SELECT 1"))).scalar() == 1
+
+    async def test_completed_request(self):
+        app = create_app(cancel_on_disconnect=True)
+        response = await call(app, "POST", "/upload", chunks=[b"a" * 1000] * 5, disconnect_after=0)
+        assert response["status"] == 200
+        assert b'"data":5000' in response["body"]
+
+    async def run(self):
+        await self.test_disconnect_frees_connection()
+        await self.test_connection_reusable_after_cancel()
+        await self.test_completed_request()
+
+
+if __name__ == '__main__':
+    asyncio.run(TestDisconnect().run())
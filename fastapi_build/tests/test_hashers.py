@@ -0,0 +1,108 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/20 12:00
+# @Author : PinBar
+# @File : test_hashers.py
+"""
+Admission and recovery of the password hash process pool.
+
+    python tests/test_hashers.py
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from auth import hashers
+from auth.hashers import HashPool, password_hash_rejected_total, password_hash_pending
+from exceptions.custom_exception import ServiceBusyError
+
+
+def metric_value(child) -> float:
+    return child.store.values[child.index]
+
+
+class TestHashPool:
+
+    async def test_admission_limit(self):
+        pool = HashPool(workers=1, max_pending=2)
+        rejected = metric_value(password_hash_rejected_total.labels())
+        try:
+            running = [pool.submit(time.sleep, 0.5) for _ in range(2)]
+            assert pool.pending == 2 and metric_value(password_hash_pending.labels()) == 2
+            try:
+                pool.submit(abs, -1)
+            except ServiceBusyError:
+                pass
+            else:
+                raise AssertionError("submit over max_pending accepted")
+            assert metric_value(password_hash_rejected_total.labels()) == rejected + 1
+            for future in running:
+                future.result(timeout=30)
+            # 回调在管理线程中执行, 等 pending 回落
+            for _ in range(100):
+                if pool.pending == 0:
+                    break
+                time.sleep(0.01)
+            assert pool.pending == 0
+            assert pool.submit(abs, -1).result(timeout=30) == 1
+        finally:
+            pool.shutdown()
+
+    async def test_concurrent_submits_share_executor(self):
+        created = []
+
+        class CountingExecutor(hashers.ProcessPoolExecutor):
+            def __init__(self, *args, **kwargs):
+                created.append(self)
+                super().__init__(*args, **kwargs)
+
+        origin, hashers.ProcessPoolExecutor = hashers.ProcessPoolExecutor, CountingExecutor
+        pool = HashPool(workers=1, max_pending=16)
+        barrier = threading.Barrier(8)
+        futures = []
+
+        def submit():
+            barrier.wait()
+            futures.append(pool.submit(abs, -1))
+
+        try:
+            threads = [threading.Thread(target=submit) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert [future.result(timeout=30) for future in futures] == [1] * 8
+            assert len(created) == 1
+        finally:
+            hashers.ProcessPoolExecutor = origin
+            pool.shutdown()
+
+    async def test_broken_pool_replaced(self):
+        pool = HashPool(workers=1, max_pending=4)
+        try:
+            crashed = pool.submit(os._exit, 1)
+            try:
+                crashed.result(timeout=30)
+            except BrokenProcessPool:
+                pass
+            else:
+                raise AssertionError("pool process did not exit")
+            broken = pool._executor
+            assert pool.submit(abs, -2).result(timeout=30) == 2
+            assert pool._executor is not broken
+        finally:
+            pool.shutdown()
+
+    async def run(self):
+        for func in self.__dir__():
+            if func.startswith("test"):
+                await getattr(self, func)()
+
+
+if __name__ == '__main__':
+    asyncio.run(TestHashPool().run())
@@ -0,0 +1,163 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/20 13:00
+# @Author : PinBar
+# @File : test_permissions.py
+"""
+Permission sets cached by ``load_permissions`` / ``aload_permissions``. Needs Redis (REDIS_HOST).
+
+    python tests/test_permissions.py
+"""
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from sqlalchemy import String, Integer, delete, select
+from sqlalchemy.orm import Mapped, mapped_column
+
+from auth import permissions as perms
+from auth.base_authentication import AnonymousUser
+from auth.permissions import (permission_cache, set_permission_loader, aload_permissions, load_permissions, require,
+                              watch_permission_models, ainvalidate_permissions, invalidate_permissions)
+from core.context import g
+from db.database import engine_sync, session_maker, session_maker_sync
+from db.redis_client import r_cache
+from models.base import BaseModel, Base
+
+
+class UserRole(BaseModel):
+    __tablename__ = 'user_role_test'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    role: Mapped[str] = mapped_column(String(32), nullable=False)
+
+
+watch_permission_models(UserRole)
+loads = []
+
+
+def load_roles(user) -> list[str]:
+    loads.append(user.id)
+    with session_maker_sync() as session:
+        return list(session.scalars(select(UserRole.role).where(UserRole.user_id == user.id)))
+
+
+async def aload_roles(user) -> list[str]:
+    loads.append(user.id)
+    async with session_maker() as session:
+        return list(await session.scalars(select(UserRole.role).where(UserRole.user_id == user.id)))
+
+
+def redis_permissions(user_id: int):
+    value = r_cache.get(perms._redis_key(str(user_id)))
+    return None if value is None else set(json.loads(value))
+
+
+async def add_role(user_id: int, role: str):
+    async with session_maker() as session:
+        session.add(UserRole(user_id=user_id, role=role))
+        await session.commit()
+
+
+class TestPermissions:
+
+    def setup_class(self):
+        Base.metadata.create_all(bind=engine_sync, tables=[UserRole.__table__])
+
+    def clear(self):
+        with engine_sync.begin() as connection:
+            connection.execute(delete(UserRole))
+        permission_cache.clear()
+        r_cache.delete(*r_cache.keys(f"{perms.PERMISSION_CACHE_PREFIX}:*") or ["-"])
+        loads.clear()
+        set_permission_loader(load_roles, aload_roles)
+
+    async def test_require(self):
+        await add_role(1, "order.view")
+        g.user = AnonymousUser(id=1)
+        assert await require("order.view")().has_permission(None)
+        assert not await require("order.view", "order.edit")().has_permission(None)
+        assert require("order.view")().has_permission_sync(None)
+        assert not require("order.edit")().has_permission_sync(None)
+        # 第一次加载后都从缓存读取
+        assert loads == [1]
+        assert redis_permissions(1) == {"order.view"}
+
+    async def test_redis_shared_between_workers(self):
+        await add_role(1, "a")
+        await aload_permissions(AnonymousUser(id=1))
+        # 另一个 worker 的本地缓存是空的, 从 Redis 读取
+        permission_cache.clear()
+        assert load_permissions(AnonymousUser(id=1)) == {"a"}
+        assert loads == [1]
+
+    async def test_watch_permission_models(self):
+        await add_role(1, "a")
+        await add_role(2, "b")
+        await aload_permissions(AnonymousUser(id=1))
+        await aload_permissions(AnonymousUser(id=2))
+        await add_role(1, "c")
+        assert "1" not in permission_cache and redis_permissions(1) is None
+        assert "2" in permission_cache and redis_permissions(2) == {"b"}
+        assert await aload_permissions(AnonymousUser(id=1)) == {"a", "c"}
+
+        # 同步 session 提交同样生效
+        with session_maker_sync() as session:
+            session.add(UserRole(user_id=2, role="d"))
+            session.commit()
+        assert "2" not in permission_cache and redis_permissions(2) is None
+        assert load_permissions(AnonymousUser(id=2)) == {"b", "d"}
+
+    async def test_bulk_statement_invalidates_all(self):
+        await add_role(1, "a")
+        await add_role(2, "b")
+        await aload_permissions(AnonymousUser(id=1))
+        await aload_permissions(AnonymousUser(id=2))
+        async with session_maker() as session:
+            await session.execute(delete(UserRole).where(UserRole.role == "a"))
+            await session.commit()
+        assert len(permission_cache) == 0
+        assert redis_permissions(1) is None and redis_permissions(2) is None
+        assert await aload_permissions(AnonymousUser(id=1)) == frozenset()
+
+    async def test_invalidate_permissions(self):
+        await add_role(1, "a")
+        await add_role(2, "b")
+        await aload_permissions(AnonymousUser(id=1))
+        await aload_permissions(AnonymousUser(id=2))
+        await ainvalidate_permissions(1)
+        assert "1" not in permission_cache and redis_permissions(1) is None
+        assert redis_permissions(2) == {"b"}
+        invalidate_permissions()
+        assert len(permission_cache) == 0 and redis_permissions(2) is None
+
+    async def test_stale_load_not_cached(self):
+        await add_role(1, "old")
+
+        async def slow_loader(user):
+            roles = await aload_roles(user)
+            # 读完旧角色后, 另一个请求提交了改动并失效缓存
+            await add_role(1, "new")
+            return roles
+
+        set_permission_loader(load_roles, slow_loader)
+        assert await aload_permissions(AnonymousUser(id=1)) == {"old"}
+        # 旧集合既没有写入本进程缓存, 也没有写回 Redis
+        assert "1" not in permission_cache and redis_permissions(1) is None
+        set_permission_loader(load_roles, aload_roles)
+        assert await aload_permissions(AnonymousUser(id=1)) == {"old", "new"}
+        assert redis_permissions(1) == {"old", "new"}
+
+    async def run(self):
+        self.setup_class()
+        for func in self.__dir__():
+            if func.startswith("test"):
+                self.clear()
+                await getattr(self, func)()
+
+
+if __name__ == '__main__':
+    asyncio.run(TestPermissions().run())
@@ -201,6 +201,30 @@ class TestQuery(BaseTest):
         delete_user = await User.objects.aget(User.nickname == "soft_delete2")
         assert delete_user is None
 
+    async def test_partition(self):
+        for i in range(10):
+            User.objects.create(username=f"test_{time.time()}_{i}", nickname="partition")
+        count = User.objects.count()
+        for method in ("minmax", "quantile"):
+            parts = User.objects.partition(4, method=method)
+            assert sum(p.count() for p in parts) == count
+        ids = User.objects.order_by(User.id).values_list("id", flat=True)
+        assert User.objects.parallel_map(lambda user: user.id, workers=2) == ids
+
+    async def test_partition_invalid(self):
+        invalid = [lambda: User.objects.partition(0), lambda: User.objects.partition(-1),
+                   lambda: User.objects.filter().limit(5).partition(2),
+                   lambda: User.objects.filter().offset(5).parallel_map(abs, workers=2),
+                   lambda: User.objects.parallel_map(abs, workers=0),
+                   lambda: User.objects.parallel_map(abs, workers=2, partitions=0)]
+        for call in invalid:
+            try:
+                call()
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("invalid partition accepted")
+
 
 if __name__ == '__main__':
     asyncio.run(TestQuery().run())
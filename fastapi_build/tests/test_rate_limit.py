@@ -0,0 +1,124 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/20 15:00
+# @Author : PinBar
+# @File : test_rate_limit.py
+"""
+Redis token bucket of ``api_description(rate_limit=...)``. Needs Redis (REDIS_HOST).
+
+    python tests/test_rate_limit.py
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from fastapi import FastAPI, APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from core import base_view
+from core.base_view import BaseView
+from core.decorator import api_description
+from core.rate_limit import RateLimiter, Rate
+from db.redis_client import r_cache
+from exceptions.custom_exception import ApiError, TooManyRequestsError
+from middleware.request_log import RequestLogMiddleware
+
+
+class LimitedView(BaseView):
+    authentication_classes = []
+
+    @api_description(depend_session=False, rate_limit="2/min", rate_limit_key="ip")
+    async def get(self):
+        return self.response(data="ok")
+
+
+def create_app() -> FastAPI:
+    base_view.base_router = APIRouter()
+    LimitedView("/limited")
+    app = FastAPI()
+    app.include_router(base_view.base_router)
+    app.add_middleware(RequestLogMiddleware)
+
+    @app.exception_handler(ApiError)
+    async def api_error(request: Request, exc: ApiError):
+        return JSONResponse(status_code=exc.http_code, content={"message": exc.message, "code": exc.code},
+                            headers=getattr(exc, "headers", None))
+
+    return app
+
+
+async def call(app: FastAPI, path: str, client: str = "10.0.0.1"):
+    scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "headers": [], "http_version": "1.1", "scheme": "http", "server": ("testserver", 80),
+             "client": (client, 50000), "root_path": ""}
+    response = {"status": None, "headers": {}}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode(): v.decode() for k, v in message["headers"]}
+
+    await app(scope, receive, send)
+    return response
+
+
+async def rejected(limiter: RateLimiter, key: str) -> bool:
+    try:
+        await limiter.check(key)
+    except TooManyRequestsError:
+        return True
+    return False
+
+
+class TestRateLimit:
+
+    def setup_class(self):
+        r_cache.delete(*r_cache.keys("rate_limit:*") or ["-"])
+
+    async def test_429_with_retry_after(self):
+        app = create_app()
+        assert [(await call(app, "/limited"))["status"] for _ in range(2)] == [200, 200]
+        response = await call(app, "/limited")
+        assert response["status"] == 429
+        # 每 30 秒补充一个令牌
+        assert 1 <= int(response["headers"]["retry-after"]) <= 30
+        # 按 ip 分桶, 其他客户端不受影响
+        assert (await call(app, "/limited", client="10.0.0.2"))["status"] == 200
+
+    async def test_bucket_refills(self):
+        limiter = RateLimiter("refill", Rate(2, 0.2), key="global")
+        assert not await rejected(limiter, "k") and not await rejected(limiter, "k")
+        assert await rejected(limiter, "k")
+        # 0.1 秒补充一个令牌
+        await asyncio.sleep(0.15)
+        assert not await rejected(limiter, "k")
+        assert await rejected(limiter, "k")
+        assert r_cache.exists("rate_limit:refill:k")
+
+    async def test_shared_between_workers(self):
+        # 两个 RateLimiter 模拟两个 worker, 令牌桶在 Redis 中共享
+        first, second = RateLimiter("shared", "2/min"), RateLimiter("shared", "2/min")
+        assert not await rejected(first, "k") and not await rejected(second, "k")
+        assert await rejected(first, "k") and await rejected(second, "k")
+
+    async def test_local_fallback(self):
+        limiter = RateLimiter("fallback", "1/min")
+        limiter._redis_down_until = time.monotonic() + 60
+        assert not await rejected(limiter, "k")
+        assert await rejected(limiter, "k")
+        assert not r_cache.exists("rate_limit:fallback:k")
+
+    async def run(self):
+        self.setup_class()
+        for func in self.__dir__():
+            if func.startswith("test"):
+                await getattr(self, func)()
+
+
+if __name__ == '__main__':
+    asyncio.run(TestRateLimit().run())
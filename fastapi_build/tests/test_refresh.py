@@ -0,0 +1,83 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/20 11:00
+# @Author : PinBar
+# @File : test_refresh.py
+"""
+``a_create`` / ``a_update_by_id`` return objects with the stored values, whatever the session's
+``expire_on_commit``.
+
+    python tests/test_refresh.py
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from sqlalchemy import String, Integer, delete, text, event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Mapped, mapped_column
+
+from core.context import g
+from db.database import engine, engine_sync
+from models.base import BaseModel, Base
+
+
+class Article(BaseModel):
+    __tablename__ = 'article_test'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    title: Mapped[str] = mapped_column(String(32), nullable=False)
+    summary: Mapped[str] = mapped_column(String(32), nullable=True)
+    status: Mapped[str] = mapped_column(String(16), nullable=True, server_default=text("'draft'"))
+
+
+class TestRefresh:
+
+    def setup_class(self):
+        Base.metadata.create_all(bind=engine_sync, tables=[Article.__table__])
+        with engine_sync.begin() as connection:
+            connection.execute(delete(Article))
+
+    async def create(self, expire_on_commit: bool) -> Article:
+        g.session = async_sessionmaker(bind=engine, expire_on_commit=expire_on_commit)()
+        try:
+            return await Article.objects.a_create(title=f"expire={expire_on_commit}")
+        finally:
+            await g.session.close()
+
+    async def test_expire_on_commit(self):
+        article = await self.create(expire_on_commit=True)
+        assert article.id is not None
+        assert article.title == "expire=True"
+        assert article.create_time is not None
+        assert article.summary is None
+        assert article.status == "draft"
+
+    async def test_no_expire(self):
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+
+        event.listen(engine.sync_engine, "before_cursor_execute", count)
+        try:
+            article = await self.create(expire_on_commit=False)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", count)
+        assert article.id is not None and article.title == "expire=False"
+        assert article.summary is None
+        assert article.status == "draft"
+        # summary 没有写入也没有服务端默认值, 不需要再查询
+        assert not any("summary" in statement and statement.lstrip().upper().startswith("SELECT")
+                       for statement in statements)
+
+    async def run(self):
+        self.setup_class()
+        for func in self.__dir__():
+            if func.startswith("test"):
+                await getattr(self, func)()
+
+
+if __name__ == '__main__':
+    asyncio.run(TestRefresh().run())
@@ -0,0 +1,166 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/20 14:30
+# @Author : PinBar
+# @File : test_response_cache.py
+"""
+``api_description(cache_ttl=...)`` responses, invalidated by writes to the tables they read. Needs Redis (REDIS_HOST).
+
+    python tests/test_response_cache.py
+"""
+import asyncio
+import gzip
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from fastapi import FastAPI, APIRouter, Request, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import String, Integer, delete, insert
+from sqlalchemy.orm import Mapped, mapped_column
+
+from core import base_view
+from core.base_view import BaseView
+from core.context import g
+from core.decorator import api_description
+from db.database import engine_sync, session_maker
+from db.redis_client import r_cache
+from exceptions.custom_exception import ApiError
+from middleware.cache import ResponseCacheMiddleware
+from middleware.request_log import RequestLogMiddleware
+from models.base import BaseModel, Base
+
+calls = []
+
+
+class CacheRow(BaseModel):
+    __tablename__ = 'response_cache_test'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String(32), nullable=False)
+
+
+class CachedView(BaseView):
+    authentication_classes = []
+
+    @api_description(cache_ttl=60, vary_on=["accept-language"])
+    async def get(self, response: Response):
+        calls.append(1)
+        names = [row["name"] for row in await CacheRow.objects.filter().order_by(CacheRow.id).avalues("name")]
+        response.headers["Cache-Control"] = "max-age=30"
+        response.headers["X-Custom"] = "kept"
+        return self.response(data=names)
+
+
+class CompressedView(BaseView):
+    authentication_classes = []
+
+    @api_description(cache_ttl=60, cache_compress=True)
+    async def get(self):
+        return self.response(data=[row["name"] for row in await CacheRow.objects.filter().avalues("name")])
+
+
+def create_app() -> FastAPI:
+    base_view.base_router = APIRouter()
+    CachedView("/cached")
+    CompressedView("/compressed")
+    app = FastAPI()
+    app.include_router(base_view.base_router)
+    app.add_middleware(ResponseCacheMiddleware)
+    app.add_middleware(RequestLogMiddleware)
+
+    @app.exception_handler(ApiError)
+    async def api_error(request: Request, exc: ApiError):
+        return JSONResponse(status_code=exc.http_code, content={"message": exc.message, "code": exc.code})
+
+    return app
+
+
+async def call(app: FastAPI, path: str, headers: list = None):
+    scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "headers": headers or [], "http_version": "1.1", "scheme": "http", "server": ("testserver", 80),
+             "client": ("testclient", 50000), "root_path": ""}
+    response = {"status": None, "headers": {}, "body": b""}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode(): v.decode() for k, v in message["headers"]}
+        else:
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response
+
+
+class TestResponseCache:
+
+    def setup_class(self):
+        Base.metadata.create_all(bind=engine_sync, tables=[CacheRow.__table__])
+        with engine_sync.begin() as connection:
+            connection.execute(delete(CacheRow))
+            connection.execute(insert(CacheRow), [{"name": "a"}])
+        r_cache.delete(*r_cache.keys("resp_cache:*") or ["-"])
+        self.app = create_app()
+
+    async def test_hit_then_invalidated_by_write(self):
+        # 第一次只记录路由读过的表, 第二次写入缓存, 第三次命中
+        for _ in range(2):
+            response = await call(self.app, "/cached")
+            assert response["status"] == 200 and "x-cache" not in response["headers"]
+        hit = await call(self.app, "/cached")
+        assert len(calls) == 2
+        assert hit["headers"]["x-cache"] == "HIT"
+        assert json.loads(hit["body"])["data"] == ["a"]
+        # 路由自己的响应头和 Vary 在命中时保留
+        assert hit["headers"]["cache-control"] == "max-age=30"
+        assert hit["headers"]["x-custom"] == "kept"
+        assert hit["headers"]["content-type"] == "application/json"
+        assert hit["headers"]["vary"] == "accept-language"
+        assert int(hit["headers"]["content-length"]) == len(hit["body"])
+
+        # ModelManager 写入提交后刷新表版本, 下次请求未命中
+        g.session = session_maker()
+        try:
+            await CacheRow.objects.a_create(name="b")
+        finally:
+            await g.session.close()
+        miss = await call(self.app, "/cached")
+        assert "x-cache" not in miss["headers"] and len(calls) == 3
+        assert json.loads(miss["body"])["data"] == ["a", "b"]
+        assert (await call(self.app, "/cached"))["headers"]["x-cache"] == "HIT"
+
+    async def test_vary_on_header_separates_entries(self):
+        hit = await call(self.app, "/cached")
+        assert hit["headers"]["x-cache"] == "HIT"
+        other = await call(self.app, "/cached", [(b"accept-language", b"en")])
+        assert "x-cache" not in other["headers"]
+
+    async def test_compressed_entry_negotiated(self):
+        for _ in range(2):
+            await call(self.app, "/compressed")
+        accepted = await call(self.app, "/compressed", [(b"accept-encoding", b"gzip, br")])
+        assert accepted["headers"]["x-cache"] == "HIT"
+        assert accepted["headers"]["content-encoding"] == "gzip"
+        assert accepted["headers"]["vary"] == "Accept-Encoding"
+        assert json.loads(gzip.decompress(accepted["body"]))["data"]
+
+        # q=0 表示拒绝 gzip, 返回解压后的内容
+        refused = await call(self.app, "/compressed", [(b"accept-encoding", b"gzip;q=0, identity")])
+        assert refused["headers"]["x-cache"] == "HIT"
+        assert "content-encoding" not in refused["headers"]
+        assert refused["headers"]["vary"] == "Accept-Encoding"
+        assert json.loads(refused["body"])["data"]
+
+    async def run(self):
+        self.setup_class()
+        for func in sorted(name for name in self.__dir__() if name.startswith("test")):
+            await getattr(self, func)()
+
+
+if __name__ == '__main__':
+    asyncio.run(TestResponseCache().run())
@@ -0,0 +1,114 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/20 15:30
+# @Author : PinBar
+# @File : test_single_flight.py
+"""
+Identical concurrent GETs of an ``api_description(single_flight=True)`` route share one run.
+
+    python tests/test_single_flight.py
+"""
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from fastapi import FastAPI, APIRouter
+from fastapi.responses import JSONResponse
+
+from core import base_view
+from core.base_view import BaseView
+from core.decorator import api_description
+from middleware.request_log import RequestLogMiddleware
+from middleware.single_flight import SingleFlightMiddleware
+
+calls = []
+# 为 True 时下一次执行返回 500
+state = {"fail": False}
+
+
+class ReportView(BaseView):
+    authentication_classes = []
+
+    @api_description(depend_session=False, single_flight=True)
+    async def get(self, name: str = ""):
+        calls.append(name)
+        await asyncio.sleep(0.1)
+        if state["fail"]:
+            state["fail"] = False
+            return JSONResponse({"message": "error"}, status_code=500)
+        return JSONResponse({"data": name, "run": len(calls)}, headers={"X-Report": name})
+
+
+def create_app() -> FastAPI:
+    base_view.base_router = APIRouter()
+    ReportView("/report")
+    app = FastAPI()
+    app.include_router(base_view.base_router)
+    app.add_middleware(SingleFlightMiddleware)
+    app.add_middleware(RequestLogMiddleware)
+    return app
+
+
+async def call(app: FastAPI, path: str, query_string: str = ""):
+    scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(),
+             "query_string": query_string.encode(), "headers": [], "http_version": "1.1", "scheme": "http",
+             "server": ("testserver", 80), "client": ("testclient", 50000), "root_path": ""}
+    response = {"status": None, "headers": {}, "body": b""}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode(): v.decode() for k, v in message["headers"]}
+        else:
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response
+
+
+class TestSingleFlight:
+
+    def setup_class(self):
+        self.app = create_app()
+
+    async def test_concurrent_requests_run_once(self):
+        responses = await asyncio.gather(*[call(self.app, "/report", "name=a") for _ in range(5)])
+        assert calls == ["a"]
+        assert all(response["status"] == 200 for response in responses)
+        assert {json.loads(response["body"])["run"] for response in responses} == {1}
+        shared = [response for response in responses if response["headers"].get("x-single-flight") == "shared"]
+        assert len(shared) == 4
+        assert all(response["headers"]["x-report"] == "a" for response in shared)
+
+    async def test_different_requests_not_shared(self):
+        await asyncio.gather(call(self.app, "/report", "name=a"), call(self.app, "/report", "name=b"))
+        assert sorted(calls) == ["a", "b"]
+
+    async def test_server_error_not_shared(self):
+        state["fail"] = True
+        responses = await asyncio.gather(*[call(self.app, "/report", "name=c") for _ in range(3)])
+        # 领头请求 500, 等待的请求各自执行
+        assert len(calls) == 3
+        assert sorted(response["status"] for response in responses) == [200, 200, 500]
+        assert not any("x-single-flight" in response["headers"] for response in responses)
+
+    async def test_sequential_requests_not_shared(self):
+        await call(self.app, "/report", "name=d")
+        await call(self.app, "/report", "name=d")
+        assert calls == ["d", "d"]
+
+    async def run(self):
+        self.setup_class()
+        for func in self.__dir__():
+            if func.startswith("test"):
+                calls.clear()
+                await getattr(self, func)()
+
+
+if __name__ == '__main__':
+    asyncio.run(TestSingleFlight().run())
@@ -0,0 +1,186 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/20 10:00
+# @Author : PinBar
+# @File : test_streaming.py
+"""
+QuerySet exports streamed by ``BaseView.export``.
+
+    python tests/test_streaming.py
+"""
+import asyncio
+import gzip
+import io
+import sys
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fastapi import FastAPI, APIRouter
+from sqlalchemy import String, Integer, JSON, delete, insert
+from sqlalchemy.orm import Mapped, mapped_column
+
+from core import base_view
+from core.base_view import BaseView
+from core.context import g
+from core.decorator import api_description
+from db.database import engine_sync, session_maker_sync, session_maker
+from middleware.request_log import RequestLogMiddleware
+from models.base import BaseModel, Base
+
+
+class ExportRow(BaseModel):
+    __tablename__ = 'export_test'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String(32), nullable=False)
+    score: Mapped[int] = mapped_column(Integer, nullable=True)
+
+
+class ExportView(BaseView):
+    authentication_classes = []
+
+    @api_description(depend_session=False)
+    async def get(self, format: str = "csv", min_score: int = 0, compress: bool = False):
+        queryset = ExportRow.objects.filter(ExportRow.score >= min_score).with_columns("name", "score")
+        return self.export(queryset, format, gzip=compress, chunk_size=2)
+
+
+class JsonRow(BaseModel):
+    __tablename__ = 'export_json_test'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    extra: Mapped[dict] = mapped_column(JSON, nullable=True)
+
+
+def create_app() -> FastAPI:
+    base_view.base_router = APIRouter()
+    ExportView("/export")
+    app = FastAPI()
+    app.include_router(base_view.base_router)
+    app.add_middleware(RequestLogMiddleware)
+    return app
+
+
+async def call(app: FastAPI, path: str, query_string: str = "", headers: list = None):
+    scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(),
+             "query_string": query_string.encode(), "headers": headers or [], "http_version": "1.1",
+             "scheme": "http", "server": ("testserver", 80), "client": ("testclient", 50000), "root_path": ""}
+    response = {"status": None, "headers": {}, "body": b""}
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode(): v.decode() for k, v in message["headers"]}
+        else:
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response
+
+
+class TestStreaming:
+
+    def setup_class(self):
+        Base.metadata.create_all(bind=engine_sync, tables=[ExportRow.__table__, JsonRow.__table__])
+        with engine_sync.begin() as connection:
+            connection.execute(delete(ExportRow))
+            connection.execute(insert(ExportRow), [{"name": f"row{i}", "score": i} for i in range(5)])
+            connection.execute(delete(JsonRow))
+            connection.execute(insert(JsonRow), [{"extra": None}, {"extra": None}, {"extra": {"a": [1, "中"]}}])
+        self.app = create_app()
+
+    async def test_csv(self):
+        response = await call(self.app, "/export")
+        assert response["status"] == 200
+        assert response["headers"]["content-type"].startswith("text/csv")
+        lines = response["body"].decode().splitlines()
+        assert lines == ["name,score"] + [f"row{i},{i}" for i in range(5)]
+
+    async def test_empty_csv_has_header(self):
+        response = await call(self.app, "/export", "min_score=100")
+        assert response["body"].decode().splitlines() == ["name,score"]
+
+    async def test_gzip_negotiated(self):
+        accepted = await call(self.app, "/export", "compress=true", [(b"accept-encoding", b"gzip, br")])
+        assert accepted["headers"]["content-encoding"] == "gzip"
+        assert accepted["headers"]["vary"] == "Accept-Encoding"
+        assert gzip.decompress(accepted["body"]).decode().splitlines()[1] == "row0,0"
+
+        refused = await call(self.app, "/export", "compress=true")
+        assert "content-encoding" not in refused["headers"]
+        assert refused["headers"]["vary"] == "Accept-Encoding"
+        assert refused["body"].decode().splitlines()[1] == "row0,0"
+
+        for accept_encoding in (b"gzip;q=0, identity", b"br, *;q=0", b"deflate"):
+            refused = await call(self.app, "/export", "compress=true", [(b"accept-encoding", accept_encoding)])
+            assert "content-encoding" not in refused["headers"], accept_encoding
+            assert refused["body"].decode().splitlines()[1] == "row0,0"
+
+        for accept_encoding in (b"GZIP;q=0.5", b"br;q=1, *", b"x-gzip"):
+            accepted = await call(self.app, "/export", "compress=true", [(b"accept-encoding", accept_encoding)])
+            assert accepted["headers"]["content-encoding"] == "gzip", accept_encoding
+
+    async def test_arrow_ipc(self):
+        response = await call(self.app, "/export", "format=arrow")
+        assert response["headers"]["content-type"] == "application/vnd.apache.arrow.stream"
+        table = pa.ipc.open_stream(response["body"]).read_all()
+        assert table.column_names == ["name", "score"]
+        assert table.schema.field("score").type == pa.int64()
+        assert table.column("name").to_pylist() == [f"row{i}" for i in range(5)]
+
+    async def test_empty_arrow_ipc_has_schema(self):
+        response = await call(self.app, "/export", "format=arrow&min_score=100")
+        table = pa.ipc.open_stream(response["body"]).read_all()
+        assert table.num_rows == 0
+        assert table.schema.names == ["name", "score"]
+        assert table.schema.field("name").type == pa.string()
+
+    async def test_to_arrow(self):
+        table = ExportRow.objects.filter(ExportRow.score >= 3).with_columns("name", "score").to_arrow(batch_size=1)
+        assert table.to_pydict() == {"name": ["row3", "row4"], "score": [3, 4]}
+        table = await ExportRow.objects.filter(ExportRow.score >= 100).ato_arrow()
+        assert table.num_rows == 0
+        assert "name" in table.schema.names
+
+    async def test_json_column_null_first_batch(self):
+        # 第一批全是 NULL 时 schema 也不能定成 null 类型, JSON 按字符串导出
+        table = JsonRow.objects.filter().order_by(JsonRow.id).with_columns("extra").to_arrow(batch_size=1)
+        assert table.schema.field("extra").type == pa.string()
+        assert table.column("extra").to_pylist() == [None, None, '{"a": [1, "中"]}']
+
+        stream = io.BytesIO()
+        assert JsonRow.objects.filter().order_by(JsonRow.id).with_columns("extra").to_parquet(stream, batch_size=2) == 3
+
+    async def test_to_parquet(self):
+        stream = io.BytesIO()
+        written = ExportRow.objects.filter().with_columns("name", "score").to_parquet(stream, batch_size=2)
+        assert written == 5
+        table = pq.read_table(io.BytesIO(stream.getvalue()))
+        assert table.column("score").to_pylist() == list(range(5))
+
+        stream = io.BytesIO()
+        written = await ExportRow.objects.filter(ExportRow.score >= 100).with_columns("name").ato_parquet(stream)
+        assert written == 0
+        table = pq.read_table(io.BytesIO(stream.getvalue()))
+        assert table.num_rows == 0 and table.schema.names == ["name"]
+
+    async def run(self):
+        self.setup_class()
+        for func in self.__dir__():
+            if func.startswith("test"):
+                g.session_sync = session_maker_sync()
+                g.session = session_maker()
+                try:
+                    await getattr(self, func)()
+                finally:
+                    g.session_sync.close()
+                    await g.session.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(TestStreaming().run())
@@ -0,0 +1,77 @@
+# -- coding: utf-8 --
+# @Time : 2026/10/20 10:30
+# @Author : PinBar
+# @File : test_write_buffer.py
+"""
+Rows queued with ``a_buffered_create`` are stored as given.
+
+    python tests/test_write_buffer.py
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from sqlalchemy import String, Integer, delete, select
+from sqlalchemy.orm import Mapped, mapped_column
+
+from dao.base.write_buffer import WriteBehindBuffer, get_write_buffer
+from db.database import engine_sync
+from models.base import BaseModel, Base
+
+
+class EventLog(BaseModel):
+    __tablename__ = 'event_log_test'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String(32), nullable=False, unique=True)
+    email: Mapped[str] = mapped_column(String(32), nullable=True)
+    level: Mapped[int] = mapped_column(Integer, nullable=True)
+
+
+def stored_rows() -> dict:
+    with engine_sync.connect() as connection:
+        rows = connection.execute(select(EventLog.name, EventLog.email, EventLog.level)).all()
+    return {name: (email, level) for name, email, level in rows}
+
+
+class TestWriteBuffer:
+
+    def setup_class(self):
+        Base.metadata.create_all(bind=engine_sync, tables=[EventLog.__table__])
+
+    def clear(self):
+        with engine_sync.begin() as connection:
+            connection.execute(delete(EventLog))
+
+    async def test_different_key_sets(self):
+        self.clear()
+        await EventLog.objects.a_buffered_create(name="a")
+        await EventLog.objects.a_buffered_create(name="b", email="x@y")
+        await EventLog.objects.a_buffered_create(name="c", level=3)
+        await EventLog.objects.a_buffered_create(name="d", email="d@y", level=4)
+        buffer = get_write_buffer(EventLog)
+        await buffer.close()
+        assert stored_rows() == {"a": (None, None), "b": ("x@y", None), "c": (None, 3), "d": ("d@y", 4)}
+        assert buffer.flushed_rows == 4 and buffer.failed_rows == 0
+
+    async def test_failed_rows_isolated(self):
+        self.clear()
+        buffer = WriteBehindBuffer(EventLog, flush_interval=0.01, max_retries=1)
+        for name in ("ok1", "dup", "dup", "ok2"):
+            await buffer.put(name=name)
+        await buffer.close()
+        # 唯一键冲突让整批失败, 重试后逐行插入, 只丢弃冲突的那一行
+        assert set(stored_rows()) == {"ok1", "dup", "ok2"}
+        assert buffer.flushed_rows == 3 and buffer.failed_rows == 1
+
+    async def run(self):
+        self.setup_class()
+        for func in self.__dir__():
+            if func.startswith("test"):
+                await getattr(self, func)()
+
+
+if __name__ == '__main__':
+    asyncio.run(TestWriteBuffer().run())
@@ -34,6 +34,10 @@ setup(
     include_package_data=True,
     exclude_package_data={'': ['*.pyc', '__pycache__/*', '*.db']},
     install_requires=parse_requirements('requirements.txt'),
+    extras_require={
+        "arrow": ["pyarrow"],
+        "orjson": ["orjson"],
+    },
     entry_points={
         "console_scripts": [
             "fbuild=fastapi_build.scripts.cli:cli",